@@ -0,0 +1,100 @@
+"""クラスタリングを行う空間（UMAPの2次元の射影 / PCAで削減した埋め込み）による違いを比較する
+
+パイプラインの hierarchical_clustering と同じ処理で、cluster_space が "umap" と "reduced" の場合の
+クラスタリングの実行時間と、evaluate_silhouette_score.py のシルエットスコア（埋め込み空間・UMAP空間）を比較する。
+シルエットスコアの計算は意見数の2乗のメモリを使うため、--max-samples 件を抽出して評価する。
+
+実行方法:
+    python src/compare_cluster_space.py {dataset-id} --cluster-dim 48
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from evaluate_silhouette_score import compute_silhouette, load_vectors
+
+# パイプラインのクラスタリングの処理を使う（パイプラインは broadlistening/pipeline をカレントとして実行される前提）
+PIPELINE_DIR = Path(__file__).resolve().parents[3] / "server" / "broadlistening" / "pipeline"
+sys.path.insert(0, str(PIPELINE_DIR))
+
+from services.clustering import (  # noqa: E402
+    hierarchical_clustering_embeddings,
+    project_embeddings,
+    reduce_dimensions,
+)
+
+
+def load_projection(dataset_path: Path, embeddings, arg_ids):
+    """既存の hierarchical_clusters.csv の座標を埋め込みの順に並べて返す。なければUMAPで射影する"""
+    clusters_path = dataset_path / "hierarchical_clusters.csv"
+    if clusters_path.exists():
+        df = pd.read_csv(clusters_path, dtype={"arg-id": str}).set_index("arg-id")
+        return df.loc[arg_ids, ["x", "y"]].to_numpy()
+    print("hierarchical_clusters.csv がないため、UMAPで射影します")
+    return project_embeddings(embeddings)
+
+
+def infer_cluster_nums(dataset_path: Path):
+    df = pd.read_csv(dataset_path / "hierarchical_clusters.csv")
+    level_columns = sorted([c for c in df.columns if c.startswith("cluster-level-")], key=lambda c: int(c.split("-")[2]))
+    return [int(df[c].nunique()) for c in level_columns]
+
+
+def save_sample(output_path: Path, embeddings, arg_ids, projection, cluster_results, sample_rows):
+    """evaluate_silhouette_score.py で読み込める形式で、抽出した意見の埋め込みとクラスタを保存する"""
+    output_path.mkdir(parents=True, exist_ok=True)
+    sampled_ids = [arg_ids[i] for i in sample_rows]
+    np.save(output_path / "embeddings.npy", np.asarray(embeddings[sample_rows], dtype=np.float32))
+    pd.DataFrame({"arg-id": sampled_ids}).to_csv(output_path / "embeddings_index.csv", index=False)
+    df = pd.DataFrame({"arg-id": sampled_ids, "x": projection[sample_rows, 0], "y": projection[sample_rows, 1]})
+    for level, labels in enumerate(cluster_results.values(), start=1):
+        df[f"cluster-level-{level}-id"] = [f"{level}_{label}" for label in np.asarray(labels)[sample_rows]]
+    df.to_csv(output_path / "hierarchical_clusters.csv", index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クラスタリングを行う空間の比較（実行時間・シルエットスコア）")
+    parser.add_argument("dataset", help="データセットID（inputs/{dataset} にパイプラインの出力を置く）")
+    parser.add_argument("--cluster-nums", type=int, nargs="+", help="省略時は hierarchical_clusters.csv から推定")
+    parser.add_argument("--cluster-dim", type=int, default=48, help="reduced の場合の次元数")
+    parser.add_argument("--max-samples", type=int, default=5000, help="シルエットスコアの評価に使う意見数")
+    args = parser.parse_args()
+
+    dataset_path = Path("inputs") / args.dataset
+    output_dir = Path("outputs") / args.dataset / "cluster_space"
+    embeddings, arg_ids = load_vectors(dataset_path, "embedding")
+    projection = load_projection(dataset_path, embeddings, arg_ids)
+    cluster_nums = args.cluster_nums or infer_cluster_nums(dataset_path)
+    rng = np.random.default_rng(42)
+    sample_rows = np.sort(rng.choice(len(arg_ids), size=min(len(arg_ids), args.max_samples), replace=False))
+
+    summary = []
+    for space in ["umap", "reduced"]:
+        start = time.perf_counter()
+        vectors = projection if space == "umap" else reduce_dimensions(embeddings, args.cluster_dim)
+        cluster_results = hierarchical_clustering_embeddings(vectors, sorted(cluster_nums))
+        elapsed = time.perf_counter() - start
+
+        save_sample(output_dir / space, embeddings, arg_ids, projection, cluster_results, sample_rows)
+        for level in range(1, len(cluster_results) + 1):
+            row = {"cluster_space": space, "level": level, "seconds": elapsed}
+            for source in ["embedding", "umap"]:
+                _, overall_avg, _ = compute_silhouette(output_dir / space, level, source)
+                row[f"silhouette_{source}"] = overall_avg["silhouette"]
+            summary.append(row)
+
+    summary_df = pd.DataFrame(summary)
+    print(summary_df.to_string(index=False, float_format="%.3f"))
+    with open(output_dir / "summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    print(f"出力完了: {output_dir / 'summary.json'}")
+
+
+if __name__ == "__main__":
+    main()
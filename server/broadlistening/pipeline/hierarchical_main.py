@@ -38,6 +38,11 @@ def parse_arguments():
         action="store_true",
         help="Skip the html output.",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process comments appended to the input since the previous run and update the existing report.",
+    )
     return parser.parse_args()
 
 
@@ -54,6 +59,8 @@ def main():
         new_argv.append("-skip-interaction")
     if args.without_html:
         new_argv.append("--without-html")
+    if args.incremental:
+        new_argv.append("--incremental")
 
     config = initialization(new_argv)
 
@@ -5,6 +5,12 @@ import traceback
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from services.clustering_cache import configure_clustering_cache
+from services.embedding_cache import DEFAULT_MAX_BYTES as EMBEDDING_CACHE_MAX_BYTES, configure_embedding_cache
+from services.llm_cache import DEFAULT_MAX_BYTES, configure_llm_cache, get_llm_cache
+from services.progress import write_progress
+from services.rate_limiter import rate_limiter_stats
+
 # serverディレクトリをパスに追加
 current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if current_dir not in sys.path:
@@ -17,10 +23,16 @@ except ImportError:
     LLMPricing = None
 
 PIPELINE_DIR = Path(__file__).parent
+# レポート横断で共有するキャッシュ（LLMレスポンスなど）の保存先
+CACHE_DIR = Path(os.getenv("PIPELINE_CACHE_DIR", PIPELINE_DIR / "cache"))
 
 with open(PIPELINE_DIR / "hierarchical_specs.json") as f:
     specs = json.load(f)
 
+LOCK_DURATION = timedelta(minutes=5)
+# 進捗の更新時、ロックの残り時間がこれより短くなっていれば hierarchical_status.json を書き直してロックを延長する
+LOCK_REFRESH_REMAINING = timedelta(minutes=4)
+
 
 def validate_config(config):
     if "input" not in config:
@@ -94,6 +106,9 @@ def decide_what_to_run(config, previous):
             reason = "forced another step with -o"
         elif config.get("only") == stepname:
             reason = "forced this step with -o"
+        elif config.get("incremental", False):
+            # 差分更新では各ステップが前回の結果を再利用しつつ、追加分のみを処理する
+            reason = "incremental update"
         elif not found_prev:
             reason = "not trace of previous run"
         elif not os.path.exists(PIPELINE_DIR / f"outputs/{config['output_dir']}/{step['filename']}"):
@@ -134,6 +149,8 @@ def initialization(sysargv):
             config["skip-interaction"] = True
         if option == "--without-html":
             config["without-html"] = True
+        if option == "--incremental":
+            config["incremental"] = True
 
     output_dir = config["output_dir"]
 
@@ -188,6 +205,20 @@ def initialization(sysargv):
     if not os.path.exists(PIPELINE_DIR / f"outputs/{output_dir}"):
         os.makedirs(PIPELINE_DIR / f"outputs/{output_dir}")
 
+    # LLMレスポンスキャッシュを有効化（LLM_CACHE_ENABLED=false で無効化）
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() != "false":
+        max_bytes = int(os.getenv("LLM_CACHE_MAX_MB", DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024
+        configure_llm_cache(CACHE_DIR / "llm_responses.sqlite3", max_bytes=max_bytes)
+
+    # 埋め込みキャッシュを有効化（EMBEDDING_CACHE_ENABLED=false で無効化）
+    if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "false":
+        max_bytes = int(os.getenv("EMBEDDING_CACHE_MAX_MB", EMBEDDING_CACHE_MAX_BYTES // (1024 * 1024))) * 1024 * 1024
+        configure_embedding_cache(CACHE_DIR / "embeddings", max_bytes=max_bytes)
+
+    # UMAPの射影・K-meansの結果のキャッシュを有効化（CLUSTERING_CACHE_ENABLED=false で無効化）
+    if os.getenv("CLUSTERING_CACHE_ENABLED", "true").lower() != "false":
+        configure_clustering_cache(CACHE_DIR / "clustering")
+
     # check if user is happy with the plan...
     plan = decide_what_to_run(config, previous)
     if "skip-interaction" not in config:
@@ -223,16 +254,31 @@ def update_status(config, updates):
             del config[key]
         else:
             config[key] = value
-    config["lock_until"] = (datetime.now() + timedelta(minutes=5)).isoformat()
+    config["lock_until"] = (datetime.now() + LOCK_DURATION).isoformat()
     with open(PIPELINE_DIR / f"outputs/{output_dir}/hierarchical_status.json", "w") as file:
         json.dump(config, file, indent=2)
+    write_progress(PIPELINE_DIR / f"outputs/{output_dir}", config)
 
 
 def update_progress(config, incr=None, total=None):
+    """ステップ内の進捗を更新する
+
+    頻繁に呼ばれるため、設定全体を含む hierarchical_status.json は書き直さずに小さな進捗ファイルだけを書き出す。
+    ただし、実行中のロックが切れないよう、残り時間が短くなった場合は hierarchical_status.json も書き直す
+    """
     if total is not None:
-        update_status(config, {"current_job_progress": 0, "current_jop_tasks": total})
+        config["current_job_progress"] = 0
+        config["current_jop_tasks"] = total
     elif incr is not None:
-        update_status(config, {"current_job_progress": config["current_job_progress"] + incr})
+        config["current_job_progress"] = config["current_job_progress"] + incr
+    else:
+        return
+
+    lock_until = config.get("lock_until")
+    if lock_until is None or datetime.fromisoformat(lock_until) - datetime.now() < LOCK_REFRESH_REMAINING:
+        update_status(config, {})
+    else:
+        write_progress(PIPELINE_DIR / f"outputs/{config['output_dir']}", config)
 
 
 def run_step(step, func, config):
@@ -252,6 +298,7 @@ def run_step(step, func, config):
     print("Running step:", step)
     # run the step...
     token_usage_before = config.get("total_token_usage", 0)
+    llm_cache_before = _llm_cache_stats()
     func(config)
     token_usage_after = config.get("total_token_usage", token_usage_before)
     token_usage_step = token_usage_after - token_usage_before
@@ -286,13 +333,28 @@ def run_step(step, func, config):
                     ).total_seconds(),
                     "params": config[step],
                     "token_usage": token_usage_step,  # ステップ毎のトークン使用量を追加
+                    "llm_cache": _llm_cache_step_stats(llm_cache_before, _llm_cache_stats()),
                 }
             ],
             "estimated_cost": estimated_cost,  # 推定コストを追加
+            "llm_cache": _llm_cache_stats(),
+            "rate_limits": rate_limiter_stats(),
         },
     )
 
 
+def _llm_cache_stats():
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else None
+
+
+def _llm_cache_step_stats(before: dict | None, after: dict | None) -> dict | None:
+    """キャッシュの統計はプロセス全体の累計のため、ステップの前後の差分からステップごとの件数を求める"""
+    if before is None or after is None:
+        return None
+    return {key: after[key] - before[key] for key in ("hits", "misses", "evictions")}
+
+
 def termination(config, error=None):
     if "previous" in config:
         # remember all previously completed jobs
@@ -0,0 +1,54 @@
+"""hierarchical_aggregation で、意見と元コメントを対応付けて列の値を取り出す処理
+
+意見ごとにコメント全体を検索すると 意見数×コメント数 の計算量になるため、意見・関係・コメントを
+一度の結合で対応付け、コメントの列からは行番号で値を取り出す。
+意見の属性（args.csv の列）も、行ごとではなく列ごとにまとめて変換する。
+"""
+
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+def match_comment_rows(
+    clusters: pd.DataFrame, comments: pd.DataFrame, relation_df: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    """意見ごとに、対応する元コメントの行番号と、対応するコメントが存在するかを返す
+
+    relation_df で同じ意見が複数回現れる場合は最後の行を、同じcomment-idのコメントが複数ある場合は先頭の行を使う。
+    """
+    num_args = len(clusters)
+    if "comment-id" not in relation_df.columns:
+        return np.zeros(num_args, dtype=np.intp), np.zeros(num_args, dtype=bool)
+
+    relation_df["comment-id"] = relation_df["comment-id"].astype(str)
+    relations = relation_df[["arg-id", "comment-id"]].drop_duplicates("arg-id", keep="last")
+    comment_index = pd.DataFrame(
+        {"comment-id": comments["comment-id"].astype(str), "comment_row": np.arange(len(comments))}
+    ).drop_duplicates("comment-id", keep="first")
+
+    joined = (
+        clusters[["arg-id"]].merge(relations, on="arg-id", how="left").merge(comment_index, on="comment-id", how="left")
+    )
+    has_comment = joined["comment_row"].notna().to_numpy()
+    comment_rows = joined["comment_row"].fillna(0).to_numpy(dtype=np.intp)
+    return comment_rows, has_comment
+
+
+def take_comment_values(column: pd.Series, comment_rows: np.ndarray) -> list[Any]:
+    """コメントの列から意見ごとの値を取り出す。NumPyの数値型はPythonの数値型に変換される"""
+    if len(column) == 0:
+        return [None] * len(comment_rows)
+    return column.to_numpy(dtype=object)[comment_rows].tolist()
+
+
+def property_values(column: pd.Series) -> list[str | None]:
+    """属性の列をJSONに書き出せる値のリストに変換する
+
+    args.csv には意見のテキストなど文字列の列が含まれるため、値はすべて文字列として扱う。
+    LLMによるcategory classificationがうまく行かず、NaNの場合はNoneにする。
+    """
+    values = column.astype(str).to_numpy(dtype=object)
+    values[column.isna().to_numpy()] = None
+    return values.tolist()
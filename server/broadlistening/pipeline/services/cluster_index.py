@@ -0,0 +1,35 @@
+"""クラスタIDから所属する意見の行位置を引く索引
+
+ラベリングのステップでは、クラスタごとに df[df[column] == cluster_id] で意見を絞り込んでいたため、
+階層ごとに「クラスタ数 × 意見数」の比較が必要だった。groupby で各クラスタに所属する行の位置を
+ID列ごとに一度だけ求めておき、クラスタごとの絞り込みは行位置による取り出しにする。
+"""
+
+from collections.abc import Hashable, Iterable
+
+import numpy as np
+import pandas as pd
+
+_EMPTY_POSITIONS = np.array([], dtype=np.intp)
+
+
+class ClusterIndex:
+    """DataFrameのクラスタID列ごとの {クラスタID: 行位置} の索引
+
+    行位置は索引を作成した時点のDataFrameの行の並びに対するもの。列を追加したDataFrameには使えるが、
+    行の並び替え・追加・削除をしたDataFrameには使えない。
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: Iterable[str]):
+        self.num_rows = len(df)
+        # indices の行位置は各クラスタ内で昇順のため、取り出した行は元の並び順のまま
+        self._positions = {column: df.groupby(column, sort=False).indices for column in columns}
+
+    def positions(self, column: str, cluster_id: Hashable) -> np.ndarray:
+        return self._positions[column].get(cluster_id, _EMPTY_POSITIONS)
+
+    def rows(self, df: pd.DataFrame, column: str, cluster_id: Hashable) -> pd.DataFrame:
+        """df[df[column] == cluster_id] と同じ行を返す"""
+        if len(df) != self.num_rows:
+            raise ValueError(f"索引の作成時と行数が異なります（索引: {self.num_rows}行, DataFrame: {len(df)}行）")
+        return df.iloc[self.positions(column, cluster_id)]
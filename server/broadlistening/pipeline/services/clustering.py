@@ -0,0 +1,221 @@
+"""UMAPによる射影と、K-means・クラスタ中心の階層による階層的クラスタリング
+
+hierarchical_clustering ステップの計算部分。最大クラスタ数でK-meansを行い、クラスタ中心の階層（ward法）を
+cluster_nums の各クラスタ数で切って上位の階層を作る。
+意見数が多い場合（大規模データ向けの処理）は、UMAPの前にPCAで次元を削減し、K-meansをMiniBatchKMeansに切り替える。
+"""
+
+from importlib import import_module
+
+import numpy as np
+import scipy.cluster.hierarchy as sch
+import sklearn
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA
+
+from .clustering_cache import array_hash, get_clustering_cache
+
+# large_dataset_mode が "auto" の場合に、大規模データ向けの処理に切り替える意見数
+DEFAULT_LARGE_DATASET_THRESHOLD = 50000
+DEFAULT_PRE_REDUCTION_DIM = 64
+# cluster_space が "reduced" の場合に、クラスタリングに使うPCAの次元数
+DEFAULT_CLUSTER_DIM = 48
+# 大規模データ向けの処理で、PCAの学習に使う意見数の上限とMiniBatchKMeansのバッチサイズ
+PCA_FIT_SAMPLES = 20000
+MINIBATCH_SIZE = 4096
+
+
+def cluster_embeddings(embeddings: np.ndarray, options: dict) -> tuple[np.ndarray, dict[int, np.ndarray]]:
+    """埋め込みを2次元に射影し、階層的にクラスタリングする
+
+    2次元の射影は表示用の座標（x, y）に使う。cluster_space が "reduced" の場合、クラスタリングは射影ではなく
+    PCAで cluster_dim 次元に削減した埋め込みで行う。
+
+    Returns:
+        (2次元の射影, クラスタ数ごとの各意見のラベル)
+    """
+    cluster_space = options.get("cluster_space", "umap")
+    # UMAPの計算に時間がかかるため、設定の誤りは先に検出する
+    if cluster_space not in ("umap", "reduced"):
+        raise ValueError(f"Unknown cluster_space: {cluster_space}")
+
+    large_dataset_mode = use_large_dataset_mode(options, embeddings.shape[0])
+    if large_dataset_mode:
+        print(f"large dataset mode: {embeddings.shape[0]} arguments")
+    umap_embeds = project_embeddings(
+        embeddings,
+        large_dataset_mode=large_dataset_mode,
+        pre_reduction_dim=options.get("pre_reduction_dim") or DEFAULT_PRE_REDUCTION_DIM,
+    )
+
+    if cluster_space == "reduced":
+        cluster_vectors = reduce_dimensions(embeddings, options.get("cluster_dim") or DEFAULT_CLUSTER_DIM)
+    else:
+        cluster_vectors = umap_embeds
+
+    cluster_results = hierarchical_clustering_embeddings(
+        vectors=cluster_vectors,
+        cluster_nums=options["cluster_nums"],
+        use_minibatch=large_dataset_mode,
+    )
+    return umap_embeds, cluster_results
+
+
+def use_large_dataset_mode(options: dict, n_samples: int) -> bool:
+    """大規模データ向けの処理を使うか。large_dataset_mode が "auto" の場合は意見数で判定する"""
+    mode = options.get("large_dataset_mode", "auto")
+    if mode == "auto":
+        return n_samples >= options.get("large_dataset_threshold", DEFAULT_LARGE_DATASET_THRESHOLD)
+    return bool(mode)
+
+
+def project_embeddings(
+    embeddings: np.ndarray, large_dataset_mode: bool = False, pre_reduction_dim: int = DEFAULT_PRE_REDUCTION_DIM
+) -> np.ndarray:
+    """埋め込みをUMAPで2次元に射影する
+
+    大規模データ向けの処理では、先にPCAで pre_reduction_dim 次元に削減し、UMAPの近傍グラフを常に
+    近似最近傍探索（NN-descent）で省メモリに構築する。
+    クラスタリングのキャッシュが有効な場合、同じ埋め込み・パラメータでの射影はキャッシュから返す。
+    """
+    umap_module = import_module("umap")
+
+    n_samples = embeddings.shape[0]
+    # デフォルト設定は15
+    default_n_neighbors = 15
+
+    # テスト等サンプルが少なすぎる場合、n_neighborsの設定値を下げる
+    if n_samples <= default_n_neighbors:
+        n_neighbors = max(2, n_samples - 1)  # 最低2以上
+    else:
+        n_neighbors = default_n_neighbors
+
+    cache = get_clustering_cache()
+    if cache is not None:
+        cache_key = array_hash(
+            embeddings,
+            {
+                "stage": "umap",
+                "n_neighbors": n_neighbors,
+                "large_dataset_mode": large_dataset_mode,
+                "pre_reduction_dim": pre_reduction_dim if large_dataset_mode else None,
+                "umap_version": umap_module.__version__,
+            },
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("use cached UMAP projection")
+            return cached["projection"]
+
+    UMAP = umap_module.UMAP
+    if large_dataset_mode:
+        embeddings = reduce_dimensions(embeddings, pre_reduction_dim)
+        umap_model = UMAP(
+            random_state=42,
+            n_components=2,
+            n_neighbors=n_neighbors,
+            low_memory=True,
+            force_approximation_algorithm=True,
+        )
+    else:
+        umap_model = UMAP(random_state=42, n_components=2, n_neighbors=n_neighbors)
+    # TODO 詳細エラーメッセージを加える
+    # 以下のエラーの場合、おそらく元の意見件数が少なすぎることが原因
+    # TypeError: Cannot use scipy.linalg.eigh for sparse A with k >= N. Use scipy.linalg.eigh(A.toarray()) or reduce k.
+    umap_embeds = umap_model.fit_transform(embeddings)
+    if cache is not None:
+        cache.put(cache_key, projection=umap_embeds)
+    return umap_embeds
+
+
+def reduce_dimensions(embeddings: np.ndarray, n_components: int, chunk_size: int = 10000) -> np.ndarray:
+    """PCAで埋め込みの次元を削減する
+
+    埋め込み全体をメモリ上にコピーしないよう、PCAは最大 PCA_FIT_SAMPLES 件の標本で学習し、
+    変換は chunk_size 件ずつ行う（メモリマップの埋め込みはチャンクごとに読み込まれる）。
+    """
+    n_samples, n_features = embeddings.shape
+    n_components = min(n_components, n_features, n_samples)
+    rng = np.random.default_rng(42)
+    sample_rows = np.sort(rng.choice(n_samples, size=min(n_samples, PCA_FIT_SAMPLES), replace=False))
+    pca = PCA(n_components=n_components, svd_solver="randomized", random_state=42)
+    pca.fit(np.asarray(embeddings[sample_rows], dtype=np.float32))
+
+    reduced = np.empty((n_samples, n_components), dtype=np.float32)
+    for start in range(0, n_samples, chunk_size):
+        reduced[start : start + chunk_size] = pca.transform(np.asarray(embeddings[start : start + chunk_size]))
+    return reduced
+
+
+def merge_clusters_with_hierarchy(
+    kmeans_labels: np.ndarray,
+    linkage_matrix: np.ndarray,
+    n_cluster_cut: int,
+) -> np.ndarray:
+    """K-meansのクラスタ中心の階層（linkage_matrix）を n_cluster_cut 個に切り、各意見のラベルを切った後のクラスタに置き換える"""
+    cluster_labels_merged = sch.fcluster(linkage_matrix, t=n_cluster_cut, criterion="maxclust")
+    return cluster_labels_merged[kmeans_labels]
+
+
+def fit_kmeans(vectors: np.ndarray, n_clusters: int, use_minibatch: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """K-meansで分割し、各意見のラベルとクラスタ中心を返す
+
+    クラスタリングのキャッシュが有効な場合、同じベクトル・クラスタ数での結果はキャッシュから返す。
+    """
+    cache = get_clustering_cache()
+    if cache is not None:
+        cache_key = array_hash(
+            vectors,
+            {
+                "stage": "kmeans",
+                "n_clusters": n_clusters,
+                "use_minibatch": use_minibatch,
+                "sklearn_version": sklearn.__version__,
+            },
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("use cached K-means result")
+            return cached["labels"], cached["centers"]
+
+    if use_minibatch:
+        # 大規模データではミニバッチごとに中心を更新し、全件を繰り返し走査しない
+        kmeans_model = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=MINIBATCH_SIZE, n_init=3)
+    else:
+        kmeans_model = KMeans(n_clusters=n_clusters, random_state=42)
+    kmeans_model.fit(vectors)
+    if cache is not None:
+        cache.put(cache_key, labels=kmeans_model.labels_, centers=kmeans_model.cluster_centers_)
+    return kmeans_model.labels_, kmeans_model.cluster_centers_
+
+
+def hierarchical_clustering_embeddings(
+    vectors,
+    cluster_nums,
+    use_minibatch=False,
+):
+    """vectors（UMAPの射影、または次元削減した埋め込み）を階層的にクラスタリングする"""
+    # 最大分割数でクラスタリングを実施
+    print("start initial clustering")
+    initial_cluster_num = cluster_nums[-1]
+    kmeans_labels, cluster_centers = fit_kmeans(vectors, initial_cluster_num, use_minibatch=use_minibatch)
+    print("end initial clustering")
+
+    results = {}
+    print("start hierarchical clustering")
+    cluster_nums.sort()
+    print(cluster_nums)
+    # クラスタ中心の階層は切る位置によらないため、1回だけ計算してすべての階層で使う
+    linkage_matrix = sch.linkage(cluster_centers, method="ward")
+    for n_cluster_cut in cluster_nums[:-1]:
+        print("n_cluster_cut: ", n_cluster_cut)
+        results[n_cluster_cut] = merge_clusters_with_hierarchy(
+            kmeans_labels=kmeans_labels,
+            linkage_matrix=linkage_matrix,
+            n_cluster_cut=n_cluster_cut,
+        )
+
+    results[initial_cluster_num] = kmeans_labels
+    print("end hierarchical clustering")
+
+    return results
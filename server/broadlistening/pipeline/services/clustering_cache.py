@@ -0,0 +1,98 @@
+"""クラスタリングの中間結果のディスクキャッシュ
+
+hierarchical_clustering のうち、UMAPによる射影と最大クラスタ数でのK-meansは意見数が多いと時間がかかるが、
+cluster_nums の上位の階層（クラスタ中心の階層をどこで切るか）だけを変えた場合は結果が変わらない。
+そこで、それぞれの結果を次のキーで保存し、同じ入力での再実行では計算を省略する。
+
+- UMAPの射影: sha256(埋め込み行列) とUMAPのパラメータ
+- K-meansの結果（各意見のラベルとクラスタ中心）: sha256(射影) と最大クラスタ数・アルゴリズム
+
+1つの結果を1つの .npz ファイルとして保存し、件数が上限を超えた場合は参照が古いものから削除する。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 64
+# 埋め込み行列をハッシュする際に一度に読み込む行数（メモリマップの行列全体をメモリに載せない）
+HASH_CHUNK_ROWS = 10000
+
+
+def array_hash(array: np.ndarray, params: dict[str, Any]) -> str:
+    """行列の内容・形状・型とパラメータから、キャッシュのキーを作る"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"shape": array.shape, "dtype": str(array.dtype), **params}, sort_keys=True).encode())
+    for start in range(0, array.shape[0], HASH_CHUNK_ROWS):
+        digest.update(np.ascontiguousarray(array[start : start + HASH_CHUNK_ROWS]).tobytes())
+    return digest.hexdigest()
+
+
+class ClusteringCache:
+    def __init__(self, directory: str | Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npz"
+
+    def get(self, key: str) -> dict[str, np.ndarray] | None:
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (FileNotFoundError, OSError, ValueError):
+            self.misses += 1
+            return None
+        # 参照された時刻を更新し、削除の対象から外れるようにする
+        os.utime(path)
+        self.hits += 1
+        return arrays
+
+    def put(self, key: str, **arrays: np.ndarray) -> None:
+        path = self._path(key)
+        # 複数のパイプラインが同時に書き込んでも読み込み側が途中のファイルを読まないよう、一時ファイルから置き換える
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self.directory.glob("*.npz"), key=lambda p: p.stat().st_mtime_ns)
+        for path in entries[: max(0, len(entries) - self.max_entries)]:
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_cache: ClusteringCache | None = None
+_cache_lock = threading.Lock()
+
+
+def configure_clustering_cache(directory: str | Path, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+    """プロセス全体で共有するクラスタリングのキャッシュを有効化する"""
+    global _cache
+    with _cache_lock:
+        _cache = ClusteringCache(directory, max_entries=max_entries)
+
+
+def disable_clustering_cache() -> None:
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def get_clustering_cache() -> ClusteringCache | None:
+    """有効化されていなければNone"""
+    with _cache_lock:
+        return _cache
@@ -0,0 +1,155 @@
+"""hierarchical_result.json の意見データを列指向にエンコードした形式
+
+散布図の点数が多いレポートでは、意見ごとのオブジェクト（arg_id, x, y, cluster_ids, attributes）の
+配列がレポートの大部分を占め、転送量とクライアントでのパース時間が大きくなる。
+この形式では、arguments を次のような列ごとの表現に置き換える（それ以外のキーは hierarchical_result.json と同じ）。
+
+- x, y, p: float32 のリトルエンディアンのバイト列を base64 でエンコードした型付き配列
+- cluster_ids: 出現するクラスタIDの辞書と、各意見のクラスタIDの辞書上の位置（int32）。
+  各意見のクラスタIDは codes[offsets[i]:offsets[i + 1]]
+- attributes: 属性ごとに、出現する値の辞書と各意見の値の辞書上の位置（int32、値がない場合は -1）。
+  すべての属性の値がない意見の attributes は null
+- arg_id, argument, url: 文字列の配列
+"""
+
+import base64
+import math
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+import numpy as np
+
+COLUMNAR_RESULT_FILENAME = "hierarchical_result_columnar.json"
+COLUMNAR_FORMAT = "columnar"
+COLUMNAR_VERSION = 1
+
+_NAN_KEY = ("nan",)
+
+
+def encode_typed_array(values: Any, dtype: str) -> dict[str, str]:
+    array = np.asarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {"dtype": dtype, "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_typed_array(encoded: dict[str, str]) -> np.ndarray:
+    dtype = np.dtype(encoded["dtype"]).newbyteorder("<")
+    return np.frombuffer(base64.b64decode(encoded["data"]), dtype=dtype)
+
+
+class DictionaryEncoder:
+    """値を、出現した値の辞書上の位置に置き換える。Noneは-1とする"""
+
+    def __init__(self):
+        self.values: list[Any] = []
+        self._positions: dict[Any, int] = {}
+
+    def encode(self, value: Any) -> int:
+        if value is None:
+            return -1
+        # 1 と 1.0 と True は辞書のキーとして等しいため、型も含めて区別する。NaNは自身と等しくないため別扱い
+        key = _NAN_KEY if isinstance(value, float) and math.isnan(value) else (type(value), value)
+        position = self._positions.get(key)
+        if position is None:
+            position = len(self.values)
+            self._positions[key] = position
+            self.values.append(value)
+        return position
+
+
+class ColumnarArgumentsBuilder:
+    """意見を1件ずつ受け取り、列指向の表現を組み立てる"""
+
+    def __init__(self):
+        self.arg_ids: list[str] = []
+        self.texts: list[str] = []
+        self.urls: list[str | None] = []
+        self.xs: list[float] = []
+        self.ys: list[float] = []
+        self.ps: list[float] = []
+        self.cluster_ids = DictionaryEncoder()
+        self.cluster_codes: list[int] = []
+        self.cluster_offsets: list[int] = [0]
+        self.attributes: dict[str, tuple[DictionaryEncoder, list[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.arg_ids)
+
+    def collect(self, arguments: Iterable[dict]) -> Iterator[dict]:
+        """意見をそのまま返しながら追加する。JsonObjectWriter.write_array と同時に組み立てるために使う"""
+        for argument in arguments:
+            self.add(argument)
+            yield argument
+
+    def add(self, argument: dict) -> None:
+        row = len(self.arg_ids)
+        self.arg_ids.append(argument["arg_id"])
+        self.texts.append(argument["argument"])
+        self.urls.append(argument.get("url"))
+        self.xs.append(argument["x"])
+        self.ys.append(argument["y"])
+        self.ps.append(argument.get("p", 0))
+        self.cluster_codes.extend(self.cluster_ids.encode(cluster_id) for cluster_id in argument["cluster_ids"])
+        self.cluster_offsets.append(len(self.cluster_codes))
+
+        attributes = argument.get("attributes") or {}
+        for name in attributes:
+            if name not in self.attributes:
+                # 途中から現れた属性は、それまでの意見の値をなしとする
+                self.attributes[name] = (DictionaryEncoder(), [-1] * row)
+        for name, (encoder, codes) in self.attributes.items():
+            codes.append(encoder.encode(attributes.get(name)))
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": len(self.arg_ids),
+            "arg_id": self.arg_ids,
+            "argument": self.texts,
+            "url": self.urls,
+            "x": encode_typed_array(self.xs, "float32"),
+            "y": encode_typed_array(self.ys, "float32"),
+            "p": encode_typed_array(self.ps, "float32"),
+            "cluster_ids": {
+                "dictionary": self.cluster_ids.values,
+                "codes": encode_typed_array(self.cluster_codes, "int32"),
+                "offsets": encode_typed_array(self.cluster_offsets, "int32"),
+            },
+            "attributes": {
+                name: {"dictionary": encoder.values, "codes": encode_typed_array(codes, "int32")}
+                for name, (encoder, codes) in self.attributes.items()
+            },
+        }
+
+
+def decode_arguments(columnar: dict[str, Any]) -> list[dict[str, Any]]:
+    """列指向の表現を hierarchical_result.json と同じ意見のリストに戻す（座標はfloat32の精度になる）"""
+    xs = decode_typed_array(columnar["x"]).tolist()
+    ys = decode_typed_array(columnar["y"]).tolist()
+    ps = decode_typed_array(columnar["p"]).tolist()
+    cluster_dictionary = columnar["cluster_ids"]["dictionary"]
+    cluster_codes = decode_typed_array(columnar["cluster_ids"]["codes"]).tolist()
+    cluster_offsets = decode_typed_array(columnar["cluster_ids"]["offsets"]).tolist()
+    attributes = [
+        (name, encoded["dictionary"], decode_typed_array(encoded["codes"]).tolist())
+        for name, encoded in columnar["attributes"].items()
+    ]
+
+    arguments = []
+    for i in range(columnar["count"]):
+        codes = cluster_codes[cluster_offsets[i] : cluster_offsets[i + 1]]
+        attribute_values = {
+            name: dictionary[attr_codes[i]] if attr_codes[i] >= 0 else None
+            for name, dictionary, attr_codes in attributes
+        }
+        arguments.append(
+            {
+                "arg_id": columnar["arg_id"][i],
+                "argument": columnar["argument"][i],
+                "x": xs[i],
+                "y": ys[i],
+                "p": ps[i],
+                "cluster_ids": [cluster_dictionary[code] for code in codes],
+                "attributes": attribute_values if any(v is not None for v in attribute_values.values()) else None,
+                "url": columnar["url"][i],
+            }
+        )
+    return arguments
@@ -0,0 +1,53 @@
+"""埋め込みリクエストのバッチ分割と並列実行
+
+意見を件数・見積もりトークン数の上限に収まるバッチに分け、スレッドプールで並列にリクエストする。
+バッチは完了順ではなく投入順に連結し、返すベクトルの行は常に入力の順になる。
+"""
+
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from .rate_limiter import estimate_tokens
+
+# OpenAI互換APIの1リクエストあたりの入力トークン上限（300,000）に対し、見積もりの誤差を考慮した値
+MAX_TOKENS_PER_REQUEST = 200_000
+
+
+def make_batches(texts: list[str], batch_size: int, max_tokens: int = MAX_TOKENS_PER_REQUEST) -> list[list[str]]:
+    """件数がbatch_size以下、かつ見積もりトークン数がmax_tokens以下になるように分割する
+
+    1件だけでmax_tokensを超える意見は、その1件だけのバッチにする。
+    """
+    batches = []
+    current: list[str] = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def request_in_batches(
+    texts: list[str],
+    request: Callable[[list[str]], list[list[float]]],
+    batch_size: int,
+    workers: int = 1,
+    max_tokens: int = MAX_TOKENS_PER_REQUEST,
+) -> np.ndarray:
+    """バッチごとに request を並列に呼び出し、入力順に並べたベクトル（float32の行列）を返す"""
+    batches = make_batches(texts, batch_size, max_tokens)
+    embeddings = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # mapは完了順ではなく投入順に結果を返すため、そのまま連結すれば入力順になる
+        for embeds in tqdm(executor.map(request, batches), total=len(batches)):
+            embeddings.extend(embeds)
+    return np.asarray(embeddings, dtype=np.float32)
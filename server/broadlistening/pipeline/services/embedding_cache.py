@@ -0,0 +1,289 @@
+"""埋め込みベクトルのディスクキャッシュ
+
+(モデル, sha256(テキスト)) をキーとして埋め込みベクトルを保存し、同じ意見を再度埋め込む際は
+プロバイダーへのリクエストを行わずにキャッシュ済みのベクトルを返す。
+
+モデルごとのディレクトリに、次元数と世代を記録した meta.json、float32の行列を追記していく vectors.f32、
+各行に対応するテキストのハッシュを1行ずつ追記していく index.txt を保存する。
+書き込み途中で停止した場合に備え、読み込み時は両ファイルで揃っている行までを有効とする。
+複数のレポートのパイプラインが同時に追記しても行がずれないよう、追記はファイルロックを取り、
+他のプロセスの追記や途中で停止した書き込みを反映してから、インデックスの行数の位置に行う。
+
+行列の大きさが上限を超えた場合は、古く追記された行を捨てて新しい世代のファイル（vectors.{世代}.f32, index.{世代}.txt）に
+詰め直し、meta.json の世代を書き換えて切り替える。古い世代のファイルを開いている他のプロセスは、
+ファイルが削除されたことを検知して新しい世代を読み込み直す。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windowsではプロセス間のロックを行わない
+    fcntl = None
+
+META_FILENAME = "meta.json"
+VECTORS_FILENAME = "vectors.f32"
+INDEX_FILENAME = "index.txt"
+LOCK_FILENAME = ".lock"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # モデルごとに1GB
+# 上限を超えた場合に残す行列の大きさ（上限に対する割合）。追記のたびに詰め直さないよう、余裕を持たせる
+COMPACTION_RATIO = 0.5
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _data_filenames(generation: int) -> tuple[str, str]:
+    if generation == 0:
+        return VECTORS_FILENAME, INDEX_FILENAME
+    return f"vectors.{generation}.f32", f"index.{generation}.txt"
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class EmbeddingCache:
+    """1つの埋め込みモデルのベクトルを保存するキャッシュ"""
+
+    def __init__(self, directory: str | Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.dim: int | None = None
+        self.generation = 0
+        self._rows: dict[str, int] = {}
+        # 読み込んだ時点のファイルの状態。他のプロセスによる変更の検知に使う
+        self._num_rows = 0
+        self._index_bytes = 0
+        self._lock = threading.Lock()
+        with self._file_lock():
+            self._refresh()
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.directory / _data_filenames(self.generation)[0]
+
+    @property
+    def _index_path(self) -> Path:
+        return self.directory / _data_filenames(self.generation)[1]
+
+    def _read_meta(self) -> dict | None:
+        try:
+            with open(self.directory / META_FILENAME) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self) -> None:
+        meta_path = self.directory / META_FILENAME
+        tmp_path = meta_path.with_name(f"{META_FILENAME}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "generation": self.generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path)
+
+    def _refresh(self) -> None:
+        """他のプロセスによる追記・詰め直しや、途中で停止した書き込みを反映する（ファイルロックを取って呼ぶ）"""
+        meta = self._read_meta()
+        if meta is None:
+            return
+        generation = meta.get("generation", 0)
+        unchanged = (
+            self.dim == meta["dim"]
+            and self.generation == generation
+            and _file_size(self._index_path) == self._index_bytes
+            and _file_size(self._vectors_path) == self._num_rows * self.dim * 4
+        )
+        if unchanged:
+            return
+        self.dim = meta["dim"]
+        self.generation = generation
+        self._load_rows()
+
+    def _load_rows(self) -> None:
+        hashes = []
+        if self._index_path.exists():
+            with open(self._index_path, encoding="utf-8") as f:
+                hashes = [line.rstrip("\n") for line in f]
+        vectors_bytes = _file_size(self._vectors_path)
+        valid_rows = min(len(hashes), vectors_bytes // (self.dim * 4))
+        self._rows = {h: row for row, h in enumerate(hashes[:valid_rows])}
+
+        # 書き込み途中の行は切り詰めて、以降の追記で行番号がずれないようにする
+        if valid_rows < len(hashes):
+            with open(self._index_path, "w", encoding="utf-8") as f:
+                f.writelines(h + "\n" for h in hashes[:valid_rows])
+        if vectors_bytes != valid_rows * self.dim * 4:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(valid_rows * self.dim * 4)
+        self._num_rows = valid_rows
+        self._index_bytes = _file_size(self._index_path)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get_many(self, texts: list[str]) -> tuple[np.ndarray | None, list[int]]:
+        """テキストのベクトルをまとめて取得する
+
+        Returns:
+            (ベクトルの行列, キャッシュに存在しなかったテキストの位置)
+            行列はtextsと同じ行数で、存在しなかった行は0埋めされる。キャッシュが空の場合はNone
+        """
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            try:
+                matrix, missing = self._lookup(hashes)
+            except FileNotFoundError:
+                # 他のプロセスが詰め直し、読み込んでいた世代のファイルが削除された
+                with self._file_lock():
+                    self._refresh()
+                matrix, missing = self._lookup(hashes)
+            self.hits += len(hashes) - len(missing)
+            self.misses += len(missing)
+        return matrix, missing
+
+    def _lookup(self, hashes: list[str]) -> tuple[np.ndarray | None, list[int]]:
+        found = [(i, self._rows[h]) for i, h in enumerate(hashes) if h in self._rows]
+        missing = [i for i, h in enumerate(hashes) if h not in self._rows]
+        if self.dim is None or not found:
+            return None, missing
+        stored = np.memmap(self._vectors_path, dtype=np.float32, mode="r").reshape(-1, self.dim)
+        matrix = np.zeros((len(hashes), self.dim), dtype=np.float32)
+        positions, rows = zip(*found, strict=True)
+        matrix[list(positions)] = stored[list(rows)]
+        return matrix, missing
+
+    def put_many(self, texts: list[str], vectors) -> None:
+        """テキストとベクトルの組を追記する（キャッシュ済みのテキストは無視する）"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        with self._lock, self._file_lock():
+            # 他のプロセスの追記を取り込み、途中で停止した書き込みの行を切り詰めてから追記する
+            self._refresh()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._write_meta()
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {vectors.shape[1]}")
+
+            new_hashes: dict[str, None] = {}
+            new_rows = []
+            for text, vector in zip(texts, vectors, strict=True):
+                h = text_hash(text)
+                if h in self._rows or h in new_hashes:
+                    continue
+                new_hashes[h] = None
+                new_rows.append(vector)
+            if not new_hashes:
+                return
+
+            # 行番号はファイルサイズではなく、インデックスと揃っている行数から求める
+            start = self._num_rows
+            # ベクトルを先に書き込み、インデックスの追記をもって確定とする
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.stack(new_rows).astype(np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.writelines(h + "\n" for h in new_hashes)
+            for offset, h in enumerate(new_hashes):
+                self._rows[h] = start + offset
+            self._num_rows += len(new_hashes)
+            self._index_bytes = _file_size(self._index_path)
+
+            if self._num_rows * self.dim * 4 > self.max_bytes:
+                self._compact()
+
+    def _compact(self) -> None:
+        """古く追記された行を捨てて、新しい世代のファイルに詰め直す（ファイルロックを取って呼ぶ）"""
+        keep = min(self._num_rows, max(1, int(self.max_bytes * COMPACTION_RATIO) // (self.dim * 4)))
+        first = self._num_rows - keep
+        with open(self._index_path, encoding="utf-8") as f:
+            hashes = [line.rstrip("\n") for line in f][first : self._num_rows]
+        stored = np.memmap(self._vectors_path, dtype=np.float32, mode="r").reshape(-1, self.dim)
+
+        old_paths = [self._vectors_path, self._index_path]
+        self.generation += 1
+        with open(self._vectors_path, "wb") as f:
+            f.write(np.ascontiguousarray(stored[first : self._num_rows]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del stored
+        with open(self._index_path, "w", encoding="utf-8") as f:
+            f.writelines(h + "\n" for h in hashes)
+            f.flush()
+            os.fsync(f.fileno())
+        # meta.json の書き換えをもって新しい世代に切り替える
+        self._write_meta()
+        for path in old_paths:
+            path.unlink(missing_ok=True)
+
+        self._rows = {h: row for row, h in enumerate(hashes)}
+        self._num_rows = keep
+        self._index_bytes = _file_size(self._index_path)
+        print(f"Embedding cache compacted: kept {keep} of {first + keep} vectors")
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.directory / LOCK_FILENAME, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._rows)}
+
+
+_root: Path | None = None
+_max_bytes = DEFAULT_MAX_BYTES
+_caches: dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def configure_embedding_cache(root: str | Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+    """プロセス全体で共有する埋め込みキャッシュを有効化する（max_bytes はモデルごとの上限）"""
+    global _root, _max_bytes
+    with _caches_lock:
+        _root = Path(root)
+        _max_bytes = max_bytes
+        _caches.clear()
+
+
+def disable_embedding_cache() -> None:
+    global _root
+    with _caches_lock:
+        _root = None
+        _caches.clear()
+
+
+def get_embedding_cache(model_key: str) -> EmbeddingCache | None:
+    """モデルごとのキャッシュを返す。有効化されていなければNone"""
+    with _caches_lock:
+        if _root is None:
+            return None
+        if model_key not in _caches:
+            # モデル名に含まれる「/」や「:」をディレクトリ名に使える文字に置き換える
+            directory = re.sub(r"[^\w.@-]", "_", model_key)
+            _caches[model_key] = EmbeddingCache(_root / directory, max_bytes=_max_bytes)
+        return _caches[model_key]
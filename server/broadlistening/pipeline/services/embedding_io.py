@@ -0,0 +1,65 @@
+"""埋め込みベクトルの保存形式
+
+埋め込みは float32 の行列（embeddings.npy）と、各行に対応する arg-id（embeddings_index.csv）として保存する。
+npy はメモリマップで読み込めるため、大量の意見でも Python のリストに展開せずにそのまま numpy で扱える。
+以前の形式（arg-id と埋め込みのリストを持つ DataFrame の embeddings.pkl）も読み込める。
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+EMBEDDINGS_FILENAME = "embeddings.npy"
+EMBEDDINGS_INDEX_FILENAME = "embeddings_index.csv"
+LEGACY_EMBEDDINGS_FILENAME = "embeddings.pkl"
+
+
+def save_embeddings(directory: str | Path, arg_ids, vectors) -> None:
+    """埋め込みを保存する。途中で停止しても壊れたファイルが残らないよう、一時ファイルから置き換える"""
+    directory = Path(directory)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(arg_ids) != len(vectors):
+        raise ValueError(f"arg_ids and vectors must have the same length: {len(arg_ids)} != {len(vectors)}")
+
+    tmp_vectors_path = directory / f"{EMBEDDINGS_FILENAME}.tmp"
+    with open(tmp_vectors_path, "wb") as f:
+        np.save(f, vectors)
+    tmp_index_path = directory / f"{EMBEDDINGS_INDEX_FILENAME}.tmp"
+    pd.DataFrame({"arg-id": list(arg_ids)}).to_csv(tmp_index_path, index=False)
+
+    os.replace(tmp_vectors_path, directory / EMBEDDINGS_FILENAME)
+    os.replace(tmp_index_path, directory / EMBEDDINGS_INDEX_FILENAME)
+    # 以前の形式のファイルが残っていると、どちらが最新か分からなくなるため削除する
+    legacy_path = directory / LEGACY_EMBEDDINGS_FILENAME
+    if legacy_path.exists():
+        legacy_path.unlink()
+
+
+def embeddings_exist(directory: str | Path) -> bool:
+    directory = Path(directory)
+    return (directory / EMBEDDINGS_FILENAME).exists() or (directory / LEGACY_EMBEDDINGS_FILENAME).exists()
+
+
+def load_embeddings(directory: str | Path, mmap: bool = True) -> tuple[np.ndarray, list[str]]:
+    """埋め込みの行列と、各行に対応するarg-idのリストを返す
+
+    Args:
+        directory: レポートの出力ディレクトリ
+        mmap: Trueの場合、embeddings.npyをメモリマップ（読み取り専用）で開き、コピーせずに返す
+    """
+    directory = Path(directory)
+    vectors_path = directory / EMBEDDINGS_FILENAME
+    if vectors_path.exists():
+        vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        arg_ids = pd.read_csv(directory / EMBEDDINGS_INDEX_FILENAME, dtype={"arg-id": str})["arg-id"].tolist()
+        return vectors, arg_ids
+
+    legacy_path = directory / LEGACY_EMBEDDINGS_FILENAME
+    if legacy_path.exists():
+        df = pd.read_pickle(legacy_path)
+        vectors = np.asarray(df["embedding"].values.tolist(), dtype=np.float32)
+        return vectors, df["arg-id"].astype(str).tolist()
+
+    raise FileNotFoundError(f"Embeddings not found in {directory}")
@@ -0,0 +1,108 @@
+"""抽出ステップのチェックポイント
+
+抽出結果を1コメントずつJSONLに追記し、途中で停止したパイプラインを再実行した際は抽出済みのコメントを
+LLMに送らずに復元する。1行目はヘッダ（抽出結果に影響する設定のfingerprint）、2行目以降は1コメント分の
+抽出結果で、コメント本文のハッシュを含む。同じslugで入力CSVを差し替えた場合に古い抽出結果を使わないよう、
+復元するのは本文のハッシュが現在の本文と一致するコメントのみとする。
+チェックポイントは args.csv の書き出しが完了したら削除する。
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+CHECKPOINT_FILENAME = "extraction_checkpoint.jsonl"
+
+
+def comment_hash(body) -> str:
+    return hashlib.sha256(str(body).encode("utf-8")).hexdigest()
+
+
+def checkpoint_fingerprint(config: dict) -> str:
+    """抽出結果に影響する設定からチェックポイントの識別子を作る"""
+    params = {
+        "input": config["input"],
+        "provider": config["provider"],
+        "model": config["extraction"]["model"],
+        "prompt": config["extraction"]["prompt"],
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def load_checkpoint(path: str, fingerprint: str, comment_hashes: dict[str, str]) -> dict[str, list[str]]:
+    """チェックポイントから抽出済みの結果を読み込む
+
+    設定が変わってfingerprintが一致しない場合は古いチェックポイントを破棄する。
+    本文のハッシュが comment_hashes（comment-id -> 現在の本文のハッシュ）と一致しないコメントは読み飛ばし、再度抽出する。
+    書き込み途中でクラッシュした場合の壊れた行は読み飛ばす。
+    """
+    if not os.path.exists(path):
+        return {}
+
+    extracted: dict[str, list[str]] = {}
+    stale = 0
+    with open(path, encoding="utf-8") as f:
+        header = f.readline()
+        try:
+            if json.loads(header).get("fingerprint") != fingerprint:
+                raise ValueError("fingerprint mismatch")
+        except (ValueError, AttributeError):
+            print("Extraction settings have changed, discarding the previous checkpoint")
+            os.remove(path)
+            return {}
+
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                logging.warning("Skipping a broken line in the extraction checkpoint")
+                continue
+            comment_id = str(record["comment-id"])
+            if record.get("body-hash") != comment_hashes.get(comment_id):
+                stale += 1
+                continue
+            extracted[comment_id] = record["arguments"]
+    if stale > 0:
+        print(f"Ignoring {stale} checkpointed comments whose body has changed or been removed")
+    return extracted
+
+
+def remove_checkpoint(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class ExtractionCheckpoint:
+    """抽出結果をバッチごとにJSONLへ追記するチェックポイント"""
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._file = None
+
+    def __enter__(self) -> "ExtractionCheckpoint":
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, "a", encoding="utf-8")
+        if is_new:
+            self._file.write(json.dumps({"fingerprint": self.fingerprint}) + "\n")
+            self.commit()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.commit()
+        self._file.close()
+
+    def append(self, comment_id, body_hash: str, arguments: list[str]) -> None:
+        record = {"comment-id": _to_native(comment_id), "body-hash": body_hash, "arguments": arguments}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def commit(self) -> None:
+        """書き込んだ結果をディスクに確実に反映する"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def _to_native(value):
+    # pandasから読み込んだcomment-idはnumpy型の場合があるため、JSONに書ける型に変換する
+    return value.item() if hasattr(value, "item") else value
@@ -0,0 +1,152 @@
+"""抽出ステップのリクエストを並列に実行する作業キュー
+
+同時実行数をworkersに保ったまま、1件完了するたびに次のコメントを投入する。
+1件のリクエストが実行を開始してから item_timeout 秒を超えた場合は打ち切り、MAX_ATTEMPTS回まで再投入する。
+
+実行中のスレッドは止められないため、打ち切ったリクエストはスレッドを占有したまま実行が続く（料金も発生する）。
+スレッドプールには打ち切ったリクエスト用に workers 個の余裕を持たせ、それを使い切っている間は新しいリクエストを
+投入せずに打ち切ったリクエストの完了を待つ。これにより、投入したリクエストがスレッドの空きを待つ間に
+時間切れになることはない。打ち切ったリクエストが後から完了した場合、そのコメントの結果をまだ返していなければ使う。
+"""
+
+import concurrent.futures
+import logging
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+# 1件のリクエストが実行開始からこの秒数を超えた場合は打ち切り、再投入する
+ITEM_TIMEOUT_SECONDS = 30
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class _Attempt:
+    index: int  # inputs内の位置
+    comment_id: Any
+    text: Any
+    attempt: int
+    started: float | None = None  # ワーカーのスレッドで実行を開始した時刻
+
+
+def extract_stream(
+    inputs: list[tuple[Any, Any]],
+    extract_fn: Callable[[Any], Any],
+    workers: int,
+    config: dict | None = None,
+    item_timeout: float = ITEM_TIMEOUT_SECONDS,
+) -> Iterator[tuple[Any, list[str] | None]]:
+    """コメントを並列に抽出し、完了した順に (comment_id, 抽出結果) を返す
+
+    失敗・タイムアウトしたコメントはMAX_ATTEMPTS回まで再投入し、それでも失敗した場合は抽出結果をNoneとする。
+
+    Args:
+        inputs: (comment_id, コメント本文) のリスト
+        extract_fn: コメント本文から (抽出結果, 入力トークン数, 出力トークン数, 合計トークン数) または抽出結果を返す関数
+        config: 指定した場合、トークン使用量（結果を受け取るたび）とリクエストのレイテンシ（終了時）を記録する
+    """
+    queue = deque(_Attempt(index, comment_id, text, 1) for index, (comment_id, text) in enumerate(inputs))
+    in_flight: dict[concurrent.futures.Future, _Attempt] = {}
+    # 打ち切ったがスレッドで実行が続いているリクエスト
+    abandoned: dict[concurrent.futures.Future, _Attempt] = {}
+    finished: set[int] = set()  # 結果（失敗を含む）を返したinputsの位置
+    latencies = []
+    totals = {"input": 0, "output": 0, "total": 0}
+
+    def run(attempt: _Attempt):
+        attempt.started = time.monotonic()
+        return extract_fn(attempt.text)
+
+    def record_tokens(result):
+        if not (isinstance(result, tuple) and len(result) == 4):
+            return result
+        items, token_input, token_output, token_total = result
+        totals["input"] += token_input
+        totals["output"] += token_output
+        totals["total"] += token_total
+        # 進捗ファイルに途中のトークン使用量が反映されるよう、1件ごとにconfigへ加算する
+        # 打ち切ったリクエストや結果を使わなかったリクエストも課金されるため含める
+        if config is not None:
+            config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
+            config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
+            config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
+        return items
+
+    def retry_or_give_up(attempt: _Attempt) -> bool:
+        if attempt.attempt < MAX_ATTEMPTS:
+            queue.append(_Attempt(attempt.index, attempt.comment_id, attempt.text, attempt.attempt + 1))
+            return False
+        logging.error(f"Giving up extraction of comment {attempt.comment_id} after {attempt.attempt} attempts")
+        finished.add(attempt.index)
+        return True
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers * 2)
+    try:
+        while queue or in_flight:
+            # 打ち切ったリクエストが占有しているスレッドを除き、空いているスレッドがある場合のみ投入する
+            while queue and len(in_flight) < workers and len(in_flight) + len(abandoned) < workers * 2:
+                attempt = queue.popleft()
+                if attempt.index in finished:
+                    continue
+                in_flight[executor.submit(run, attempt)] = attempt
+            if not in_flight and not abandoned:
+                continue
+
+            started = [attempt.started for attempt in in_flight.values() if attempt.started is not None]
+            timeout = max(0.0, min(started) + item_timeout - time.monotonic()) if started else item_timeout
+            done, _ = concurrent.futures.wait(
+                [*in_flight, *abandoned],
+                # スレッドをすべて打ち切ったリクエストが占有している場合は、いずれかが完了するまで待つ
+                timeout=timeout if in_flight else None,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            now = time.monotonic()
+
+            for future in done:
+                was_abandoned = future in abandoned
+                attempt = abandoned.pop(future) if was_abandoned else in_flight.pop(future)
+                try:
+                    items = record_tokens(future.result())
+                except Exception as e:
+                    logging.error(f"Extraction of comment {attempt.comment_id} failed with error: {e}")
+                    # 打ち切ったリクエストは打ち切った時点で再投入済み
+                    if not was_abandoned and attempt.index not in finished and retry_or_give_up(attempt):
+                        yield attempt.comment_id, None
+                    continue
+                if attempt.index in finished:
+                    continue
+                finished.add(attempt.index)
+                latencies.append(now - attempt.started)
+                yield attempt.comment_id, items
+
+            for future, attempt in list(in_flight.items()):
+                if attempt.started is None or now - attempt.started < item_timeout:
+                    continue
+                del in_flight[future]
+                abandoned[future] = attempt
+                logging.warning(f"Extraction of comment {attempt.comment_id} timed out (attempt {attempt.attempt})")
+                if attempt.index not in finished and retry_or_give_up(attempt):
+                    yield attempt.comment_id, None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if config is not None:
+            config["extraction_latency"] = _latency_stats(latencies)
+        print(f"Extraction: input={totals['input']}, output={totals['output']}, total={totals['total']} tokens")
+
+
+def _latency_stats(latencies: list[float]) -> dict[str, float] | None:
+    """リクエストのレイテンシ（秒）の統計値"""
+    if not latencies:
+        return None
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {
+        "count": len(latencies),
+        "mean": round(float(np.mean(latencies)), 3),
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "max": round(float(np.max(latencies)), 3),
+    }
@@ -0,0 +1,179 @@
+"""差分更新（--incremental）モードで各ステップが共有する処理
+
+差分更新では、入力CSVに追加されたコメントのみを抽出・埋め込みし、既存のクラスタ中心に割り当てる。
+ラベリングは、所属する意見が閾値を超えて変化したクラスタのみやり直す。
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# 差分更新の直前のクラスタリング結果。ラベリングステップでクラスタの変化量を計算するために使う
+PREVIOUS_CLUSTERS_FILENAME = "hierarchical_clusters.previous.csv"
+# 差分更新で追加された意見の座標を求める際に参照する近傍の意見数
+INCREMENTAL_N_NEIGHBORS = 15
+# 前回から変わっていた場合は、既存のクラスタに割り当てずに全体を再計算するクラスタリングの設定
+# （cluster_nums は前回の結果の各階層のクラスタ数と比べる）
+CLUSTERING_OPTIONS = (
+    "large_dataset_mode",
+    "large_dataset_threshold",
+    "pre_reduction_dim",
+    "cluster_space",
+    "cluster_dim",
+)
+
+
+def is_incremental(config: dict) -> bool:
+    return bool(config.get("incremental", False))
+
+
+def load_previous_clusters(dataset: str) -> pd.DataFrame | None:
+    """差分更新前のクラスタリング結果を読み込む。全体再計算した場合は存在しないためNone"""
+    path = f"outputs/{dataset}/{PREVIOUS_CLUSTERS_FILENAME}"
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path)
+
+
+def is_compatible_clusters(previous_df: pd.DataFrame, cluster_nums: list[int]) -> bool:
+    """前回のクラスタリング結果が現在のクラスタ数の設定と一致するか
+
+    最下層だけでなく、各階層のクラスタ数がそれぞれ cluster_nums（昇順）と一致する場合のみ互換とする。
+    """
+    level_columns = sorted(
+        [c for c in previous_df.columns if c.startswith("cluster-level-")],
+        key=lambda c: int(c.split("-")[2]),
+    )
+    return [previous_df[c].nunique() for c in level_columns] == sorted(cluster_nums)
+
+
+def previous_step_params(config: dict, step: str) -> dict | None:
+    """前回の実行でステップが完了した際の設定。前回の実行が失敗していた場合は、さらに前の実行までたどる"""
+    previous = config.get("previous") or None
+    while previous and previous.get("previous") is not None:
+        previous = previous["previous"]
+    if not previous:
+        return None
+    jobs = previous.get("completed_jobs", []) + previous.get("previously_completed_jobs", [])
+    return next((job["params"] for job in jobs if job["step"] == step), None)
+
+
+def incremental_clustering_fallback_reason(
+    previous_df: pd.DataFrame, options: dict, previous_options: dict | None
+) -> str | None:
+    """前回のクラスタに割り当てられない場合に、全体を再計算する理由を返す。割り当てられる場合はNone
+
+    追加された意見は2次元の座標（x, y）で最も近いクラスタに割り当てるため、クラスタリングも2次元の射影で
+    行っていて（cluster_space が "umap"）、クラスタリングの設定が前回から変わっていない場合のみ割り当てる。
+    """
+    if options.get("cluster_space", "umap") != "umap":
+        return f"cluster_space is {options['cluster_space']}, clusters cannot be assigned on the 2D projection"
+    if previous_options is None:
+        return "previous clustering options are unknown"
+    changed = [key for key in CLUSTERING_OPTIONS if previous_options.get(key) != options.get(key)]
+    if changed:
+        return "clustering options changed from previous run: " + ", ".join(changed)
+    if not is_compatible_clusters(previous_df, options["cluster_nums"]):
+        return "cluster_nums changed from previous run"
+    return None
+
+
+def assign_to_existing_clusters(
+    previous_df: pd.DataFrame,
+    arguments_df: pd.DataFrame,
+    embeddings: np.ndarray,
+    embedding_arg_ids: list[str],
+) -> pd.DataFrame:
+    """前回のクラスタ構造を維持したまま、追加された意見を既存のクラスタに割り当てる
+
+    UMAPモデルは保存していないため、追加された意見の2次元座標は、埋め込みのコサイン類似度が
+    高い既存の意見の座標を類似度で重み付け平均して求める。その座標から最も近い最下層の
+    クラスタ中心に割り当て、上位の階層は最下層のクラスタの親をそのまま引き継ぐ。
+    削除された意見は結果から取り除く。
+    """
+    level_columns = sorted(
+        [c for c in previous_df.columns if c.startswith("cluster-level-")],
+        key=lambda c: int(c.split("-")[2]),
+    )
+    bottom_column = level_columns[-1]
+
+    current_ids = set(arguments_df["arg-id"])
+    kept_df = previous_df[previous_df["arg-id"].isin(current_ids)]
+    new_arguments = arguments_df[~arguments_df["arg-id"].isin(set(previous_df["arg-id"]))]
+    print(
+        f"incremental clustering: keep {len(kept_df)}, add {len(new_arguments)}, remove {len(previous_df) - len(kept_df)}"
+    )
+    if new_arguments.empty:
+        return kept_df.reset_index(drop=True)
+
+    rows = {arg_id: row for row, arg_id in enumerate(embedding_arg_ids)}
+    known = previous_df[previous_df["arg-id"].isin(rows.keys())]
+    known_vectors = _normalize(embeddings[[rows[arg_id] for arg_id in known["arg-id"]]])
+    new_vectors = _normalize(embeddings[[rows[arg_id] for arg_id in new_arguments["arg-id"]]])
+    known_xy = known[["x", "y"]].to_numpy()
+
+    k = min(INCREMENTAL_N_NEIGHBORS, len(known))
+    new_xy = np.empty((len(new_arguments), 2))
+    chunk_size = 1000
+    for start in range(0, len(new_vectors), chunk_size):
+        similarities = new_vectors[start : start + chunk_size] @ known_vectors.T
+        neighbors = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        weights = np.clip(np.take_along_axis(similarities, neighbors, axis=1), 0, None) + 1e-6
+        new_xy[start : start + chunk_size] = (known_xy[neighbors] * weights[..., None]).sum(axis=1) / weights.sum(
+            axis=1, keepdims=True
+        )
+
+    # 最下層のクラスタ中心と、各クラスタが属する上位階層のクラスタ
+    centroids = previous_df.groupby(bottom_column)[["x", "y"]].mean()
+    parents = previous_df.groupby(bottom_column)[level_columns[:-1]].first()
+    distances = ((new_xy[:, None, :] - centroids.to_numpy()[None, :, :]) ** 2).sum(axis=2)
+    assigned = centroids.index[distances.argmin(axis=1)]
+
+    new_df = pd.DataFrame(
+        {
+            "arg-id": new_arguments["arg-id"].to_numpy(),
+            "argument": new_arguments["argument"].to_numpy(),
+            "x": new_xy[:, 0],
+            "y": new_xy[:, 1],
+        }
+    )
+    for column in level_columns[:-1]:
+        new_df[column] = parents.loc[assigned, column].to_numpy()
+    new_df[bottom_column] = np.asarray(assigned)
+
+    return pd.concat([kept_df, new_df[kept_df.columns]], ignore_index=True)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def find_changed_clusters(
+    previous: pd.DataFrame,
+    current: pd.DataFrame,
+    id_column: str,
+    threshold: float,
+) -> set[str]:
+    """所属する意見の変化率が閾値を超えたクラスタIDを返す
+
+    変化率は「追加・削除された意見数 / 変更前の意見数」で計算する。
+    変更前に存在しなかったクラスタは常に変化ありとして扱う。
+    """
+    if id_column not in previous.columns:
+        return set(current[id_column].astype(str).unique())
+
+    previous_members = previous.groupby(id_column)["arg-id"].agg(set)
+    current_members = current.groupby(id_column)["arg-id"].agg(set)
+
+    changed = set()
+    for cluster_id, members in current_members.items():
+        before = previous_members.get(cluster_id)
+        if before is None:
+            changed.add(str(cluster_id))
+            continue
+        change_ratio = len(members ^ before) / max(len(before), 1)
+        if change_ratio > threshold:
+            changed.add(str(cluster_id))
+    return changed
@@ -0,0 +1,83 @@
+"""大きなJSONファイルを逐次書き出すためのライター
+
+hierarchical_result.json のように意見の配列が大きいJSONを、結果全体をメモリ上に組み立てずに
+要素ごとに書き出す。NumPyの型は json の default で変換するため、事前にデータ全体をコピーして
+Pythonの型に変換する必要はない。
+"""
+
+import json
+from collections.abc import Iterable
+from typing import Any, TextIO
+
+import numpy as np
+
+
+def json_default(obj: Any) -> Any:
+    """json.dump の default として、NumPyの型をPythonの型に変換する"""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonObjectWriter:
+    """トップレベルがオブジェクトのJSONを、キーごとに書き出す
+
+    indent を指定した場合は json.dump(obj, f, indent=indent) と同じ形式で、None の場合は空白を含まない形式で書き出す。
+
+    Example:
+        with open(path, "w", encoding="utf-8") as f:
+            writer = JsonObjectWriter(f, indent=2)
+            writer.write_array("arguments", iter_arguments())
+            writer.write("overview", overview)
+            writer.close()
+    """
+
+    def __init__(self, file: TextIO, indent: int | None = 2):
+        self._file = file
+        self._indent = indent
+        self._has_keys = False
+        separators = (",", ": ") if indent is not None else (",", ":")
+        self._encoder = json.JSONEncoder(ensure_ascii=False, indent=indent, separators=separators, default=json_default)
+        self._key_separator = separators[1]
+        self._file.write("{")
+
+    def _newline(self, level: int) -> str:
+        if self._indent is None:
+            return ""
+        return "\n" + " " * (self._indent * level)
+
+    def _encode(self, value: Any, level: int) -> str:
+        text = self._encoder.encode(value)
+        if self._indent is None:
+            return text
+        # 文字列中の改行は \n にエスケープされるため、ここでの改行はすべてインデントによるもの
+        return text.replace("\n", self._newline(level))
+
+    def _write_key(self, key: str) -> None:
+        separator = "," if self._has_keys else ""
+        self._file.write(separator + self._newline(1) + self._encoder.encode(key) + self._key_separator)
+        self._has_keys = True
+
+    def write(self, key: str, value: Any) -> None:
+        self._write_key(key)
+        self._file.write(self._encode(value, 1))
+
+    def write_array(self, key: str, items: Iterable[Any]) -> None:
+        """イテラブルの要素を1つずつ書き出す。ジェネレーターを渡せば、配列全体を保持せずに書き出せる"""
+        self._write_key(key)
+        self._file.write("[")
+        is_empty = True
+        for item in items:
+            self._file.write(("" if is_empty else ",") + self._newline(2) + self._encode(item, 2))
+            is_empty = False
+        self._file.write("]" if is_empty else self._newline(1) + "]")
+
+    def close(self) -> None:
+        """オブジェクトを閉じる（ファイル自体は閉じない）"""
+        self._file.write(self._newline(0) + "}" if self._has_keys else "}")
@@ -1,16 +1,23 @@
+import asyncio
+import concurrent.futures
 import logging
 import os
 import random
 import threading
 import time
+import weakref
+from collections import OrderedDict
 from typing import Any
 
 import openai
 from dotenv import load_dotenv
-from openai import AzureOpenAI, OpenAI
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
 from pydantic import BaseModel
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
+from .llm_cache import get_llm_cache
+from .rate_limiter import estimate_tokens, get_rate_limiter
+
 try:  # Optional dependency
     import google.generativeai as genai
     from google.api_core import exceptions as google_exceptions
@@ -21,6 +28,117 @@ except ModuleNotFoundError:  # pragma: no cover - library might be unavailable i
 DOTENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../../.env"))
 load_dotenv(DOTENV_PATH)
 
+# Geminiの埋め込みは1リクエストあたり100件まで
+GEMINI_EMBED_BATCH_SIZE = 100
+GEMINI_EMBED_WORKERS = 4
+
+# プロバイダー・APIキーごとにクライアントを使い回し、HTTPのkeep-aliveやTLSセッションを再利用する
+CLIENT_POOL_SIZE = 32
+_client_pool: OrderedDict = OrderedDict()
+_client_pool_lock = threading.Lock()
+# 非同期クライアントの接続はイベントループをまたいで使えないため、イベントループごとに保持する
+_async_client_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def _get_client(client_class, **kwargs):
+    """クライアントのクラスとコンストラクタ引数の組ごとに、生成済みのクライアントを返す"""
+    key = (client_class, tuple(sorted(kwargs.items())))
+    with _client_pool_lock:
+        client = _client_pool.get(key)
+        if client is None:
+            client = client_class(**kwargs)
+            _client_pool[key] = client
+            if len(_client_pool) > CLIENT_POOL_SIZE:
+                _client_pool.popitem(last=False)
+        else:
+            _client_pool.move_to_end(key)
+        return client
+
+
+def _get_async_client(client_class, **kwargs):
+    """実行中のイベントループで共有する非同期クライアントを返す"""
+    pool = _async_client_pools.setdefault(asyncio.get_running_loop(), {})
+    key = (client_class, tuple(sorted(kwargs.items())))
+    if key not in pool:
+        pool[key] = client_class(**kwargs)
+    return pool[key]
+
+
+def _local_base_url(address: str) -> str:
+    """ローカルLLMのアドレス（host:port）からOpenAI互換APIのベースURLを作る"""
+    try:
+        if ":" in address:
+            host, port_str = address.split(":")
+            port = int(port_str)
+        else:
+            host = address
+            port = 11434  # デフォルトポート
+    except ValueError:
+        logging.warning(f"Invalid address format: {address}, using default")
+        host = "localhost"
+        port = 11434
+    return f"http://{host}:{port}/v1"
+
+
+def _azure_chat_settings(user_api_key: str | None = None) -> dict[str, str]:
+    azure_endpoint = os.getenv("AZURE_CHATCOMPLETION_ENDPOINT")
+    deployment = os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
+    api_key = user_api_key or os.getenv("AZURE_CHATCOMPLETION_API_KEY")
+    api_version = os.getenv("AZURE_CHATCOMPLETION_VERSION")
+
+    missing_vars = []
+    if not azure_endpoint:
+        missing_vars.append("AZURE_CHATCOMPLETION_ENDPOINT")
+    if not deployment:
+        missing_vars.append("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
+    if not api_key:
+        missing_vars.append("AZURE_CHATCOMPLETION_API_KEY")
+    if not api_version:
+        missing_vars.append("AZURE_CHATCOMPLETION_VERSION")
+
+    if missing_vars:
+        raise RuntimeError(
+            f"Azure OpenAI environment variables not set: {', '.join(missing_vars)}. "
+            f"Note: Use AZURE_CHATCOMPLETION_* variables, not AZURE_OPENAI_*. "
+            f"See .env.example for correct variable names."
+        )
+    return {
+        "azure_endpoint": azure_endpoint,
+        "deployment": deployment,
+        "api_key": api_key,
+        "api_version": api_version,
+    }
+
+
+def _azure_embed_settings(user_api_key: str | None = None) -> dict[str, str]:
+    azure_endpoint = os.getenv("AZURE_EMBEDDING_ENDPOINT")
+    api_key = user_api_key or os.getenv("AZURE_EMBEDDING_API_KEY")
+    api_version = os.getenv("AZURE_EMBEDDING_VERSION")
+    deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME")
+
+    missing_vars = []
+    if not azure_endpoint:
+        missing_vars.append("AZURE_EMBEDDING_ENDPOINT")
+    if not api_key:
+        missing_vars.append("AZURE_EMBEDDING_API_KEY")
+    if not api_version:
+        missing_vars.append("AZURE_EMBEDDING_VERSION")
+    if not deployment:
+        missing_vars.append("AZURE_EMBEDDING_DEPLOYMENT_NAME")
+
+    if missing_vars:
+        raise RuntimeError(
+            f"Azure OpenAI embedding environment variables not set: {', '.join(missing_vars)}. "
+            f"Note: Use AZURE_EMBEDDING_* variables, not AZURE_OPENAI_*. "
+            f"See .env.example for correct variable names."
+        )
+    return {
+        "azure_endpoint": azure_endpoint,
+        "deployment": deployment,
+        "api_key": api_key,
+        "api_version": api_version,
+    }
+
 
 @retry(
     retry=retry_if_exception_type(openai.RateLimitError),
@@ -40,12 +158,14 @@ def request_to_openai(
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
 
-    client = OpenAI(api_key=user_api_key) if user_api_key else OpenAI()
+    client = _get_client(OpenAI, api_key=user_api_key) if user_api_key else _get_client(OpenAI)
 
     try:
         if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
             # Use beta.chat.completions.create for Pydantic BaseModel
-            response = client.beta.chat.completions.parse(
+            response = get_rate_limiter("openai", model).call(
+                client.beta.chat.completions.parse,
+                estimate_tokens(messages),
                 model=model,
                 messages=messages,
                 temperature=0,
@@ -78,7 +198,9 @@ def request_to_openai(
             if response_format:
                 payload["response_format"] = response_format
 
-            response = client.chat.completions.create(**payload)
+            response = get_rate_limiter("openai", model).call(
+                client.chat.completions.create, estimate_tokens(messages), **payload
+            )
 
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
@@ -109,43 +231,27 @@ def request_to_azure_chatcompletion(
     json_schema: dict | type[BaseModel] | None = None,
     user_api_key: str | None = None,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
-    azure_endpoint = os.getenv("AZURE_CHATCOMPLETION_ENDPOINT")
-    deployment = os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
-    api_key = user_api_key or os.getenv("AZURE_CHATCOMPLETION_API_KEY")
-    api_version = os.getenv("AZURE_CHATCOMPLETION_VERSION")
-
-    missing_vars = []
-    if not azure_endpoint:
-        missing_vars.append("AZURE_CHATCOMPLETION_ENDPOINT")
-    if not deployment:
-        missing_vars.append("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
-    if not api_key:
-        missing_vars.append("AZURE_CHATCOMPLETION_API_KEY")
-    if not api_version:
-        missing_vars.append("AZURE_CHATCOMPLETION_VERSION")
-
-    if missing_vars:
-        raise RuntimeError(
-            f"Azure OpenAI environment variables not set: {', '.join(missing_vars)}. "
-            f"Note: Use AZURE_CHATCOMPLETION_* variables, not AZURE_OPENAI_*. "
-            f"See .env.example for correct variable names."
-        )
+    settings = _azure_chat_settings(user_api_key)
+    deployment = settings["deployment"]
 
     token_usage_input = 0  # 入力トークン使用量を追跡する変数
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
 
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
+    client = _get_client(
+        AzureOpenAI,
+        api_version=settings["api_version"],
+        azure_endpoint=settings["azure_endpoint"],
+        api_key=settings["api_key"],
     )
     # Set response format based on parameters
 
     try:
         if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
             # Use beta.chat.completions.create for Pydantic BaseModel (Azure)
-            response = client.beta.chat.completions.parse(
+            response = get_rate_limiter("azure", deployment).call(
+                client.beta.chat.completions.parse,
+                estimate_tokens(messages),
                 model=deployment,
                 messages=messages,
                 temperature=0,
@@ -182,7 +288,9 @@ def request_to_azure_chatcompletion(
             if response_format:
                 payload["response_format"] = response_format
 
-            response = client.chat.completions.create(**payload)
+            response = get_rate_limiter("azure", deployment).call(
+                client.chat.completions.create, estimate_tokens(messages), **payload
+            )
 
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
@@ -201,6 +309,51 @@ def request_to_azure_chatcompletion(
         raise
 
 
+def _gemini_retry_wait(e: Exception, attempt: int, max_retries: int, base_wait: int) -> int:
+    """GeminiのAPIエラーを受けた際の待機時間（秒）を返す。リトライすべきでないエラーの場合は再送出する"""
+    status_code = getattr(e, "code", None)
+    is_rate_limit = (status_code == 429) or isinstance(e, google_exceptions.ResourceExhausted)
+
+    if is_rate_limit:
+        error_message = str(e).lower()
+        if "free tier" in error_message:
+            logging.error(f"Gemini API free tier rate limit exceeded. Stopping immediately. Error: {e}")
+            # パイプラインを停止させるために、例外を再発生させる
+            raise e
+    else:
+        # レート制限以外のAPIエラー
+        logging.error(f"Gemini API error: {e}")
+        raise e
+
+    # --- 以下、有料プラン向けの既存リトライロジック ---
+    retry_delay: int | str | None = getattr(e, "retry_delay", None)
+    response_data = getattr(e, "response", None)
+    if retry_delay is None and isinstance(response_data, dict):
+        retry_delay = response_data.get("error", {}).get("details", [{}])[0].get("metadata", {}).get("retry_delay")
+
+    wait_time: int
+    if isinstance(retry_delay, str) and retry_delay.endswith("s"):
+        retry_delay = retry_delay[:-1]
+    try:
+        wait_time = int(retry_delay) if retry_delay is not None else 0
+    except (TypeError, ValueError):
+        wait_time = 0
+
+    if wait_time <= 0:
+        # ジッターを含む指数バックオフ: base * 2^attempt * (0.5 ~ 1.5)
+        jitter = 0.5 + random.random()  # 0.5 ~ 1.5 の範囲
+        wait_time = min(int(base_wait * (2**attempt) * jitter), 60)
+
+    if attempt >= max_retries - 1:
+        logging.error(
+            f"Gemini API rate limit exceeded repeatedly after {max_retries} attempts. "
+            f"Error: {e}. Free tier allows 15 requests per minute per model. "
+            "Consider upgrading to a paid plan."
+        )
+        raise e
+    return wait_time
+
+
 def request_to_gemini_chatcompletion(
     messages: list[dict],
     model: str = "gemini-2.5-flash",
@@ -299,7 +452,9 @@ def request_to_gemini_chatcompletion(
 
     for attempt in range(max_retries):
         try:
-            response = model_client.generate_content(history, generation_config=generation_config)
+            response = get_rate_limiter("gemini", model).call(
+                model_client.generate_content, estimate_tokens(messages), history, generation_config=generation_config
+            )
             usage = getattr(response, "usage_metadata", None)
             if usage:
                 token_usage_input = getattr(usage, "prompt_token_count", 0) or 0
@@ -355,50 +510,7 @@ def request_to_gemini_chatcompletion(
             logging.error(f"Gemini API bad request error: {e}")
             raise
         except google_exceptions.GoogleAPICallError as e:
-            status_code = getattr(e, "code", None)
-            is_rate_limit = (status_code == 429) or isinstance(e, google_exceptions.ResourceExhausted)
-
-            if is_rate_limit:
-                error_message = str(e).lower()
-                if "free tier" in error_message:
-                    logging.error(
-                        f"Gemini API free tier rate limit exceeded. Stopping immediately. Error: {e}"
-                    )
-                    # パイプラインを停止させるために、例外を再発生させる
-                    raise e
-            else:
-                # レート制限以外のAPIエラー
-                logging.error(f"Gemini API error: {e}")
-                raise
-
-            # --- 以下、有料プラン向けの既存リトライロジック ---
-            retry_delay: int | str | None = getattr(e, "retry_delay", None)
-            response_data = getattr(e, "response", None)
-            if retry_delay is None and isinstance(response_data, dict):
-                retry_delay = (
-                    response_data.get("error", {}).get("details", [{}])[0].get("metadata", {}).get("retry_delay")
-                )
-
-            wait_time: int
-            if isinstance(retry_delay, str) and retry_delay.endswith("s"):
-                retry_delay = retry_delay[:-1]
-            try:
-                wait_time = int(retry_delay) if retry_delay is not None else 0
-            except (TypeError, ValueError):
-                wait_time = 0
-
-            if wait_time <= 0:
-                # ジッターを含む指数バックオフ: base * 2^attempt * (0.5 ~ 1.5)
-                jitter = 0.5 + random.random()  # 0.5 ~ 1.5 の範囲
-                wait_time = min(int(base_wait * (2**attempt) * jitter), 60)
-
-            if attempt >= max_retries - 1:
-                logging.error(
-                    f"Gemini API rate limit exceeded repeatedly after {max_retries} attempts. "
-                    f"Error: {e}. Free tier allows 15 requests per minute per model. "
-                    "Consider upgrading to a paid plan."
-                )
-                raise
+            wait_time = _gemini_retry_wait(e, attempt, max_retries, base_wait)
             logging.info(f"Rate limit hit, retrying after {wait_time} seconds (attempt {attempt + 1}/{max_retries})")
             time.sleep(wait_time)
 
@@ -429,40 +541,17 @@ def request_to_local_llm(
     token_usage_input = 0  # 入力トークン使用量を追跡する変数
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
-    try:
-        if ":" in address:
-            host, port_str = address.split(":")
-            port = int(port_str)
-        else:
-            host = address
-            port = 11434  # デフォルトポート
-    except ValueError:
-        logging.warning(f"Invalid address format: {address}, using default")
-        host = "localhost"
-        port = 11434
-
-    base_url = f"http://{host}:{port}/v1"
+    base_url = _local_base_url(address)
+    response_format = None
 
     try:
-        client = OpenAI(
+        client = _get_client(
+            OpenAI,
             base_url=base_url,
             api_key="not-needed",  # OllamaとLM Studioは認証不要
         )
 
-        response_format = None
-        if is_json:
-            response_format = {"type": "json_object"}
-        if json_schema and isinstance(json_schema, dict):
-            response_format = json_schema
-        if json_schema and isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
-            response_format = {
-                "type": "json_schema",
-                "json_schema": {
-                    "name": json_schema.__name__,
-                    "strict": True,  # ← スキーマ逸脱を弾く
-                    "schema": json_schema.schema(),
-                },
-            }
+        response_format = _local_response_format(is_json, json_schema)
 
         payload = {
             "model": model,
@@ -491,6 +580,25 @@ def request_to_local_llm(
         raise
 
 
+def _local_response_format(is_json: bool, json_schema: dict | type[BaseModel] | None) -> dict | None:
+    """ローカルLLM向けのresponse_format（Pydanticモデルはjson_schema形式に変換する）"""
+    response_format = None
+    if is_json:
+        response_format = {"type": "json_object"}
+    if json_schema and isinstance(json_schema, dict):
+        response_format = json_schema
+    if json_schema and isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": json_schema.__name__,
+                "strict": True,  # ← スキーマ逸脱を弾く
+                "schema": json_schema.schema(),
+            },
+        }
+    return response_format
+
+
 def request_to_chat_ai(
     messages: list[dict],
     model: str = "gpt-4o",
@@ -519,7 +627,78 @@ def request_to_chat_ai(
         - provider="local": ローカルLLM（OllamaやLM Studio）を使用
         - provider="openrouter": OpenRouter APIを使用（OpenAIやGeminiのモデルにアクセス可能）
         - provider="gemini": Google Gemini APIを使用
+        - LLMレスポンスキャッシュが有効な場合、キャッシュヒット時はトークン使用量0として返す
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return _request_to_provider(messages, model, is_json, json_schema, provider, local_llm_address, user_api_key)
+
+    cache_key = _chat_cache_key(cache, messages, model, is_json, json_schema, provider, local_llm_address)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached, 0, 0, 0
+
+    result = _request_to_provider(messages, model, is_json, json_schema, provider, local_llm_address, user_api_key)
+    cache.set(cache_key, result[0])
+    return result
+
+
+async def request_to_chat_ai_async(
+    messages: list[dict],
+    model: str = "gpt-4o",
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+    provider: str = "openai",
+    local_llm_address: str | None = None,
+    user_api_key: str | None = None,
+) -> tuple[str, int, int, int]:
+    """request_to_chat_ai の非同期版
+
+    イベントループごとに共有する非同期クライアントを使うため、スレッドを増やさずに多数のリクエストを並行して送れる。
+    引数・戻り値・キャッシュの扱いは request_to_chat_ai と同じ。
     """
+    cache = get_llm_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = _chat_cache_key(cache, messages, model, is_json, json_schema, provider, local_llm_address)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, 0, 0, 0
+
+    result = await _request_to_provider_async(
+        messages, model, is_json, json_schema, provider, local_llm_address, user_api_key
+    )
+    if cache is not None:
+        cache.set(cache_key, result[0])
+    return result
+
+
+def _chat_cache_key(cache, messages, model, is_json, json_schema, provider, local_llm_address) -> str:
+    return cache.make_key(
+        provider=_cache_provider_name(provider, local_llm_address),
+        model=os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME") if provider == "azure" else model,
+        messages=messages,
+        json_schema=json_schema,
+        is_json=is_json,
+    )
+
+
+def _cache_provider_name(provider: str, local_llm_address: str | None) -> str:
+    # ローカルLLMはアドレスごとに別のモデルが動いている可能性があるため、アドレスもキーに含める
+    if provider == "local":
+        return f"local@{local_llm_address or 'localhost:11434'}"
+    return provider
+
+
+def _request_to_provider(
+    messages: list[dict],
+    model: str,
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+    local_llm_address: str | None,
+    user_api_key: str | None,
+) -> tuple[str, int, int, int]:
     if provider == "azure":
         return request_to_azure_chatcompletion(messages, is_json, json_schema, user_api_key)
     elif provider == "openai":
@@ -536,6 +715,112 @@ def request_to_chat_ai(
         raise ValueError(f"Unknown provider: {provider}")
 
 
+async def _request_to_provider_async(
+    messages: list[dict],
+    model: str,
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+    local_llm_address: str | None,
+    user_api_key: str | None,
+) -> tuple[str, int, int, int]:
+    if provider == "azure":
+        settings = _azure_chat_settings(user_api_key)
+        client = _get_async_client(
+            AsyncAzureOpenAI,
+            api_version=settings["api_version"],
+            azure_endpoint=settings["azure_endpoint"],
+            api_key=settings["api_key"],
+        )
+        return await _chat_completion_async(
+            "azure", client, settings["deployment"], messages, is_json, json_schema, True
+        )
+    elif provider == "openai":
+        client = (
+            _get_async_client(AsyncOpenAI, api_key=user_api_key) if user_api_key else _get_async_client(AsyncOpenAI)
+        )
+        return await _chat_completion_async(provider, client, model, messages, is_json, json_schema)
+    elif provider == "local":
+        client = _get_async_client(
+            AsyncOpenAI, base_url=_local_base_url(local_llm_address or "localhost:11434"), api_key="not-needed"
+        )
+        return await _chat_completion_async(
+            "local", client, model, messages, False, _local_response_format(is_json, json_schema)
+        )
+    elif provider == "gemini":
+        # google-generativeaiには共有できる非同期クライアントがないため、スレッドで実行する
+        return await asyncio.to_thread(
+            request_to_gemini_chatcompletion, messages, model, is_json, json_schema, user_api_key
+        )
+    elif provider == "openrouter":
+        api_key = user_api_key or os.getenv("OPENROUTER_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENROUTER_API_KEY environment variable is not set")
+        client = _get_async_client(AsyncOpenAI, base_url="https://openrouter.ai/api/v1", api_key=api_key)
+        return await _chat_completion_async(provider, client, model, messages, is_json, json_schema)
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+
+
+@retry(
+    retry=retry_if_exception_type(openai.RateLimitError),
+    wait=wait_exponential(multiplier=3, min=3, max=20),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def _chat_completion_async(
+    provider: str,
+    client: AsyncOpenAI | AsyncAzureOpenAI,
+    model: str,
+    messages: list[dict],
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    parsed_as_dict: bool = False,
+) -> tuple[str, int, int, int]:
+    """OpenAI互換APIへの非同期チャットリクエスト
+
+    Args:
+        provider: レート制限の予算を共有するプロバイダー名
+        parsed_as_dict: Pydanticモデル指定時、パース済みの結果を辞書で返す（Azureの同期版に合わせる）
+    """
+    if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        response = await get_rate_limiter(provider, model).call_async(
+            client.beta.chat.completions.parse,
+            estimate_tokens(messages),
+            model=model,
+            messages=messages,
+            temperature=0,
+            n=1,
+            seed=0,
+            response_format=json_schema,
+            timeout=30,
+        )
+        message = response.choices[0].message
+        content = message.parsed.model_dump() if parsed_as_dict else message.content
+    else:
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0,
+            "n": 1,
+            "seed": 0,
+            "timeout": 30,
+        }
+        if is_json:
+            payload["response_format"] = {"type": "json_object"}
+        if json_schema:  # 両方有効化されていたら、json_schemaを優先
+            payload["response_format"] = json_schema
+        response = await get_rate_limiter(provider, model).call_async(
+            client.chat.completions.create, estimate_tokens(messages), **payload
+        )
+        content = response.choices[0].message.content
+
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return content, 0, 0, 0
+    return content, usage.prompt_tokens or 0, usage.completion_tokens or 0, usage.total_tokens or 0
+
+
 EMBDDING_MODELS = [
     "text-embedding-3-large",
     "text-embedding-3-small",
@@ -561,22 +846,9 @@ def request_to_local_llm_embed(args, model, address="localhost:11434"):
         埋め込みベクトルのリスト
     """
     try:
-        if ":" in address:
-            host, port_str = address.split(":")
-            port = int(port_str)
-        else:
-            host = address
-            port = 11434  # デフォルトポート
-    except ValueError:
-        logging.warning(f"Invalid address format: {address}, using default")
-        host = "localhost"
-        port = 11434
-
-    base_url = f"http://{host}:{port}/v1"
-
-    try:
-        client = OpenAI(
-            base_url=base_url,
+        client = _get_client(
+            OpenAI,
+            base_url=_local_base_url(address),
             api_key="not-needed",  # OllamaとLM Studioは認証不要
         )
 
@@ -596,9 +868,10 @@ def request_to_embed(
     provider="openai",
     local_llm_address: str | None = None,
     user_api_key: str | None = None,
+    local_batch_size: int | None = None,
 ):
     if is_embedded_at_local:
-        return request_to_local_embed(args)
+        return request_to_local_embed(args, batch_size=local_batch_size)
 
     if provider == "azure":
         logging.info("request_to_azure_embed")
@@ -606,8 +879,10 @@ def request_to_embed(
     elif provider == "openai":
         logging.info("request_to_openai_embed")
         _validate_model(model)
-        client = OpenAI(api_key=user_api_key) if user_api_key else OpenAI()
-        response = client.embeddings.create(input=args, model=model)
+        client = _get_client(OpenAI, api_key=user_api_key) if user_api_key else _get_client(OpenAI)
+        response = get_rate_limiter("openai", model).call(
+            client.embeddings.create, estimate_tokens(args), input=args, model=model
+        )
         embeds = [item.embedding for item in response.data]
         return embeds
     elif provider == "gemini":
@@ -627,6 +902,57 @@ def request_to_embed(
         raise ValueError(f"Unknown provider: {provider}")
 
 
+async def request_to_embed_async(
+    args,
+    model,
+    is_embedded_at_local=False,
+    provider="openai",
+    local_llm_address: str | None = None,
+    user_api_key: str | None = None,
+):
+    """request_to_embed の非同期版"""
+    if is_embedded_at_local or provider == "gemini":
+        # ローカルモデルとGeminiは同期APIしかないため、スレッドで実行する
+        return await asyncio.to_thread(
+            request_to_embed, args, model, is_embedded_at_local, provider, local_llm_address, user_api_key
+        )
+
+    if provider == "azure":
+        settings = _azure_embed_settings(user_api_key)
+        client = _get_async_client(
+            AsyncAzureOpenAI,
+            api_version=settings["api_version"],
+            azure_endpoint=settings["azure_endpoint"],
+            api_key=settings["api_key"],
+        )
+        response = await get_rate_limiter("azure", settings["deployment"]).call_async(
+            client.embeddings.create, estimate_tokens(args), input=args, model=settings["deployment"]
+        )
+    elif provider == "openai":
+        _validate_model(model)
+        client = (
+            _get_async_client(AsyncOpenAI, api_key=user_api_key) if user_api_key else _get_async_client(AsyncOpenAI)
+        )
+        response = await get_rate_limiter("openai", model).call_async(
+            client.embeddings.create, estimate_tokens(args), input=args, model=model
+        )
+    elif provider == "openrouter":
+        raise NotImplementedError("OpenRouter embedding support is not implemented yet")
+    elif provider == "local":
+        client = _get_async_client(
+            AsyncOpenAI, base_url=_local_base_url(local_llm_address or "localhost:11434"), api_key="not-needed"
+        )
+        try:
+            response = await client.embeddings.create(input=args, model=model)
+        except Exception as e:
+            logging.error(f"LocalLLM embedding API error: {e}")
+            logging.warning("Falling back to local embedding")
+            return await asyncio.to_thread(request_to_local_embed, args)
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+    return [item.embedding for item in response.data]
+
+
 def extract_embedding_values(response: Any) -> list[float] | None:
     # 1) genai オブジェクト系
     emb_obj = getattr(response, "embedding", None)
@@ -673,7 +999,18 @@ def extract_embedding_values(response: Any) -> list[float] | None:
     return None
 
 
-def request_to_gemini_embed(args, model, user_api_key: str | None = None):
+def request_to_gemini_embed(
+    args,
+    model,
+    user_api_key: str | None = None,
+    batch_size: int = GEMINI_EMBED_BATCH_SIZE,
+    workers: int = GEMINI_EMBED_WORKERS,
+):
+    """Geminiで埋め込みを取得する
+
+    テキストをbatch_size件ずつ1回のembed_contentで送り、複数のバッチは最大workers個を並列に送信する。
+    レート制限エラーはチャットと同じくリトライし、結果は入力順に返す。
+    """
     if genai is None:
         raise RuntimeError("google-generativeai is required for Gemini provider")
 
@@ -686,51 +1023,74 @@ def request_to_gemini_embed(args, model, user_api_key: str | None = None):
     if isinstance(args, str):
         args = [args]
 
-    embeds: list[list[float]] = []
-    for text in args:
-        response = genai.embed_content(model=model, content=text)
-        values = extract_embedding_values(response)
-        if not isinstance(values, list):
-            # ここでキー一覧などをログに残すと調査が楽
-            keys = list(response.keys()) if isinstance(response, dict) else type(response).__name__
-            raise RuntimeError(
-                f"Gemini embedding response did not contain a 'values' list for text: {text[:50]}... (shape={keys})"
-            )
-        embeds.append(values)
+    batches = [args[i : i + batch_size] for i in range(0, len(args), batch_size)]
+    if len(batches) <= 1 or workers <= 1:
+        results = [_request_to_gemini_embed_batch(batch, model) for batch in batches]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            results = list(executor.map(lambda batch: _request_to_gemini_embed_batch(batch, model), batches))
 
-    return embeds
+    return [embed for result in results for embed in result]
 
 
-def request_to_azure_embed(args, model, user_api_key: str | None = None):
-    azure_endpoint = os.getenv("AZURE_EMBEDDING_ENDPOINT")
-    api_key = user_api_key or os.getenv("AZURE_EMBEDDING_API_KEY")
-    api_version = os.getenv("AZURE_EMBEDDING_VERSION")
-    deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME")
+def _request_to_gemini_embed_batch(texts: list[str], model: str) -> list[list[float]]:
+    max_retries = 5
+    base_wait = 8
 
-    missing_vars = []
-    if not azure_endpoint:
-        missing_vars.append("AZURE_EMBEDDING_ENDPOINT")
-    if not api_key:
-        missing_vars.append("AZURE_EMBEDDING_API_KEY")
-    if not api_version:
-        missing_vars.append("AZURE_EMBEDDING_VERSION")
-    if not deployment:
-        missing_vars.append("AZURE_EMBEDDING_DEPLOYMENT_NAME")
+    for attempt in range(max_retries):
+        try:
+            response = get_rate_limiter("gemini", model).call(
+                genai.embed_content, estimate_tokens(texts), model=model, content=texts
+            )
+            break
+        except Exception as e:
+            if google_exceptions is None or not isinstance(e, google_exceptions.GoogleAPICallError):
+                raise
+            wait_time = _gemini_retry_wait(e, attempt, max_retries, base_wait)
+            logging.info(f"Rate limit hit, retrying after {wait_time} seconds (attempt {attempt + 1}/{max_retries})")
+            time.sleep(wait_time)
+    else:  # pragma: no cover - _gemini_retry_wait raises on the last attempt
+        raise RuntimeError("Gemini API call failed after retries")
 
-    if missing_vars:
+    embeds = extract_batch_embedding_values(response)
+    if embeds is None or len(embeds) != len(texts):
+        # ここでキー一覧などをログに残すと調査が楽
+        keys = list(response.keys()) if isinstance(response, dict) else type(response).__name__
         raise RuntimeError(
-            f"Azure OpenAI embedding environment variables not set: {', '.join(missing_vars)}. "
-            f"Note: Use AZURE_EMBEDDING_* variables, not AZURE_OPENAI_*. "
-            f"See .env.example for correct variable names."
+            f"Gemini embedding response did not contain {len(texts)} embeddings "
+            f"for texts starting with: {texts[0][:50]}... (shape={keys})"
         )
+    return embeds
 
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
+
+def extract_batch_embedding_values(response: Any) -> list[list[float]] | None:
+    """バッチで埋め込みを取得した際のレスポンスから、入力順のベクトルのリストを取り出す"""
+    # genai の embed_content はリストを渡すと {"embedding": [[...], [...]]} を返す
+    emb = response.get("embedding") if isinstance(response, dict) else getattr(response, "embedding", None)
+    if isinstance(emb, list) and all(isinstance(v, list) for v in emb):
+        return emb
+
+    # {"embeddings": [{"values": [...]}, ...]} やSDKオブジェクト（response.embeddings[i].values）
+    embeddings = response.get("embeddings") if isinstance(response, dict) else getattr(response, "embeddings", None)
+    if isinstance(embeddings, list):
+        values = [e.get("values") if isinstance(e, dict) else getattr(e, "values", None) for e in embeddings]
+        if all(isinstance(v, list) for v in values):
+            return values
+    return None
+
+
+def request_to_azure_embed(args, model, user_api_key: str | None = None):
+    settings = _azure_embed_settings(user_api_key)
+    client = _get_client(
+        AzureOpenAI,
+        api_version=settings["api_version"],
+        azure_endpoint=settings["azure_endpoint"],
+        api_key=settings["api_key"],
     )
 
-    response = client.embeddings.create(input=args, model=deployment)
+    response = get_rate_limiter("azure", settings["deployment"]).call(
+        client.embeddings.create, estimate_tokens(args), input=args, model=settings["deployment"]
+    )
     return [item.embedding for item in response.data]
 
 
@@ -738,7 +1098,13 @@ __local_emb_model = None
 __local_emb_model_loading_lock = threading.Lock()
 
 
-def request_to_local_embed(args):
+def request_to_local_embed(args, batch_size: int | None = None):
+    """sentence-transformersのモデルで埋め込みを計算する
+
+    Args:
+        args: 埋め込みを計算するテキスト
+        batch_size: encodeで一度に計算する件数。Noneの場合はsentence-transformersの既定値（32）
+    """
     global __local_emb_model
     # memo: モデルを遅延ロード＆キャッシュするために、グローバル変数を使用
 
@@ -750,7 +1116,10 @@ def request_to_local_embed(args):
             model_name = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
             __local_emb_model = SentenceTransformer(model_name)
 
-    result = __local_emb_model.encode(args)
+    if batch_size is None:
+        result = __local_emb_model.encode(args)
+    else:
+        result = __local_emb_model.encode(args, batch_size=batch_size)
     return result.tolist()
 
 
@@ -876,14 +1245,17 @@ def request_to_openrouter_chatcompletion(
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
 
-    client = OpenAI(
+    client = _get_client(
+        OpenAI,
         base_url="https://openrouter.ai/api/v1",
         api_key=api_key,
     )
 
     try:
         if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
-            response = client.beta.chat.completions.parse(
+            response = get_rate_limiter("openrouter", model).call(
+                client.beta.chat.completions.parse,
+                estimate_tokens(messages),
                 model=model,
                 messages=messages,
                 temperature=0,
@@ -912,7 +1284,9 @@ def request_to_openrouter_chatcompletion(
             if json_schema:  # 両方有効化されていたら、json_schemaを優先
                 payload["response_format"] = json_schema
 
-            response = client.chat.completions.create(**payload)
+            response = get_rate_limiter("openrouter", model).call(
+                client.chat.completions.create, estimate_tokens(messages), **payload
+            )
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
                 token_usage_output = response.usage.completion_tokens or 0
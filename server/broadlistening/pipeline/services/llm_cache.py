@@ -0,0 +1,219 @@
+"""LLMレスポンスのディスクキャッシュ
+
+プロバイダー・モデル・メッセージ・json_schemaの組からキーを作り、レスポンスをSQLiteに保存する。
+同一プロンプト・同一入力での再実行（クラッシュ後の再開や設定変更による全体再実行など）では
+プロバイダーへのリクエストを行わずにキャッシュ済みのレスポンスを返す。
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+# ヒット時の参照時刻の更新は、この件数ごと（または保存時・統計取得時）にまとめて書き込む
+TOUCH_BATCH_SIZE = 100
+
+
+def _normalize_json_schema(json_schema: dict | type[BaseModel] | None) -> Any:
+    """json_schemaをキー生成用の比較可能な値に変換する"""
+    if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        return {"pydantic": json_schema.__name__, "schema": json_schema.model_json_schema()}
+    return json_schema
+
+
+class LLMResponseCache:
+    """SQLiteを使ったサイズ上限付きのLLMレスポンスキャッシュ
+
+    上限サイズを超えた場合は、最後に参照された時刻が古いエントリから削除する。
+    保存のたびに全エントリのサイズを集計しないよう、合計サイズはトリガーで meta テーブルの1行に保持する
+    （複数のパイプラインが同じファイルを使っても正しい値になる）。
+    パイプラインの各ステップはスレッドプールから並列に呼び出すため、内部でロックを取る。
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # まだ書き込んでいないヒット時の参照時刻
+        self._pending_touches: dict[str, float] = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+        # 既存のファイルでは、meta テーブルの作成時に一度だけ合計サイズを集計する
+        self._conn.executescript(
+            """
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS meta (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total_size INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta (id, total_size) SELECT 0, COALESCE(SUM(size), 0) FROM responses;
+            CREATE TRIGGER IF NOT EXISTS responses_total_size_insert AFTER INSERT ON responses BEGIN
+                UPDATE meta SET total_size = total_size + new.size WHERE id = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_total_size_delete AFTER DELETE ON responses BEGIN
+                UPDATE meta SET total_size = total_size - old.size WHERE id = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_total_size_update AFTER UPDATE OF size ON responses BEGIN
+                UPDATE meta SET total_size = total_size - old.size + new.size WHERE id = 0;
+            END;
+            COMMIT;
+            """
+        )
+
+    @staticmethod
+    def make_key(
+        provider: str,
+        model: str | None,
+        messages: list[dict],
+        json_schema: dict | type[BaseModel] | None = None,
+        is_json: bool = False,
+    ) -> str:
+        """リクエスト内容からキャッシュキー（sha256）を生成する"""
+        payload = {
+            "provider": provider,
+            "model": model,
+            "messages": messages,
+            "json_schema": _normalize_json_schema(json_schema),
+            "is_json": is_json,
+        }
+        serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Any | None:
+        """キャッシュ済みのレスポンスを返す。存在しない場合はNone"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            # ヒットのたびにコミットすると重いため、参照時刻の更新はまとめて書き込む
+            self._pending_touches[key] = time.time()
+            if len(self._pending_touches) >= TOUCH_BATCH_SIZE:
+                self._flush_touches()
+                self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])["response"]
+
+    def set(self, key: str, response: Any) -> None:
+        """レスポンスを保存し、上限サイズを超えていれば古いエントリを削除する"""
+        try:
+            value = json.dumps({"response": response}, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"LLM response is not JSON serializable, skip caching: {e}")
+            return
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # INSERT OR REPLACE では置き換え時に削除のトリガーが動かないため、UPSERTで更新する
+            self._conn.execute(
+                """
+                INSERT INTO responses (key, value, size, accessed_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = excluded.value, size = excluded.size, accessed_at = excluded.accessed_at
+                """,
+                (key, value, size, time.time()),
+            )
+            self._flush_touches()
+            self._evict()
+            self._conn.commit()
+
+    def _flush_touches(self) -> None:
+        if not self._pending_touches:
+            return
+        self._conn.executemany(
+            "UPDATE responses SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._pending_touches.items()],
+        )
+        self._pending_touches.clear()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT total_size FROM meta WHERE id = 0").fetchone()[0]
+
+    def _evict(self) -> None:
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        # 参照時刻のインデックス順に、上限を下回るまでの行だけを読む
+        evict_keys = []
+        cursor = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC")
+        for key, size in cursor:
+            if total <= self.max_bytes:
+                break
+            evict_keys.append((key,))
+            total -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+        self.evictions += len(evict_keys)
+
+    def stats(self) -> dict[str, int]:
+        """ヒット・ミス数などの統計情報を返す"""
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": self._total_size(),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+            self._conn.close()
+
+
+_cache: LLMResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def configure_llm_cache(path: str | Path, max_bytes: int = DEFAULT_MAX_BYTES) -> LLMResponseCache:
+    """プロセス全体で共有するキャッシュを有効化する"""
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = LLMResponseCache(path, max_bytes=max_bytes)
+        return _cache
+
+
+def disable_llm_cache() -> None:
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = None
+
+
+def get_llm_cache() -> LLMResponseCache | None:
+    """有効化されていればキャッシュを返す。APIサーバーなど未設定のプロセスではNone"""
+    return _cache
@@ -0,0 +1,57 @@
+"""パイプラインの進捗を書き出す軽量なファイル
+
+hierarchical_status.json はプロンプトや各ステップのソースコード、前回の実行履歴を含む設定全体のため、
+抽出のバッチごとのような頻繁な更新のたびに書き直すと重い。頻繁な更新は、現在のステップ・処理件数・
+トークン使用量だけを含む小さな hierarchical_progress.json に書き出し、hierarchical_status.json は
+ステップの区切りでだけ書き出す。
+"""
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+PROGRESS_FILENAME = "hierarchical_progress.json"
+PROGRESS_KEYS = (
+    "status",
+    "current_job",
+    "current_job_started",
+    "current_job_progress",
+    "current_jop_tasks",
+    "total_token_usage",
+    "token_usage_input",
+    "token_usage_output",
+    "estimated_cost",
+    "provider",
+    "model",
+)
+
+
+def progress_snapshot(config: dict[str, Any]) -> dict[str, Any]:
+    """設定のうち、進捗の表示に必要な値だけを取り出す"""
+    snapshot = {key: config.get(key) for key in PROGRESS_KEYS}
+    snapshot["completed_jobs"] = [job["step"] for job in config.get("completed_jobs", [])]
+    snapshot["updated_at"] = datetime.now().isoformat()
+    return snapshot
+
+
+def write_progress(directory: Path, config: dict[str, Any]) -> None:
+    """進捗ファイルを書き出す。読み込み側が書き込み途中のファイルを読まないよう、一時ファイルから置き換える
+
+    頻繁に呼ばれるため fsync はしない（停止した場合は hierarchical_status.json の状態が正となる）
+    """
+    path = Path(directory) / PROGRESS_FILENAME
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(progress_snapshot(config), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_progress(directory: Path) -> dict[str, Any] | None:
+    """進捗ファイルを読み込む。存在しない場合はNoneを返す"""
+    try:
+        with open(Path(directory) / PROGRESS_FILENAME, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
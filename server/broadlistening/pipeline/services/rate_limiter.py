@@ -0,0 +1,392 @@
+"""プロバイダー・モデルごとのレート制限（RPM/TPM）
+
+パイプラインの各ステップはスレッドプールから並列にLLMを呼び出すため、レート制限に達してから
+指数バックオフで待つと実行時間の多くを待機に費やしてしまう。ここではプロセス全体で共有する
+トークンバケットで、リクエスト数（RPM）とトークン数（TPM）の予算を超えないように送信を待たせる。
+
+- 最初は DEFAULT_LIMITS のプロバイダー・モデルごとの予算を使う
+- 成功したレスポンスのヘッダ（x-ratelimit-limit-* / x-ratelimit-remaining-* / x-ratelimit-reset-*）から
+  実際の上限値と残量を学習し、残量がなくなればリセットまで送信を待たせる
+- 環境変数（{PROVIDER}_RPM_LIMIT / {PROVIDER}_TPM_LIMIT、共通の LLM_RPM_LIMIT / LLM_TPM_LIMIT）で指定した値は
+  既定値の代わりに使い、ヘッダから学習した上限値もこれを超えないようにする
+- 429を受けたら送信レートを半分にし、成功するたびに少しずつ元のレートへ戻す（AIMD）。
+  レスポンスヘッダ（retry-after など）で指定された待機時間も守る
+- 上限値が不明な場合（既定値がなく、上限値のヘッダも返さないプロバイダー）は、指定された待機時間以外は待たない
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+# 1分間の予算のうち、一度に消費できる量の割合。分の始めに予算を使い切ってしまうのを防ぐ
+BURST_RATIO = 1 / 6
+MIN_RATE_FACTOR = 0.1
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_STEP = 0.02
+
+# 環境変数の指定もヘッダからの学習もない場合の (RPM, TPM)。モデル名は前方一致で、最も長く一致するものを使う
+# OpenAI・Geminiの Tier 1 の上限値を目安にしている。成功したレスポンスのヘッダに上限値があれば、その値で置き換える
+# Azure（デプロイごとにクォータが異なり、上限値のヘッダを返さない）・OpenRouter・ローカルLLMには既定値を設けない
+DEFAULT_LIMITS: dict[str, dict[str, tuple[float, float]]] = {
+    "openai": {
+        "": (500, 30_000),
+        "gpt-4o": (500, 30_000),
+        "gpt-4o-mini": (500, 200_000),
+        "gpt-4.1": (500, 30_000),
+        "gpt-4.1-mini": (500, 200_000),
+        "gpt-4.1-nano": (500, 200_000),
+        "text-embedding-3": (3000, 1_000_000),
+    },
+    "gemini": {
+        "": (1000, 1_000_000),
+        "gemini-2.0-flash": (2000, 4_000_000),
+        "gemini-2.5-pro": (150, 2_000_000),
+        "gemini-embedding": (3000, 1_000_000),
+    },
+}
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def estimate_tokens(content: Any) -> int:
+    """送信前にトークン数を見積もる
+
+    日本語は1文字がおおよそ1トークン（UTF-8で3バイト）、英語は4文字がおおよそ1トークンのため、
+    UTF-8のバイト数/3 で見積もる。実際の使用量はレスポンス受信後に補正する。
+    """
+    if isinstance(content, str):
+        text = content
+    else:
+        text = json.dumps(content, ensure_ascii=False, default=str)
+    return max(1, len(text.encode("utf-8")) // 3)
+
+
+def parse_duration(value: str) -> float | None:
+    """「1s」「6m0s」「20ms」のような期間や秒数の文字列を秒に変換する"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    matches = _DURATION_PATTERN.findall(value)
+    if not matches:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in matches)
+
+
+class TokenBucket:
+    """1分あたりの上限値から補充量を決めるトークンバケット
+
+    上限値がNoneの間は制限しない。残量がマイナス（前借り）になることを許し、
+    1回の要求量がバケットの容量を超える場合でも、満杯になれば通す。
+    """
+
+    def __init__(self, limit_per_minute: float | None = None):
+        self.limit_per_minute = limit_per_minute
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        if self.limit_per_minute is None:
+            return 0.0
+        return max(1.0, self.limit_per_minute * BURST_RATIO)
+
+    def set_limit(self, limit_per_minute: float) -> None:
+        self.limit_per_minute = limit_per_minute
+        self.level = min(self.level, self.capacity)
+
+    def refill(self, now: float, rate_factor: float) -> None:
+        if self.limit_per_minute is not None:
+            rate = self.limit_per_minute * rate_factor / 60
+            self.level = min(self.capacity, self.level + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, rate_factor: float) -> float:
+        """amountを消費できるまでの待機時間（秒）"""
+        if self.limit_per_minute is None:
+            return 0.0
+        required = min(amount, self.capacity)
+        if self.level >= required:
+            return 0.0
+        rate = self.limit_per_minute * rate_factor / 60
+        return (required - self.level) / rate
+
+    def consume(self, amount: float) -> None:
+        if self.limit_per_minute is not None:
+            self.level -= amount
+
+
+class RateLimiter:
+    """1つのプロバイダー・モデルのRPM/TPMを管理する
+
+    rpm・tpm は指定された上限値で、ヘッダから学習した上限値もこれを超えない。
+    default_rpm・default_tpm は上限値を学習するまでの予算で、ヘッダの上限値で置き換える。
+    """
+
+    def __init__(
+        self,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        default_rpm: float | None = None,
+        default_tpm: float | None = None,
+    ):
+        self.requests = TokenBucket(rpm or default_rpm)
+        self.tokens = TokenBucket(tpm or default_tpm)
+        self.rate_factor = 1.0
+        self.paused_until = 0.0
+        self.waited_seconds = 0.0
+        self.rate_limited_count = 0
+        self._configured = {"requests": rpm, "tokens": tpm}
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        """予算があれば消費して0を、なければ待機すべき秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now, self.rate_factor)
+            self.tokens.refill(now, self.rate_factor)
+            wait = max(
+                self.paused_until - now,
+                self.requests.wait_time(1, self.rate_factor),
+                self.tokens.wait_time(tokens, self.rate_factor),
+            )
+            if wait > 0:
+                return wait
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            return 0.0
+
+    def acquire(self, tokens: int = 0) -> None:
+        """予算を確保できるまで待つ"""
+        while (wait := self._try_acquire(tokens)) > 0:
+            self._add_waited(wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        """acquire の非同期版。待機中もイベントループをブロックしない"""
+        while (wait := self._try_acquire(tokens)) > 0:
+            self._add_waited(wait)
+            await asyncio.sleep(wait)
+
+    def _add_waited(self, wait: float) -> None:
+        # 複数のスレッドが同時に待つため、ロックの中で加算する
+        with self._lock:
+            self.waited_seconds += wait
+
+    def record_success(self, estimated_tokens: int, actual_tokens: int | None, headers: Any = None) -> None:
+        """見積もりと実際のトークン使用量の差を補正し、送信レートを少し戻す
+
+        レスポンスヘッダがあれば上限値と残量を学習し、残量がなければリセットまで送信を待たせる。
+        """
+        headers = _string_headers(headers)
+        with self._lock:
+            reset_after = self._learn_limits(headers)
+            if actual_tokens is not None:
+                self.tokens.consume(actual_tokens - estimated_tokens)
+            self.rate_factor = min(1.0, self.rate_factor + RATE_INCREASE_STEP)
+            if reset_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + reset_after)
+
+    def _learn_limits(self, headers: dict[str, str]) -> float | None:
+        """ヘッダの上限値・残量をバケットに反映し、残量が0の予算がリセットされるまでの秒数を返す（ロック内で呼ぶ）"""
+        resets = []
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            limit = _to_float(headers.get(f"x-ratelimit-limit-{kind}"))
+            if limit is not None and limit > 0:
+                configured = self._configured[kind]
+                bucket.set_limit(min(limit, configured) if configured else limit)
+            remaining = _to_float(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if remaining is None:
+                continue
+            # 同じAPIキーを他のプロセスと共有している場合でも、サーバー側の残量より多くは送らない
+            if bucket.limit_per_minute is not None:
+                bucket.level = min(bucket.level, remaining)
+            if remaining <= 0 and f"x-ratelimit-reset-{kind}" in headers:
+                resets.append(parse_duration(headers[f"x-ratelimit-reset-{kind}"]))
+        resets = [reset for reset in resets if reset is not None]
+        return max(resets) if resets else None
+
+    def record_rate_limited(self, headers: Any = None, retry_after: float | None = None) -> None:
+        """レート制限エラーを受けた際に送信レートを下げ、ヘッダから上限値と待機時間を学習する"""
+        headers = _string_headers(headers)
+        with self._lock:
+            reset_after = self._learn_limits(headers)
+
+        if retry_after is None:
+            retry_after = _to_float(headers.get("retry-after"))
+        if retry_after is None and "retry-after-ms" in headers:
+            retry_after = (_to_float(headers["retry-after-ms"]) or 0) / 1000
+        if retry_after is None:
+            retry_after = reset_after
+
+        with self._lock:
+            self.rate_limited_count += 1
+            self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor * RATE_DECREASE_FACTOR)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        logging.info(f"Rate limited, rate factor={self.rate_factor:.2f}, retry after={retry_after}")
+
+    def call(self, func: Callable, estimated_tokens: int, *args, **kwargs):
+        """予算を確保してからfuncを呼び出し、結果に応じて予算を補正する
+
+        funcがOpenAI SDKのメソッドの場合は with_raw_response 経由で呼び出し、成功したレスポンスのヘッダからも
+        上限値と残量を学習する（戻り値は通常どおりパース済みのレスポンス）。
+        """
+        self.acquire(estimated_tokens)
+        raw_func = _raw_response_method(func)
+        try:
+            response = (raw_func or func)(*args, **kwargs)
+        except Exception as e:
+            self._handle_exception(e)
+            raise
+        return self._handle_response(response, estimated_tokens, raw_func is not None)
+
+    async def call_async(self, func: Callable, estimated_tokens: int, *args, **kwargs):
+        """call の非同期版"""
+        await self.acquire_async(estimated_tokens)
+        raw_func = _raw_response_method(func)
+        try:
+            response = await (raw_func or func)(*args, **kwargs)
+        except Exception as e:
+            self._handle_exception(e)
+            raise
+        return self._handle_response(response, estimated_tokens, raw_func is not None)
+
+    def _handle_response(self, response: Any, estimated_tokens: int, is_raw: bool) -> Any:
+        headers = None
+        if is_raw:
+            headers = response.headers
+            response = response.parse()
+        self.record_success(estimated_tokens, response_total_tokens(response), headers)
+        return response
+
+    def _handle_exception(self, e: Exception) -> None:
+        if is_rate_limit_error(e):
+            response = getattr(e, "response", None)
+            retry_after = getattr(e, "retry_delay", None)
+            self.record_rate_limited(
+                getattr(response, "headers", None),
+                retry_after=_to_float(retry_after) if retry_after is not None else None,
+            )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "rpm_limit": self.requests.limit_per_minute,
+            "tpm_limit": self.tokens.limit_per_minute,
+            "rate_factor": round(self.rate_factor, 3),
+            "waited_seconds": round(self.waited_seconds, 3),
+            "rate_limited_count": self.rate_limited_count,
+        }
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """OpenAI（RateLimitError）・Gemini（ResourceExhausted）のレート制限エラーか"""
+    return (
+        getattr(e, "status_code", None) == 429
+        or getattr(e, "code", None) == 429
+        or type(e).__name__
+        in (
+            "RateLimitError",
+            "ResourceExhausted",
+        )
+    )
+
+
+def response_total_tokens(response: Any) -> int | None:
+    """OpenAI・Geminiのレスポンスから合計トークン使用量を取り出す"""
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None)
+    if isinstance(total, int):
+        return total
+    usage_metadata = getattr(response, "usage_metadata", None)
+    total = getattr(usage_metadata, "total_token_count", None)
+    return total if isinstance(total, int) else None
+
+
+def default_limits(provider: str, model: str | None) -> tuple[float | None, float | None]:
+    """DEFAULT_LIMITS から、モデル名に最も長く前方一致する (RPM, TPM) を返す"""
+    limits = DEFAULT_LIMITS.get(provider, {})
+    prefixes = [prefix for prefix in limits if (model or "").startswith(prefix)]
+    if not prefixes:
+        return None, None
+    return limits[max(prefixes, key=len)]
+
+
+def _raw_response_method(func: Callable) -> Callable | None:
+    """OpenAI SDKのメソッド（client.chat.completions.create など）に対応する with_raw_response 版
+
+    with_raw_response 版はヘッダを含むパース前のレスポンスを返す。OpenAI SDKのメソッドでなければNone
+    """
+    resource = getattr(func, "__self__", None)
+    raw_resource = getattr(resource, "with_raw_response", None)
+    raw_func = getattr(raw_resource, getattr(func, "__name__", ""), None)
+    return raw_func if callable(raw_func) else None
+
+
+def _string_headers(headers: Any) -> dict[str, str]:
+    # テストなどでheadersがMagicMockの場合もあるため、文字列のキー・値のみを取り出す
+    if headers is None or not hasattr(headers, "items"):
+        return {}
+    try:
+        return {k.lower(): v for k, v in headers.items() if isinstance(k, str) and isinstance(v, str)}
+    except TypeError:
+        return {}
+
+
+def _to_float(value: Any) -> float | None:
+    if isinstance(value, int | float):
+        return float(value)
+    if isinstance(value, str):
+        return parse_duration(value)
+    return None
+
+
+def _env_limit(provider: str, kind: str) -> float | None:
+    value = os.getenv(f"{provider.upper()}_{kind}_LIMIT") or os.getenv(f"LLM_{kind}_LIMIT")
+    if not value:
+        return None
+    try:
+        limit = float(value)
+    except ValueError:
+        logging.warning(f"Invalid {kind} limit for {provider}: {value}")
+        return None
+    return limit if limit > 0 else None
+
+
+_limiters: dict[tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, model: str | None) -> RateLimiter:
+    """プロセス全体で共有する、プロバイダー・モデルごとのレートリミッターを返す"""
+    key = (provider, model or "")
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            default_rpm, default_tpm = default_limits(provider, model)
+            limiter = RateLimiter(
+                rpm=_env_limit(provider, "RPM"),
+                tpm=_env_limit(provider, "TPM"),
+                default_rpm=default_rpm,
+                default_tpm=default_tpm,
+            )
+            _limiters[key] = limiter
+        return limiter
+
+
+def reset_rate_limiters() -> None:
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def rate_limiter_stats() -> dict[str, dict[str, Any]]:
+    with _limiters_lock:
+        return {f"{provider}/{model}": limiter.stats() for (provider, model), limiter in _limiters.items()}
@@ -1,10 +1,20 @@
 import os
 
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
+from services.embedding_batches import request_in_batches
+from services.embedding_cache import get_embedding_cache
+from services.embedding_io import embeddings_exist, load_embeddings, save_embeddings
+from services.incremental import is_incremental
 from services.llm import request_to_embed
 
+# 1リクエストあたりの件数の既定値
+# OpenAI/Azureは1リクエストで複数件を送れるが、Geminiは100件ずつのバッチで送る
+DEFAULT_BATCH_SIZES = {"openai": 1000, "azure": 1000, "local": 256, "gemini": 100}
+# sentence-transformersのencodeの既定値
+DEFAULT_LOCAL_BATCH_SIZE = 32
+
 
 def embedding(config):
     model = config["embedding"]["model"]
@@ -13,20 +23,93 @@ def embedding(config):
     # print(f"embedding model: {model}, is_embedded_at_local: {is_embedded_at_local}")
 
     dataset = config["output_dir"]
-    path = f"outputs/{dataset}/embeddings.pkl"
-    arguments = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings = []
-    batch_size = 1000
-    for i in tqdm(range(0, len(arguments), batch_size)):
-        args = arguments["argument"].tolist()[i : i + batch_size]
+    output_dir = f"outputs/{dataset}"
+    arguments = pd.read_csv(f"{output_dir}/args.csv", usecols=["arg-id", "argument"], dtype={"arg-id": str})
+    arg_ids = arguments["arg-id"].tolist()
+
+    # 差分更新では前回の埋め込みを再利用し、追加された意見のみ埋め込む
+    previous_vectors = None
+    previous_rows: dict[str, int] = {}
+    if is_incremental(config) and embeddings_exist(output_dir):
+        previous_vectors, previous_arg_ids = load_embeddings(output_dir)
+        previous_rows = {arg_id: row for row, arg_id in enumerate(previous_arg_ids)}
+    pending = [i for i, arg_id in enumerate(arg_ids) if arg_id not in previous_rows]
+    if previous_rows:
+        print(f"Reusing {len(arg_ids) - len(pending)} embeddings, embedding {len(pending)} new arguments")
+
+    texts = arguments["argument"].tolist()
+    new_vectors = _embed_with_cache([texts[i] for i in pending], model, is_embedded_at_local, config)
+    if previous_vectors is None:
+        vectors = new_vectors
+    else:
+        vectors = np.empty((len(arg_ids), previous_vectors.shape[1]), dtype=np.float32)
+        reused = [i for i, arg_id in enumerate(arg_ids) if arg_id in previous_rows]
+        vectors[reused] = previous_vectors[[previous_rows[arg_ids[i]] for i in reused]]
+        if pending:
+            vectors[pending] = new_vectors
+    save_embeddings(output_dir, arg_ids, vectors)
+
+
+def _embedding_model_key(model, is_embedded_at_local, config) -> str:
+    """埋め込みキャッシュを共有する単位（同じベクトルを返すプロバイダー・モデルの組）"""
+    if is_embedded_at_local:
+        return "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+    if config["provider"] == "local":
+        return f"local@{config.get('local_llm_address') or 'localhost:11434'}/{model}"
+    if config["provider"] == "azure":
+        return f"azure/{os.getenv('AZURE_EMBEDDING_DEPLOYMENT_NAME')}"
+    return f"{config['provider']}/{model}"
+
+
+def _embed_with_cache(texts, model, is_embedded_at_local, config) -> np.ndarray:
+    """キャッシュに存在しない意見のみ埋め込みをリクエストし、入力順のベクトル（float32の行列）を返す"""
+    cache = get_embedding_cache(_embedding_model_key(model, is_embedded_at_local, config))
+    missing = list(range(len(texts)))
+    cached = None
+    if cache is not None:
+        cached, missing = cache.get_many(texts)
+        print(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+
+    missing_texts = [texts[i] for i in missing]
+    embeddings = _request_embeddings(missing_texts, model, is_embedded_at_local, config, cache)
+    if cached is None:
+        return embeddings
+    if missing:
+        cached[missing] = embeddings
+    return cached
+
+
+def _request_embeddings(texts, model, is_embedded_at_local, config, cache) -> np.ndarray:
+    """バッチに分けて並列に埋め込みをリクエストし、入力順に並べたベクトルを返す"""
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    options = config.get("embedding", {})
+    batch_size = options.get("batch_size")
+
+    if is_embedded_at_local:
+        # sentence-transformersはencode内でバッチ処理するため、まとめて渡す
+        embeds = request_to_embed(
+            texts, model, is_embedded_at_local, local_batch_size=batch_size or DEFAULT_LOCAL_BATCH_SIZE
+        )
+        if cache is not None:
+            cache.put_many(texts, embeds)
+        return np.asarray(embeds, dtype=np.float32)
+
+    provider = config["provider"]
+
+    def request(batch):
         embeds = request_to_embed(
-            args,
+            batch,
             model,
             is_embedded_at_local,
-            config["provider"],
+            provider,
             local_llm_address=config.get("local_llm_address"),
             user_api_key=os.getenv("USER_API_KEY"),
         )
-        embeddings.extend(embeds)
-    df = pd.DataFrame([{"arg-id": arguments.iloc[i]["arg-id"], "embedding": e} for i, e in enumerate(embeddings)])
-    df.to_pickle(path)
+        if cache is not None:
+            cache.put_many(batch, embeds)
+        return embeds
+
+    return request_in_batches(
+        texts, request, batch_size or DEFAULT_BATCH_SIZES.get(provider, 1000), workers=options.get("workers", 1)
+    )
@@ -1,16 +1,26 @@
-import concurrent.futures
 import json
 import logging
 import os
 import re
+from functools import partial
 
 import pandas as pd
+from hierarchical_utils import update_progress
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
+from services.extraction_checkpoint import (
+    CHECKPOINT_FILENAME,
+    ExtractionCheckpoint,
+    checkpoint_fingerprint,
+    comment_hash,
+    load_checkpoint,
+    remove_checkpoint,
+)
+from services.extraction_queue import extract_stream
+from services.incremental import is_incremental
 from services.llm import request_to_chat_ai
 from services.parse_json_list import parse_extraction_response
-from utils import update_progress
 
 COMMA_AND_SPACE_AND_RIGHT_BRACKET = re.compile(r",\s*(\])")
 
@@ -27,6 +37,7 @@ def _validate_property_columns(property_columns: list[str], comments: pd.DataFra
 def extraction(config):
     dataset = config["output_dir"]
     path = f"outputs/{dataset}/args.csv"
+    checkpoint_path = f"outputs/{dataset}/{CHECKPOINT_FILENAME}"
     model = config["extraction"]["model"]
     prompt = config["extraction"]["prompt"]
     workers = config["extraction"]["workers"]
@@ -44,42 +55,79 @@ def extraction(config):
     comments = pd.read_csv(
         f"inputs/{config['input']}.csv", usecols=["comment-id", "comment-body"] + config["extraction"]["properties"]
     )
+    if is_incremental(config):
+        # 差分更新では、レポート作成後に追加されたコメントも対象にするため件数制限を適用しない
+        limit = len(comments)
     comment_ids = (comments["comment-id"].values)[:limit]
     comments.set_index("comment-id", inplace=True)
-    results = pd.DataFrame()
     update_progress(config, total=len(comment_ids))
 
+    # 前回の実行で抽出済みのコメントはチェックポイントから復元し、未処理のコメントのみLLMに送る
+    # 同じslugで入力CSVが差し替えられた場合に備え、本文が変わったコメントは復元せずに抽出し直す
+    fingerprint = checkpoint_fingerprint(config)
+    body_hashes = {
+        str(comment_id): comment_hash(body)
+        for comment_id, body in zip(comment_ids, comments["comment-body"].values[:limit], strict=True)
+    }
+    extracted = load_checkpoint(checkpoint_path, fingerprint, body_hashes)
+    if not extracted and is_incremental(config):
+        # ストレージ同期でチェックポイントが削除されている場合は、前回の出力から抽出済みの結果を復元する
+        extracted = _load_previous_outputs(dataset)
+    pending_ids = [comment_id for comment_id in comment_ids if str(comment_id) not in extracted]
+    resumed_num = len(comment_ids) - len(pending_ids)
+    if resumed_num > 0:
+        print(f"Resuming extraction from checkpoint: {resumed_num} comments already extracted")
+        update_progress(config, incr=resumed_num)
+
+    inputs = [(comment_id, comments.loc[comment_id]["comment-body"]) for comment_id in pending_ids]
+    with ExtractionCheckpoint(checkpoint_path, fingerprint) as checkpoint:
+        extract_fn = partial(
+            extract_arguments,
+            prompt=prompt,
+            model=model,
+            provider=provider,
+            local_llm_address=config.get("local_llm_address"),
+        )
+        results = extract_stream(inputs, extract_fn, workers, config)
+        unreported = 0
+        for comment_id, extracted_args in tqdm(results, total=len(inputs)):
+            # 失敗したコメントはチェックポイントに残さず、再実行時に再度抽出する
+            if extracted_args is not None:
+                extracted[str(comment_id)] = extracted_args
+                checkpoint.append(comment_id, body_hashes[str(comment_id)], extracted_args)
+
+            # 1件ごとのfsyncと進捗の書き込みは重いため、workers件ごとにまとめて反映する
+            unreported += 1
+            if unreported >= workers:
+                checkpoint.commit()
+                update_progress(config, incr=unreported)
+                unreported = 0
+        if unreported > 0:
+            update_progress(config, incr=unreported)
+
     argument_map = {}
     relation_rows = []
 
-    for i in tqdm(range(0, len(comment_ids), workers)):
-        batch = comment_ids[i : i + workers]
-        batch_inputs = [comments.loc[id]["comment-body"] for id in batch]
-        batch_results = extract_batch(
-            batch_inputs, prompt, model, workers, provider, config.get("local_llm_address"), config
-        )
-
-        for comment_id, extracted_args in zip(batch, batch_results, strict=False):
-            for j, arg in enumerate(extracted_args):
-                if arg not in argument_map:
-                    # argumentテーブルに追加
-                    arg_id = f"A{comment_id}_{j}"
-                    argument = arg
-                    argument_map[arg] = {
-                        "arg-id": arg_id,
-                        "argument": argument,
-                    }
-                else:
-                    arg_id = argument_map[arg]["arg-id"]
-
-                # relationテーブルにcommentとargの関係を追加
-                relation_row = {
+    # 完了順ではなく入力順に組み立てることで、再開の有無に関わらず同じarg-idになるようにする
+    for comment_id in comment_ids:
+        for j, arg in enumerate(extracted.get(str(comment_id), [])):
+            if arg not in argument_map:
+                # argumentテーブルに追加
+                arg_id = f"A{comment_id}_{j}"
+                argument = arg
+                argument_map[arg] = {
                     "arg-id": arg_id,
-                    "comment-id": comment_id,
+                    "argument": argument,
                 }
-                relation_rows.append(relation_row)
+            else:
+                arg_id = argument_map[arg]["arg-id"]
 
-        update_progress(config, incr=len(batch))
+            # relationテーブルにcommentとargの関係を追加
+            relation_row = {
+                "arg-id": arg_id,
+                "comment-id": comment_id,
+            }
+            relation_rows.append(relation_row)
 
     # DataFrame化
     results = pd.DataFrame(argument_map.values())
@@ -91,53 +139,29 @@ def extraction(config):
     results.to_csv(path, index=False)
     # comment-idとarg-idの関係を保存
     relation_df.to_csv(f"outputs/{dataset}/relations.csv", index=False)
+    # 出力が揃えばチェックポイントは不要。残しておくと、入力を差し替えて再実行した際に古い結果を使うおそれがある
+    remove_checkpoint(checkpoint_path)
 
 
-logging.basicConfig(level=logging.DEBUG)
+def _load_previous_outputs(dataset: str) -> dict[str, list[str]]:
+    """前回出力したargs.csvとrelations.csvから、コメントごとの抽出結果を復元する"""
+    args_path = f"outputs/{dataset}/args.csv"
+    relations_path = f"outputs/{dataset}/relations.csv"
+    if not (os.path.exists(args_path) and os.path.exists(relations_path)):
+        return {}
+
+    arguments = pd.read_csv(args_path, usecols=["arg-id", "argument"])
+    relations = pd.read_csv(relations_path)
+    relations = relations.merge(arguments, on="arg-id", how="inner")
 
+    extracted: dict[str, list[str]] = {}
+    for comment_id, argument in zip(relations["comment-id"].astype(str), relations["argument"], strict=True):
+        extracted.setdefault(comment_id, []).append(argument)
+    print(f"Restored extraction results of {len(extracted)} comments from previous outputs")
+    return extracted
 
-def extract_batch(batch, prompt, model, workers, provider="openai", local_llm_address=None, config=None):
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        futures_with_index = [
-            (i, executor.submit(extract_arguments, input, prompt, model, provider, local_llm_address))
-            for i, input in enumerate(batch)
-        ]
-
-        done, not_done = concurrent.futures.wait([f for _, f in futures_with_index], timeout=30)
-        results = [[] for _ in range(len(batch))]
-        total_token_input = 0
-        total_token_output = 0
-        total_token_usage = 0
-
-        for _, future in futures_with_index:
-            if future in not_done and not future.cancelled():
-                future.cancel()
-
-        for i, future in futures_with_index:
-            if future in done:
-                try:
-                    result = future.result()
-                    if isinstance(result, tuple) and len(result) == 4:
-                        items, token_input, token_output, token_total = result
-                        results[i] = items
-                        total_token_input += token_input
-                        total_token_output += token_output
-                        total_token_usage += token_total
-                    else:
-                        results[i] = result
-                except Exception as e:
-                    logging.error(f"Task {future} failed with error: {e}")
-                    results[i] = []
-
-        if config is not None:
-            config["total_token_usage"] = config.get("total_token_usage", 0) + total_token_usage
-            config["token_usage_input"] = config.get("token_usage_input", 0) + total_token_input
-            config["token_usage_output"] = config.get("token_usage_output", 0) + total_token_output
-            print(
-                f"Extraction batch: input={total_token_input}, output={total_token_output}, total={total_token_usage} tokens"
-            )
-
-        return results
+
+logging.basicConfig(level=logging.DEBUG)
 
 
 def extract_arguments(input, prompt, model, provider="openai", local_llm_address=None):
@@ -1,44 +1,30 @@
 """Generate a convenient JSON output file."""
 
 import json
+import os
 from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, TypedDict
+from typing import TypedDict
 
 import numpy as np
 import pandas as pd
 
+from services.aggregation_rows import match_comment_rows, property_values, take_comment_values
+from services.columnar_result import (
+    COLUMNAR_FORMAT,
+    COLUMNAR_RESULT_FILENAME,
+    COLUMNAR_VERSION,
+    ColumnarArgumentsBuilder,
+)
+from services.json_stream import JsonObjectWriter
+
 ROOT_DIR = Path(__file__).parent.parent.parent.parent
 CONFIG_DIR = ROOT_DIR / "scatter" / "pipeline" / "configs"
 PIPELINE_DIR = ROOT_DIR / "broadlistening" / "pipeline"
 
 
-def json_serialize_numpy(obj: Any) -> Any:
-    """
-    Recursively convert NumPy data types to native Python types for JSON serialization.
-
-    Args:
-        obj: Any Python object which might contain NumPy data types
-
-    Returns:
-        The same object structure with NumPy types converted to Python native types
-    """
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: json_serialize_numpy(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [json_serialize_numpy(item) for item in obj]
-    elif isinstance(obj, tuple):
-        return tuple(json_serialize_numpy(item) for item in obj)
-    else:
-        return obj
-
-
 class Argument(TypedDict):
     arg_id: str
     argument: str
@@ -64,15 +50,6 @@ class Cluster(TypedDict):
 def hierarchical_aggregation(config) -> bool:
     try:
         path = f"outputs/{config['output_dir']}/hierarchical_result.json"
-        results = {
-            "arguments": [],
-            "clusters": [],
-            "comments": {},
-            "propertyMap": {},
-            "translations": {},
-            "overview": "",
-            "config": config,
-        }
 
         arguments = pd.read_csv(f"outputs/{config['output_dir']}/args.csv")
         arguments.set_index("arg-id", inplace=True)
@@ -83,31 +60,56 @@ def hierarchical_aggregation(config) -> bool:
         labels = pd.read_csv(f"outputs/{config['output_dir']}/hierarchical_merge_labels.csv")
 
         hidden_properties_map: dict[str, list[str]] = config["hierarchical_aggregation"]["hidden_properties"]
-
-        results["arguments"] = _build_arguments(clusters, comments, relation_df, config)
-        results["clusters"] = _build_cluster_value(labels, arg_num)
-
-        # results["comments"] = _build_comments_value(
-        #     comments, arguments, hidden_properties_map
-        # )
-        results["comment_num"] = len(comments)
-        results["translations"] = _build_translations(config)
         # 属性情報のカラムは、元データに対して指定したカラムとclassificationするカテゴリを合わせたもの
-        results["propertyMap"] = _build_property_map(arguments, comments, hidden_properties_map, config)
+        property_map = _build_property_map(arguments, comments, hidden_properties_map, config)
 
         with open(f"outputs/{config['output_dir']}/hierarchical_overview.txt") as f:
             overview = f.read()
         print("overview")
         print(overview)
-        results["overview"] = overview
-
-        # Convert non-serializable NumPy types to native Python types
-        results = json_serialize_numpy(results)
 
-        with open(path, "w") as file:
-            json.dump(results, file, indent=2, ensure_ascii=False)
         # TODO: サンプリングロジックを実装したいが、現状は全件抽出
-        create_custom_intro(config)
+        custom_intro = create_custom_intro(config, input_count=len(comments), args_count=arg_num)
+
+        cluster_value = _build_cluster_value(labels, arg_num)
+        translations = _build_translations(config)
+        result_config = {**config, "intro": custom_intro}
+
+        # 意見は1件ずつ書き出し、結果全体をメモリ上に組み立てない
+        # 書き出しと同時に、散布図向けの列指向の表現（hierarchical_result_columnar.json）を組み立てる
+        columnar_arguments = ColumnarArgumentsBuilder()
+        indent = None if config["hierarchical_aggregation"].get("compact_json", False) else 2
+        with _atomic_open(path) as file:
+            writer = JsonObjectWriter(file, indent=indent)
+            writer.write_array(
+                "arguments", columnar_arguments.collect(_iter_arguments(clusters, comments, relation_df, config))
+            )
+            writer.write_array("clusters", cluster_value)
+            # results["comments"] = _build_comments_value(
+            #     comments, arguments, hidden_properties_map
+            # )
+            writer.write("comments", {})
+            writer.write("propertyMap", property_map)
+            writer.write("translations", translations)
+            writer.write("overview", overview)
+            writer.write("config", result_config)
+            writer.write("comment_num", len(comments))
+            writer.close()
+
+        with _atomic_open(f"outputs/{config['output_dir']}/{COLUMNAR_RESULT_FILENAME}") as file:
+            writer = JsonObjectWriter(file, indent=None)
+            writer.write("format", COLUMNAR_FORMAT)
+            writer.write("version", COLUMNAR_VERSION)
+            writer.write("arguments", columnar_arguments.to_dict())
+            writer.write_array("clusters", cluster_value)
+            writer.write("comments", {})
+            writer.write("propertyMap", property_map)
+            writer.write("translations", translations)
+            writer.write("overview", overview)
+            writer.write("config", result_config)
+            writer.write("comment_num", len(comments))
+            writer.close()
+
         if config["is_pubcom"]:
             add_original_comments(labels, arguments, relation_df, clusters, config)
         return True
@@ -117,14 +119,20 @@ def hierarchical_aggregation(config) -> bool:
         return False
 
 
-def create_custom_intro(config):
-    dataset = config["output_dir"]
-    args_path = PIPELINE_DIR / f"outputs/{dataset}/args.csv"
-    comments = pd.read_csv(PIPELINE_DIR / f"inputs/{config['input']}.csv")
-    result_path = PIPELINE_DIR / f"outputs/{dataset}/hierarchical_result.json"
+@contextmanager
+def _atomic_open(path: str):
+    """途中で失敗した場合に書きかけのファイルが残らないよう、一時ファイルに書き出してから置き換える"""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            yield file
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
-    input_count = len(comments)
-    args_count = len(pd.read_csv(args_path))
+def create_custom_intro(config, input_count: int, args_count: int) -> str:
     processed_num = min(input_count, config["extraction"]["limit"])
 
     print(f"Input count: {input_count}")
@@ -157,12 +165,7 @@ def create_custom_intro(config):
     custom_intro = base_custom_intro.format(
         intro=intro, processed_num=processed_num, args_count=args_count, llm_provider=llm_provider
     )
-
-    with open(result_path) as f:
-        result = json.load(f)
-    result["config"]["intro"] = custom_intro
-    with open(result_path, "w") as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
+    return custom_intro
 
 
 def add_original_comments(labels, arguments, relation_df, clusters, config):
@@ -224,8 +227,14 @@ def add_original_comments(labels, arguments, relation_df, clusters, config):
 def _build_arguments(
     clusters: pd.DataFrame, comments: pd.DataFrame, relation_df: pd.DataFrame, config: dict
 ) -> list[Argument]:
+    return list(_iter_arguments(clusters, comments, relation_df, config))
+
+
+def _iter_arguments(
+    clusters: pd.DataFrame, comments: pd.DataFrame, relation_df: pd.DataFrame, config: dict
+) -> Iterator[Argument]:
     """
-    Build the arguments list including attribute information from original comments
+    Build the arguments including attribute information from original comments, one at a time
 
     Args:
         clusters: DataFrame containing cluster information for each argument
@@ -235,73 +244,56 @@ def _build_arguments(
     """
     cluster_columns = [col for col in clusters.columns if col.startswith("cluster-level-") and "id" in col]
 
-    # Prepare for merging with original comments to get attributes
-    comments_copy = comments.copy()
-    comments_copy["comment-id"] = comments_copy["comment-id"].astype(str)
-
-    # Get argument to comment mapping
-    arg_comment_map = {}
-    if "comment-id" in relation_df.columns:
-        relation_df["comment-id"] = relation_df["comment-id"].astype(str)
-        arg_comment_map = dict(zip(relation_df["arg-id"], relation_df["comment-id"], strict=False))
-
     # Find attribute columns in comments dataframe
     attribute_columns = [col for col in comments.columns if col.startswith("attribute_")]
     print(f"属性カラム検出: {attribute_columns}")
 
-    arguments: list[Argument] = []
-    for _, row in clusters.iterrows():
-        cluster_ids = ["0"]
-        for cluster_column in cluster_columns:
-            cluster_ids.append(str(row[cluster_column]))  # Convert to string to ensure serializable
+    # 意見ごとに対応する元コメントの行番号を、意見・関係・コメントの結合で一度に求める
+    # （意見ごとにコメント全体を検索すると 意見数×コメント数 の計算量になるため）
+    comment_rows, has_comment = match_comment_rows(clusters, comments, relation_df)
+
+    num_args = len(clusters)
+    arg_ids = clusters["arg-id"].astype(str).tolist()
+    texts = clusters["argument"].astype(str).tolist()
+    xs = clusters["x"].astype(float).tolist()
+    ys = clusters["y"].astype(float).tolist()
+    cluster_id_columns = [clusters[col].astype(str).tolist() for col in cluster_columns]
+    cluster_ids_per_arg = zip(*cluster_id_columns, strict=True) if cluster_id_columns else [()] * num_args
+
+    # Add URL if available and enabled
+    urls = None
+    if config.get("enable_source_link", False) and "url" in comments.columns:
+        urls = take_comment_values(comments["url"], comment_rows)
+
+    # Remove "attribute_" prefix for cleaner attribute names
+    attribute_values = [
+        (attr_col[len("attribute_") :], take_comment_values(comments[attr_col], comment_rows))
+        for attr_col in attribute_columns
+    ]
 
-        # Create base argument
+    for i, cluster_ids in enumerate(cluster_ids_per_arg):
         argument: Argument = {
-            "arg_id": str(row["arg-id"]),  # Convert to string to ensure serializable
-            "argument": str(row["argument"]),
-            "x": float(row["x"]),  # Convert to native float
-            "y": float(row["y"]),  # Convert to native float
+            "arg_id": arg_ids[i],
+            "argument": texts[i],
+            "x": xs[i],
+            "y": ys[i],
             "p": 0,  # NOTE: 一旦全部0でいれる
-            "cluster_ids": cluster_ids,
+            "cluster_ids": ["0", *cluster_ids],
             "attributes": None,
             "url": None,
         }
 
-        # Add attributes and URL if available
-        if row["arg-id"] in arg_comment_map:
-            comment_id = arg_comment_map[row["arg-id"]]
-            comment_rows = comments_copy[comments_copy["comment-id"] == comment_id]
-
-            if not comment_rows.empty:
-                comment_row = comment_rows.iloc[0]
-
-                # Add URL if available and enabled
-                if config.get("enable_source_link", False) and "url" in comment_row and comment_row["url"] is not None:
-                    argument["url"] = str(comment_row["url"])
-
-                # Add attributes if available
-                if attribute_columns:
-                    attributes = {}
-                    for attr_col in attribute_columns:
-                        # Remove "attribute_" prefix for cleaner attribute names
-                        attr_name = attr_col[len("attribute_") :]
-                        # Convert potential numpy types to Python native types
-                        attr_value = comment_row.get(attr_col, None)
-                        if attr_value is not None:
-                            if isinstance(attr_value, np.integer):
-                                attr_value = int(attr_value)
-                            elif isinstance(attr_value, np.floating):
-                                attr_value = float(attr_value)
-                            elif isinstance(attr_value, np.ndarray):
-                                attr_value = attr_value.tolist()
-                        attributes[attr_name] = attr_value
-
-                    # Only add non-empty attributes
-                    if any(v is not None for v in attributes.values()):
-                        argument["attributes"] = attributes
-
-        arguments.append(argument)
-    return arguments
+        if has_comment[i]:
+            if urls is not None and urls[i] is not None:
+                argument["url"] = str(urls[i])
+
+            if attribute_values:
+                attributes = {attr_name: values[i] for attr_name, values in attribute_values}
+                # Only add non-empty attributes
+                if any(v is not None for v in attributes.values()):
+                    argument["attributes"] = attributes
+
+        yield argument
 
 
 def _build_cluster_value(melted_labels: pd.DataFrame, total_num: int) -> list[Cluster]:
@@ -393,29 +385,9 @@ def _build_property_map(
             "設定ファイルaggregation / hidden_propertiesから該当カラムを取り除いてください。"
         )
 
+    # Make sure arg_id is string
+    arg_ids = arguments.index.astype(str).tolist()
     for prop in property_columns:
-        for arg_id, row in arguments.iterrows():
-            # LLMによるcategory classificationがうまく行かず、NaNの場合はNoneにする
-            value = row[prop] if not pd.isna(row[prop]) else None
-
-            # Convert NumPy types to Python native types
-            if value is not None:
-                if isinstance(value, np.integer):
-                    value = int(value)
-                elif isinstance(value, np.floating):
-                    value = float(value)
-                elif isinstance(value, np.ndarray):
-                    value = value.tolist()
-                else:
-                    # Convert any other types to string to ensure serialization
-                    try:
-                        value = str(value)
-                    except Exception as e:
-                        print(f"Error converting value to string: {e}")
-                        value = None
-
-            # Make sure arg_id is string
-            str_arg_id = str(arg_id)
-            property_map[prop][str_arg_id] = value
+        property_map[prop] = dict(zip(arg_ids, property_values(arguments[prop]), strict=True))
 
     return property_map
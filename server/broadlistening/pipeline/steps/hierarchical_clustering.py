@@ -1,43 +1,47 @@
 """Cluster the arguments using UMAP + HDBSCAN and GPT-4."""
 
-from importlib import import_module
+import os
 
-import numpy as np
 import pandas as pd
-import scipy.cluster.hierarchy as sch
-from sklearn.cluster import KMeans
 
+from services.clustering import cluster_embeddings
+from services.embedding_io import load_embeddings
+from services.incremental import (
+    PREVIOUS_CLUSTERS_FILENAME,
+    assign_to_existing_clusters,
+    incremental_clustering_fallback_reason,
+    is_incremental,
+    previous_step_params,
+)
 
-def hierarchical_clustering(config):
-    UMAP = import_module("umap").UMAP
 
+def hierarchical_clustering(config):
     dataset = config["output_dir"]
     path = f"outputs/{dataset}/hierarchical_clusters.csv"
-    arguments_df = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings_df = pd.read_pickle(f"outputs/{dataset}/embeddings.pkl")
-    embeddings_array = np.asarray(embeddings_df["embedding"].values.tolist())
-    cluster_nums = config["hierarchical_clustering"]["cluster_nums"]
-
-    n_samples = embeddings_array.shape[0]
-    # デフォルト設定は15
-    default_n_neighbors = 15
-
-    # テスト等サンプルが少なすぎる場合、n_neighborsの設定値を下げる
-    if n_samples <= default_n_neighbors:
-        n_neighbors = max(2, n_samples - 1)  # 最低2以上
-    else:
-        n_neighbors = default_n_neighbors
-
-    umap_model = UMAP(random_state=42, n_components=2, n_neighbors=n_neighbors)
-    # TODO 詳細エラーメッセージを加える
-    # 以下のエラーの場合、おそらく元の意見件数が少なすぎることが原因
-    # TypeError: Cannot use scipy.linalg.eigh for sparse A with k >= N. Use scipy.linalg.eigh(A.toarray()) or reduce k.
-    umap_embeds = umap_model.fit_transform(embeddings_array)
-
-    cluster_results = hierarchical_clustering_embeddings(
-        umap_embeds=umap_embeds,
-        cluster_nums=cluster_nums,
-    )
+    previous_path = f"outputs/{dataset}/{PREVIOUS_CLUSTERS_FILENAME}"
+    arguments_df = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"], dtype={"arg-id": str})
+    # embeddings.npyはメモリマップで読み込み、Pythonのリストに展開せずにそのまま使う
+    embeddings_array, embedding_arg_ids = load_embeddings(f"outputs/{dataset}")
+    options = config["hierarchical_clustering"]
+
+    if is_incremental(config) and os.path.exists(path):
+        previous_df = pd.read_csv(path)
+        fallback_reason = incremental_clustering_fallback_reason(
+            previous_df, options, previous_step_params(config, "hierarchical_clustering")
+        )
+        if fallback_reason is None:
+            result_df = assign_to_existing_clusters(previous_df, arguments_df, embeddings_array, embedding_arg_ids)
+            # ラベリングステップで変化したクラスタを判定するため、更新前の結果を残しておく
+            previous_df.to_csv(previous_path, index=False)
+            result_df.to_csv(path, index=False)
+            return
+        print(f"{fallback_reason}, falling back to full clustering")
+
+    # 全体を再計算した場合、前回の差分更新時の結果は不要になる
+    if os.path.exists(previous_path):
+        os.remove(previous_path)
+
+    umap_embeds, cluster_results = cluster_embeddings(embeddings_array, options)
     result_df = pd.DataFrame(
         {
             "arg-id": arguments_df["arg-id"],
@@ -80,53 +84,3 @@ def generate_cluster_count_list(min_clusters: int, max_clusters: int):
         current = next_double
 
     return cluster_counts
-
-
-def merge_clusters_with_hierarchy(
-    cluster_centers: np.ndarray,
-    kmeans_labels: np.ndarray,
-    umap_array: np.ndarray,
-    n_cluster_cut: int,
-):
-    Z = sch.linkage(cluster_centers, method="ward")
-    cluster_labels_merged = sch.fcluster(Z, t=n_cluster_cut, criterion="maxclust")
-
-    n_samples = umap_array.shape[0]
-    final_labels = np.zeros(n_samples, dtype=int)
-
-    for i in range(n_samples):
-        original_label = kmeans_labels[i]
-        final_labels[i] = cluster_labels_merged[original_label]
-
-    return final_labels
-
-
-def hierarchical_clustering_embeddings(
-    umap_embeds,
-    cluster_nums,
-):
-    # 最大分割数でクラスタリングを実施
-    print("start initial clustering")
-    initial_cluster_num = cluster_nums[-1]
-    kmeans_model = KMeans(n_clusters=initial_cluster_num, random_state=42)
-    kmeans_model.fit(umap_embeds)
-    print("end initial clustering")
-
-    results = {}
-    print("start hierarchical clustering")
-    cluster_nums.sort()
-    print(cluster_nums)
-    for n_cluster_cut in cluster_nums[:-1]:
-        print("n_cluster_cut: ", n_cluster_cut)
-        final_labels = merge_clusters_with_hierarchy(
-            cluster_centers=kmeans_model.cluster_centers_,
-            kmeans_labels=kmeans_model.labels_,
-            umap_array=umap_embeds,
-            n_cluster_cut=n_cluster_cut,
-        )
-        results[n_cluster_cut] = final_labels
-
-    results[initial_cluster_num] = kmeans_model.labels_
-    print("end hierarchical clustering")
-
-    return results
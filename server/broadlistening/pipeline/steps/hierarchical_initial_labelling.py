@@ -7,6 +7,8 @@ from typing import TypedDict
 import pandas as pd
 from pydantic import BaseModel, Field
 
+from services.cluster_index import ClusterIndex
+from services.incremental import find_changed_clusters, is_incremental, load_previous_clusters
 from services.llm import request_to_chat_ai
 
 
@@ -45,6 +47,15 @@ def hierarchical_initial_labelling(config: dict) -> None:
     # トークン使用量を追跡するための変数を初期化
     config["total_token_usage"] = config.get("total_token_usage", 0)
 
+    # 差分更新では、所属する意見の変化が閾値以下のクラスタは前回のラベルを再利用する
+    reused_label_df = _load_reusable_labels(config, clusters_argument_df, initial_cluster_id_column)
+    reused_cluster_ids = set(reused_label_df["cluster_id"])
+    target_cluster_ids = [
+        cluster_id
+        for cluster_id in clusters_argument_df[initial_cluster_id_column].unique()
+        if cluster_id not in reused_cluster_ids
+    ]
+
     initial_label_df = initial_labelling(
         initial_labelling_prompt,
         clusters_argument_df,
@@ -54,7 +65,9 @@ def hierarchical_initial_labelling(config: dict) -> None:
         config["provider"],
         config.get("local_llm_address"),
         config,  # configを渡して、トークン使用量を累積できるようにする
+        cluster_ids=target_cluster_ids,
     )
+    initial_label_df = pd.concat([reused_label_df, initial_label_df], ignore_index=True)
     print("start initial labelling")
     initial_clusters_argument_df = clusters_argument_df.merge(
         initial_label_df,
@@ -71,6 +84,31 @@ def hierarchical_initial_labelling(config: dict) -> None:
     initial_clusters_argument_df.to_csv(path, index=False)
 
 
+def _load_reusable_labels(config: dict, clusters_df: pd.DataFrame, cluster_id_column: str) -> pd.DataFrame:
+    """差分更新時に再利用できる前回のラベリング結果を返す（再利用できるものがなければ空のDataFrame）"""
+    dataset = config["output_dir"]
+    empty = pd.DataFrame(columns=["cluster_id", "label", "description"])
+    previous_clusters_df = load_previous_clusters(dataset)
+    previous_labels_path = f"outputs/{dataset}/hierarchical_initial_labels.csv"
+    if not is_incremental(config) or previous_clusters_df is None or not os.path.exists(previous_labels_path):
+        return empty
+
+    threshold = config["hierarchical_initial_labelling"].get("relabel_threshold", 0.1)
+    changed = find_changed_clusters(previous_clusters_df, clusters_df, cluster_id_column, threshold)
+    prefix = cluster_id_column.replace("-id", "")
+    previous_labels_df = (
+        pd.read_csv(previous_labels_path, usecols=["cluster_id", f"{prefix}-label", f"{prefix}-description"])
+        .drop_duplicates("cluster_id")
+        .rename(columns={f"{prefix}-label": "label", f"{prefix}-description": "description"})
+    )
+    reused = previous_labels_df[
+        previous_labels_df["cluster_id"].isin(set(clusters_df[cluster_id_column]))
+        & ~previous_labels_df["cluster_id"].isin(changed)
+    ]
+    print(f"Reusing labels of {len(reused)} clusters, relabelling {len(changed)} changed clusters")
+    return reused.reset_index(drop=True)
+
+
 def initial_labelling(
     prompt: str,
     clusters_df: pd.DataFrame,
@@ -80,6 +118,7 @@ def initial_labelling(
     provider: str = "openai",
     local_llm_address: str | None = None,
     config: dict | None = None,  # configを追加
+    cluster_ids: list[str] | None = None,
 ) -> pd.DataFrame:
     """各クラスタに対して初期ラベリングを実行する
 
@@ -92,13 +131,17 @@ def initial_labelling(
         provider: LLMプロバイダー
         local_llm_address: ローカルLLMのアドレス
         config: 設定情報を含む辞書（トークン使用量の累積に使用）
+        cluster_ids: ラベリング対象のクラスタID（省略時は最下層の全クラスタ）
 
     Returns:
         各クラスタのラベリング結果を含むDataFrame
     """
     cluster_columns = [col for col in clusters_df.columns if col.startswith("cluster-level-")]
     initial_cluster_column = cluster_columns[-1]
-    cluster_ids = clusters_df[initial_cluster_column].unique()
+    if cluster_ids is None:
+        cluster_ids = clusters_df[initial_cluster_column].unique()
+    # クラスタごとに全行を比較しないよう、所属する意見の行位置を一度だけ求めておく
+    cluster_index = ClusterIndex(clusters_df, [initial_cluster_column])
     process_func = partial(
         process_initial_labelling,
         df=clusters_df,
@@ -109,10 +152,11 @@ def initial_labelling(
         provider=provider,
         local_llm_address=local_llm_address,
         config=config,  # configを渡す
+        cluster_index=cluster_index,
     )
     with ThreadPoolExecutor(max_workers=workers) as executor:
         results = list(executor.map(process_func, cluster_ids))
-    return pd.DataFrame(results)
+    return pd.DataFrame(results, columns=["cluster_id", "label", "description"])
 
 
 class LabellingFromat(BaseModel):
@@ -132,6 +176,7 @@ def process_initial_labelling(
     provider: str = "openai",
     local_llm_address: str | None = None,
     config: dict | None = None,  # configを追加
+    cluster_index: ClusterIndex | None = None,
 ) -> LabellingResult:
     """個別のクラスタに対してラベリングを実行する
 
@@ -145,11 +190,15 @@ def process_initial_labelling(
         provider: LLMプロバイダー
         local_llm_address: ローカルLLMのアドレス
         config: 設定情報を含む辞書（トークン使用量の累積に使用）
+        cluster_index: target_column の索引（省略時はDataFrame全体を比較して絞り込む）
 
     Returns:
         クラスタのラベリング結果
     """
-    cluster_data = df[df[target_column] == cluster_id]
+    if cluster_index is not None:
+        cluster_data = cluster_index.rows(df, target_column, cluster_id)
+    else:
+        cluster_data = df[df[target_column] == cluster_id]
     sampling_num = min(sampling_num, len(cluster_data))
     cluster = cluster_data.sample(sampling_num)
     input = "\n".join(cluster["argument"].values)
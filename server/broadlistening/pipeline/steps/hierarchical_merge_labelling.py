@@ -9,6 +9,8 @@ import pandas as pd
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
+from services.cluster_index import ClusterIndex
+from services.incremental import find_changed_clusters, is_incremental, load_previous_clusters
 from services.llm import request_to_chat_ai
 
 
@@ -59,31 +61,69 @@ def hierarchical_merge_labelling(config: dict) -> None:
     clusters_df = pd.read_csv(f"outputs/{dataset}/hierarchical_initial_labels.csv")
 
     cluster_id_columns: list[str] = _filter_id_columns(clusters_df.columns)
+    # クラスタごとに全行を比較しないよう、各階層で所属する意見の行位置を一度だけ求め、以降の処理で共有する
+    # merge_labelling はラベルの列を追加するだけで行の並びを変えないため、結果のDataFrameにも同じ索引を使える
+    cluster_index = ClusterIndex(clusters_df, cluster_id_columns)
+    # 差分更新では、所属する意見の変化が閾値以下のクラスタは前回のラベルを再利用する
+    reusable_labels = _load_reusable_labels(config, clusters_df, cluster_id_columns)
     # ボトムクラスタのラベル・説明とクラスタid付きの各argumentを入力し、各階層のクラスタラベル・説明を生成し、argumentに付けたdfを作成
     merge_result_df = merge_labelling(
         clusters_df=clusters_df,
         cluster_id_columns=sorted(cluster_id_columns, reverse=True),
         config=config,
+        reusable_labels=reusable_labels,
+        cluster_index=cluster_index,
     )
     # 上記のdfから各クラスタのlevel, id, label, description, valueを取得してdfを作成
     melted_df = melt_cluster_data(merge_result_df)
     # 上記のdfに親子関係を追加
-    parent_child_df = _build_parent_child_mapping(merge_result_df, cluster_id_columns)
+    parent_child_df = _build_parent_child_mapping(merge_result_df, cluster_id_columns, cluster_index)
     melted_df = melted_df.merge(parent_child_df, on=["level", "id"], how="left")
-    density_df = calculate_cluster_density(melted_df, config)
+    density_df = calculate_cluster_density(melted_df, merge_result_df, cluster_index)
     density_df.to_csv(merge_path, index=False)
 
 
-def _build_parent_child_mapping(df: pd.DataFrame, cluster_id_columns: list[str]):
+def _load_reusable_labels(
+    config: dict, clusters_df: pd.DataFrame, cluster_id_columns: list[str]
+) -> dict[str, dict[str, ClusterValues]]:
+    """差分更新時に再利用できる前回のラベルを、ID列名ごとに {クラスタID: ClusterValues} の形で返す"""
+    dataset = config["output_dir"]
+    previous_clusters_df = load_previous_clusters(dataset)
+    merge_path = f"outputs/{dataset}/hierarchical_merge_labels.csv"
+    if not is_incremental(config) or previous_clusters_df is None or not os.path.exists(merge_path):
+        return {}
+
+    threshold = config["hierarchical_merge_labelling"].get("relabel_threshold", 0.1)
+    previous_labels_df = pd.read_csv(merge_path, usecols=["level", "id", "label", "description"])
+    reusable_labels = {}
+    for id_column in cluster_id_columns:
+        level = int(id_column.replace("cluster-level-", "").replace("-id", ""))
+        changed = find_changed_clusters(previous_clusters_df, clusters_df, id_column, threshold)
+        level_df = previous_labels_df[(previous_labels_df["level"] == level) & ~previous_labels_df["id"].isin(changed)]
+        reusable_labels[id_column] = {
+            cluster_id: ClusterValues(label=label, description=description)
+            for cluster_id, label, description in zip(
+                level_df["id"], level_df["label"], level_df["description"], strict=True
+            )
+        }
+    return reusable_labels
+
+
+def _build_parent_child_mapping(
+    df: pd.DataFrame, cluster_id_columns: list[str], cluster_index: ClusterIndex | None = None
+):
     """クラスタ間の親子関係をマッピングする
 
     Args:
         df: クラスタリング結果のDataFrame
         cluster_id_columns: クラスタIDのカラム名のリスト
+        cluster_index: df のクラスタIDの索引（省略時は作成する）
 
     Returns:
         親子関係のマッピング情報を含むDataFrame
     """
+    if cluster_index is None:
+        cluster_index = ClusterIndex(df, cluster_id_columns)
     results = []
     top_cluster_column = cluster_id_columns[0]
     top_cluster_values = df[top_cluster_column].unique()
@@ -102,8 +142,9 @@ def _build_parent_child_mapping(df: pd.DataFrame, cluster_id_columns: list[str])
         current_level = current_column.replace("-id", "").replace("cluster-level-", "")
         # 現在のレベルのクラスタid
         current_cluster_values = df[current_column].unique()
+        children_values = df[children_column].to_numpy()
         for current_id in current_cluster_values:
-            children_ids = df.loc[df[current_column] == current_id, children_column].unique()
+            children_ids = pd.unique(children_values[cluster_index.positions(current_column, current_id)])
             for child_id in children_ids:
                 results.append(
                     {
@@ -167,17 +208,29 @@ def melt_cluster_data(df: pd.DataFrame) -> pd.DataFrame:
     return pd.DataFrame(all_rows)
 
 
-def merge_labelling(clusters_df: pd.DataFrame, cluster_id_columns: list[str], config) -> pd.DataFrame:
+def merge_labelling(
+    clusters_df: pd.DataFrame,
+    cluster_id_columns: list[str],
+    config,
+    reusable_labels: dict[str, dict[str, ClusterValues]] | None = None,
+    cluster_index: ClusterIndex | None = None,
+) -> pd.DataFrame:
     """階層的なクラスタのマージラベリングを実行する
 
     Args:
         clusters_df: クラスタリング結果のDataFrame
         cluster_id_columns: クラスタIDのカラム名のリスト
         config: 設定情報を含む辞書
+        reusable_labels: LLMを呼ばずに再利用するラベル（ID列名ごとの {クラスタID: ClusterValues}）
+        cluster_index: clusters_df のクラスタIDの索引（省略時は作成する）
 
     Returns:
-        マージラベリング結果を含むDataFrame
+        マージラベリング結果を含むDataFrame（clusters_df と同じ行の並びに、各階層のラベル・説明の列を追加したもの）
     """
+    reusable_labels = reusable_labels or {}
+    if cluster_index is None:
+        cluster_index = ClusterIndex(clusters_df, cluster_id_columns)
+    clusters_df = clusters_df.copy()
     for idx in tqdm(range(len(cluster_id_columns) - 1)):
         previous_columns = ClusterColumns.from_id_column(cluster_id_columns[idx])
         current_columns = ClusterColumns.from_id_column(cluster_id_columns[idx + 1])
@@ -188,19 +241,37 @@ def merge_labelling(clusters_df: pd.DataFrame, cluster_id_columns: list[str], co
             current_columns=current_columns,
             previous_columns=previous_columns,
             config=config,
+            cluster_index=cluster_index,
         )
 
+        reusable = reusable_labels.get(current_columns.id, {})
         current_cluster_ids = sorted(clusters_df[current_columns.id].unique())
+        target_cluster_ids = [cluster_id for cluster_id in current_cluster_ids if cluster_id not in reusable]
         with ThreadPoolExecutor(max_workers=config["hierarchical_merge_labelling"]["workers"]) as executor:
             responses = list(
                 tqdm(
-                    executor.map(process_fn, current_cluster_ids),
-                    total=len(current_cluster_ids),
+                    executor.map(process_fn, target_cluster_ids),
+                    total=len(target_cluster_ids),
                 )
             )
+        responses.extend(
+            {
+                current_columns.id: cluster_id,
+                current_columns.label: reusable[cluster_id].label,
+                current_columns.description: reusable[cluster_id].description,
+            }
+            for cluster_id in current_cluster_ids
+            if cluster_id in reusable
+        )
 
-        current_result_df = pd.DataFrame(responses)
-        clusters_df = clusters_df.merge(current_result_df, on=[current_columns.id])
+        # 索引の行位置が使えるよう、mergeではなく列の追加でラベルを付ける
+        current_result_df = pd.DataFrame(responses).set_index(current_columns.id)
+        clusters_df[current_columns.label] = clusters_df[current_columns.id].map(
+            current_result_df[current_columns.label]
+        )
+        clusters_df[current_columns.description] = clusters_df[current_columns.id].map(
+            current_result_df[current_columns.description]
+        )
     return clusters_df
 
 
@@ -217,6 +288,7 @@ def process_merge_labelling(
     current_columns: ClusterColumns,
     previous_columns: ClusterColumns,
     config,
+    cluster_index: ClusterIndex | None = None,
 ):
     """個別のクラスタに対してマージラベリングを実行する
 
@@ -226,16 +298,19 @@ def process_merge_labelling(
         current_columns: 現在のレベルのカラム情報
         previous_columns: 前のレベルのカラム情報
         config: 設定情報を含む辞書
+        cluster_index: result_df のクラスタIDの索引（省略時はDataFrame全体を比較して絞り込む）
 
     Returns:
         マージラベリング結果を含む辞書
     """
+    if cluster_index is not None:
+        current_cluster_data = cluster_index.rows(result_df, current_columns.id, target_cluster_id)
+    else:
+        current_cluster_data = result_df[result_df[current_columns.id] == target_cluster_id]
 
     def filter_previous_values(df: pd.DataFrame, previous_columns: ClusterColumns) -> list[ClusterValues]:
         """前のレベルのクラスタ情報を取得する"""
-        previous_records = df[df[current_columns.id] == target_cluster_id][
-            [previous_columns.label, previous_columns.description]
-        ].drop_duplicates()
+        previous_records = df[[previous_columns.label, previous_columns.description]].drop_duplicates()
         previous_values = [
             ClusterValues(
                 label=row[previous_columns.label],
@@ -245,7 +320,7 @@ def process_merge_labelling(
         ]
         return previous_values
 
-    previous_values = filter_previous_values(result_df, previous_columns)
+    previous_values = filter_previous_values(current_cluster_data, previous_columns)
     if len(previous_values) == 1:
         return {
             current_columns.id: target_cluster_id,
@@ -255,7 +330,6 @@ def process_merge_labelling(
     elif len(previous_values) == 0:
         raise ValueError(f"クラスタ {target_cluster_id} には前のレベルのクラスタが存在しません。")
 
-    current_cluster_data = result_df[result_df[current_columns.id] == target_cluster_id]
     sampling_num = min(
         config["hierarchical_merge_labelling"]["sampling_num"],
         len(current_cluster_data),
@@ -300,15 +374,23 @@ def process_merge_labelling(
         }
 
 
-def calculate_cluster_density(melted_df: pd.DataFrame, config: dict):
-    """クラスタ内の密度計算"""
-    hierarchical_cluster_df = pd.read_csv(f"outputs/{config['output_dir']}/hierarchical_clusters.csv")
+def calculate_cluster_density(
+    melted_df: pd.DataFrame, clusters_df: pd.DataFrame, cluster_index: ClusterIndex | None = None
+):
+    """クラスタ内の密度計算
+
+    Args:
+        melted_df: 行形式に変換したクラスタデータ
+        clusters_df: 各意見の座標（x, y）とクラスタIDを含むDataFrame
+        cluster_index: clusters_df のクラスタIDの索引（省略時は作成する）
+    """
+    if cluster_index is None:
+        cluster_index = ClusterIndex(clusters_df, _filter_id_columns(clusters_df.columns))
+    xy = clusters_df[["x", "y"]].to_numpy()
 
     densities = []
     for level, c_id in zip(melted_df["level"], melted_df["id"], strict=False):
-        cluster_embeds = hierarchical_cluster_df[hierarchical_cluster_df[f"cluster-level-{level}-id"] == c_id][
-            ["x", "y"]
-        ].values
+        cluster_embeds = xy[cluster_index.positions(f"cluster-level-{level}-id", c_id)]
         density = calculate_density(cluster_embeds)
         densities.append(density)
 
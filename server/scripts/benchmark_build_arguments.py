@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""hierarchical_aggregation の _build_arguments のベンチマーク
+
+合成データ（意見数の半分の件数のコメント、属性カラム3つ、URL付き）で _build_arguments の実行時間を計測し、
+意見数に対して線形に増えることを確認します。1件あたりの時間がほぼ一定であれば線形です。
+
+実行方法:
+    cd server && rye run python scripts/benchmark_build_arguments.py --sizes 12500 25000 50000 100000 200000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# パイプラインのステップは broadlistening/pipeline をカレントとして実行される前提のため、パスを通す
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "broadlistening", "pipeline")
+)
+
+from steps.hierarchical_aggregation import _build_arguments
+
+
+def make_dataset(num_args: int, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    num_comments = max(1, num_args // 2)
+    comments = pd.DataFrame(
+        {
+            "comment-id": np.arange(num_comments),
+            "comment-body": [f"コメント{i}" for i in range(num_comments)],
+            "url": [f"https://example.com/{i}" for i in range(num_comments)],
+            "attribute_age": rng.integers(10, 90, num_comments),
+            "attribute_area": rng.choice(["北海道", "東京都", "大阪府", "沖縄県"], num_comments),
+            "attribute_score": rng.random(num_comments),
+        }
+    )
+    comment_ids = rng.integers(0, num_comments, num_args)
+    arg_ids = [f"A{comment_id}_{i}" for i, comment_id in enumerate(comment_ids)]
+    relation_df = pd.DataFrame({"arg-id": arg_ids, "comment-id": comment_ids})
+    clusters = pd.DataFrame(
+        {
+            "arg-id": arg_ids,
+            "argument": [f"意見{i}" for i in range(num_args)],
+            "x": rng.random(num_args),
+            "y": rng.random(num_args),
+            "cluster-level-1-id": [f"1_{i}" for i in rng.integers(0, 10, num_args)],
+            "cluster-level-2-id": [f"2_{i}" for i in rng.integers(0, 100, num_args)],
+        }
+    )
+    return clusters, comments, relation_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[12500, 25000, 50000, 100000, 200000])
+    parser.add_argument("--repeat", type=int, default=3, help="各サイズの計測回数（最短時間を採用）")
+    args = parser.parse_args()
+
+    config = {"enable_source_link": True}
+    print(f"{'arguments':>10} {'seconds':>10} {'us/argument':>12}")
+    for size in args.sizes:
+        clusters, comments, relation_df = make_dataset(size)
+        elapsed = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = _build_arguments(clusters, comments, relation_df.copy(), config)
+            elapsed.append(time.perf_counter() - start)
+        assert len(result) == size
+        best = min(elapsed)
+        print(f"{size:>10} {best:>10.3f} {best / size * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Geminiの埋め込みリクエストのベンチマーク
+
+ローカルに起動したGemini APIのスタブサーバーに対して、
+1件ずつ embed_content を呼ぶ従来の方法と、バッチ化・並列化した request_to_gemini_embed の
+スループット（件/秒）を比較します。実際のAPIにはリクエストしません。
+
+実行方法:
+    cd server && rye run python scripts/benchmark_gemini_embed.py --texts 2000 --latency-ms 80
+
+スタブサーバーは1リクエストごとに --latency-ms だけ待ってから、次元数 --dim のベクトルを返します。
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# serverフォルダから実行する場合のパス設定
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google.generativeai as genai
+
+from broadlistening.pipeline.services import llm
+
+
+def start_stub_server(latency: float, dim: int) -> ThreadingHTTPServer:
+    """embedContent / batchEmbedContents に応答するスタブサーバーを起動する"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            values = [0.1] * dim
+            if "requests" in body:
+                response = {"embeddings": [{"values": values} for _ in body["requests"]]}
+            else:
+                response = {"embedding": {"values": values}}
+            data = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def use_stub_endpoint(endpoint: str) -> None:
+    """request_to_gemini_embed 内の genai.configure でもスタブサーバーを向くようにする"""
+    configure = genai.configure
+
+    def configure_stub(**kwargs):
+        configure(**kwargs, transport="rest", client_options={"api_endpoint": endpoint})
+
+    genai.configure = configure_stub
+    genai.configure(api_key="benchmark")
+
+
+def embed_one_by_one(texts: list[str], model: str) -> list[list[float]]:
+    """従来の実装: 1件ずつ順番に embed_content を呼ぶ"""
+    return [genai.embed_content(model=model, content=text)["embedding"] for text in texts]
+
+
+def run(name: str, func, texts: list[str]) -> float:
+    start = time.perf_counter()
+    embeds = func()
+    elapsed = time.perf_counter() - start
+    assert len(embeds) == len(texts)
+    print(f"{name:<28} {elapsed:8.2f}s {len(texts) / elapsed:10.1f} texts/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=1000, help="埋め込むテキストの件数")
+    parser.add_argument("--latency-ms", type=float, default=50, help="スタブサーバーの1リクエストあたりの応答時間")
+    parser.add_argument("--dim", type=int, default=768, help="ベクトルの次元数")
+    parser.add_argument("--workers", type=int, default=llm.GEMINI_EMBED_WORKERS, help="バッチの並列数")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency_ms / 1000, args.dim)
+    use_stub_endpoint(f"http://127.0.0.1:{server.server_port}")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+    model = "models/gemini-embedding-001"
+    texts = [f"意見 {i}: 公共交通の本数を増やしてほしい" for i in range(args.texts)]
+    print(f"texts={args.texts} latency={args.latency_ms}ms dim={args.dim} workers={args.workers}")
+
+    baseline = run("per-text loop", lambda: embed_one_by_one(texts, model), texts)
+    batched = run(
+        "batched + concurrent",
+        lambda: llm.request_to_gemini_embed(texts, model, workers=args.workers),
+        texts,
+    )
+    print(f"speedup: {baseline / batched:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""hierarchical_clustering の通常の処理と大規模データ向けの処理（large_dataset_mode）のベンチマーク
+
+合成データ（クラスタ構造を持つ float32 の埋め込み）で、UMAPによる射影と階層クラスタリングの実行時間と
+ピークメモリ（最大RSS）を意見数ごとに計測します。メモリを正しく計測するため、1回の計測ごとに別プロセスで実行します。
+最大RSSには合成データ自体（意見数 × 次元数 × 4バイト）も含まれます。
+
+実行方法:
+    cd server && rye run python scripts/benchmark_hierarchical_clustering.py --sizes 5000 20000 50000 100000 --dim 1536
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "broadlistening", "pipeline")
+MODES = {"standard": False, "large": True}
+
+
+def make_embeddings(num_args: int, dim: int, num_topics: int = 50, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_topics, dim), dtype=np.float32)
+    topics = rng.integers(0, num_topics, num_args)
+    embeddings = centers[topics] + 0.5 * rng.standard_normal((num_args, dim), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def run_once(size: int, dim: int, mode: str, cluster_nums: list[int]) -> dict:
+    # パイプラインのステップは broadlistening/pipeline をカレントとして実行される前提のため、パスを通す
+    sys.path.insert(0, PIPELINE_DIR)
+    from services.clustering import hierarchical_clustering_embeddings, project_embeddings
+
+    embeddings = make_embeddings(size, dim)
+    large_dataset_mode = MODES[mode]
+    start = time.perf_counter()
+    umap_embeds = project_embeddings(embeddings, large_dataset_mode=large_dataset_mode)
+    projected = time.perf_counter()
+    hierarchical_clustering_embeddings(umap_embeds, list(cluster_nums), use_minibatch=large_dataset_mode)
+    end = time.perf_counter()
+    return {
+        "umap_seconds": projected - start,
+        "clustering_seconds": end - projected,
+        # Linuxでは ru_maxrss の単位はKB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000, 50000, 100000])
+    parser.add_argument("--dim", type=int, default=1536, help="埋め込みの次元数")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--cluster-nums", type=int, nargs="+", default=[3, 6, 12, 24])
+    parser.add_argument("--child", nargs=2, metavar=("SIZE", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        size, mode = int(args.child[0]), args.child[1]
+        print(json.dumps(run_once(size, args.dim, mode, args.cluster_nums)))
+        return
+
+    print(f"{'arguments':>10} {'mode':>9} {'umap [s]':>9} {'kmeans [s]':>11} {'peak RSS [MB]':>14}")
+    for size in args.sizes:
+        for mode in args.modes:
+            command = [sys.executable, __file__, "--child", str(size), mode, "--dim", str(args.dim), "--cluster-nums"]
+            output = subprocess.run(
+                command + [str(n) for n in args.cluster_nums], check=True, capture_output=True, text=True
+            ).stdout
+            # ステップが出力するログの後ろに、計測結果のJSONが1行出力される
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{size:>10} {mode:>9} {result['umap_seconds']:>9.1f} {result['clustering_seconds']:>11.2f} "
+                f"{result['peak_rss_mb']:>14.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,9 @@ class Settings(BaseSettings):
     INPUT_DIR: Path = TOOL_DIR / "pipeline" / "inputs"
     DATA_DIR: Path = BASE_DIR / "data"
 
+    # 公開APIがメモリ上に保持するレポート結果の上限サイズ（MB）。0でキャッシュしない
+    REPORT_CACHE_MAX_MB: int = Field(env="REPORT_CACHE_MAX_MB", default=256)
+
     # ストレージ設定
     STORAGE_TYPE: StorageType = Field(env="STORAGE_TYPE", default="local")
     AZURE_BLOB_STORAGE_ACCOUNT_NAME: str | None = Field(env="AZURE_BLOB_STORAGE_ACCOUNT_NAME", default=None)
@@ -8,7 +8,7 @@ except Exception:  # pragma: no cover
     google_exceptions = None
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, Security
-from fastapi.responses import FileResponse, ORJSONResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from fastapi.security.api_key import APIKeyHeader
 
 from src.config import settings
@@ -22,6 +22,7 @@ from src.schemas.report_config import ReportConfigUpdate
 from src.services.llm_models import get_models_by_provider
 from src.services.llm_pricing import LLMPricing
 from src.services.report_launcher import execute_aggregation, launch_report_generation
+from src.services.report_progress import iter_progress_events
 from src.services.report_status import (
     add_analysis_data,
     invalidate_report_cache,
@@ -79,6 +80,19 @@ async def download_comments_csv(slug: str, api_key: str = Depends(verify_admin_a
     return FileResponse(path=str(csv_path), media_type="text/csv", filename=f"kouchou_{slug}.csv")
 
 
+@router.get("/admin/reports/{slug}/status/stream", dependencies=[Depends(verify_admin_api_key)])
+async def stream_step_progress(slug: str, request: Request) -> StreamingResponse:
+    """ステップの遷移・処理件数・トークン使用量を Server-Sent Events で送る
+
+    パイプラインが書き出す進捗ファイルが更新されたときだけイベントを送り、パイプラインが終了したら接続を閉じる
+    """
+    return StreamingResponse(
+        iter_progress_events(slug, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/admin/reports/{slug}/status/step-json", dependencies=[Depends(verify_admin_api_key)])
 async def get_current_step(slug: str) -> dict:
     status_file = settings.REPORT_DIR / slug / "hierarchical_status.json"
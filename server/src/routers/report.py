@@ -1,17 +1,23 @@
-import json
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, Security
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Security
 from fastapi.security.api_key import APIKeyHeader
+from starlette.concurrency import run_in_threadpool
 
 from src.config import settings
 from src.schemas.report import Report, ReportStatus, ReportVisibility
+from src.services.report_cache import etag_matches, report_result_cache, select_encoding
 from src.services.report_status import load_status_as_reports
 
 logger = logging.getLogger("uvicorn")
 
 router = APIRouter()
 
+# 意見データを列指向にエンコードしたレポート（パイプラインの services/columnar_result.py を参照）
+# Acceptヘッダにこのメディアタイプを含むリクエストには、存在すれば列指向の形式を返す
+COLUMNAR_MEDIA_TYPE = "application/vnd.kouchou-ai.columnar+json"
+COLUMNAR_RESULT_FILENAME = "hierarchical_result_columnar.json"
+
 api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
 
 
@@ -31,7 +37,7 @@ async def reports() -> list[Report]:
 
 
 @router.get("/reports/{slug}")
-async def report(slug: str, api_key: str = Depends(verify_public_api_key)) -> dict:
+async def report(slug: str, request: Request, api_key: str = Depends(verify_public_api_key)) -> Response:
     report_path = settings.REPORT_DIR / slug / "hierarchical_result.json"
     all_reports = load_status_as_reports()
     target_report_status = next((report for report in all_reports if report.slug == slug), None)
@@ -45,13 +51,25 @@ async def report(slug: str, api_key: str = Depends(verify_public_api_key)) -> di
     if not report_path.exists():
         raise HTTPException(status_code=404, detail="Report not found")
 
-    with open(report_path) as f:
-        report_result = json.load(f)
-
-    # レポートにvisibilityを追加
-    report_result["visibility"] = target_report_status.visibility.value
-
-    return report_result
+    visibility = target_report_status.visibility.value
+    columnar_path = settings.REPORT_DIR / slug / COLUMNAR_RESULT_FILENAME
+    if COLUMNAR_MEDIA_TYPE in request.headers.get("accept", "") and columnar_path.exists():
+        media_type, result_path = COLUMNAR_MEDIA_TYPE, columnar_path
+    else:
+        media_type, result_path = "application/json", report_path
+
+    # レポートにvisibilityを追加したJSONを、圧縮済みの表現とともにファイルが更新されるまでメモリ上に保持して返す
+    # キャッシュのミス時の読み込み・圧縮で他のリクエストを止めないよう、イベントループの外で実行する
+    cached = await run_in_threadpool(report_result_cache.get, result_path, visibility)
+    encoding = select_encoding(request.headers.get("accept-encoding", ""))
+    body, etag = cached.representation(encoding)
+    # Accept・Accept-Encodingヘッダによってレスポンスが変わるため、キャッシュがヘッダごとに区別されるようにする
+    headers = {"Vary": "Accept, Accept-Encoding", "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding in cached.encoded:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
 
 
 @router.get("/test-error")
@@ -0,0 +1,182 @@
+"""公開APIで返すレポート結果（hierarchical_result.json）のメモリキャッシュ
+
+レポート結果は数MB〜数十MBのJSONになるため、リクエストのたびにファイルを読み込んでパースすると
+人気のあるレポートへのアクセスが集中した際に遅くなる。ここでは、レスポンスとしてそのまま返せる
+シリアライズ済みのバイト列を、ファイルのパスごとにLRUで保持する。
+
+- ファイルの更新時刻とサイズが変わった場合は読み込み直す
+- invalidate_report_cache（レポートのメタデータ・公開範囲の更新時）から invalidate が呼ばれる
+- 保持するバイト列の合計が上限（REPORT_CACHE_MAX_MB）を超えた場合は、最も古くに使われたものから破棄する
+- 読み込み時に gzip（brotli がインストールされていれば brotli も）で圧縮したバイト列と強いETagを作っておき、
+  リクエストごとに圧縮やハッシュの計算をしない
+- 読み込みと圧縮は数MBのレポートでは時間がかかるため、呼び出し側はイベントループの外（スレッドプール）で get を呼ぶ
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import orjson
+
+from src.config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTITY_ENCODING = "identity"
+# 同じ品質値の場合に優先する順
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# キャッシュのミス時にその場で圧縮するため、圧縮率より速度を優先した設定にする
+# （brotli の既定の品質11や gzip の9は数MBのレポートで数秒かかる）
+GZIP_COMPRESSLEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime を固定し、同じ内容からは同じバイト列（=同じETag）ができるようにする
+    return gzip.compress(body, compresslevel=GZIP_COMPRESSLEVEL, mtime=0)
+
+
+@dataclass
+class CachedReportResult:
+    """シリアライズ済みのレポート結果と、その圧縮済みの表現"""
+
+    body: bytes
+    etag: str
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+    def representation(self, encoding: str) -> tuple[bytes, str]:
+        """Content-Encoding に対応するバイト列とETagを返す。ETagは表現ごとに異なる値にする
+
+        圧縮済みの表現がない場合は、圧縮していないバイト列を返す
+        """
+        if encoding not in self.encoded:
+            return self.body, self.etag
+        return self.encoded[encoding], f'{self.etag[:-1]}-{encoding}"'
+
+
+@dataclass
+class _CacheEntry:
+    signature: tuple[int, int]
+    visibility: str
+    result: CachedReportResult
+
+
+def select_encoding(accept_encoding: str, available: tuple[str, ...] = SUPPORTED_ENCODINGS) -> str:
+    """Accept-Encoding ヘッダから、返すContent-Encodingを選ぶ。圧縮できない場合は identity を返す"""
+    qualities: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    best, best_quality = IDENTITY_ENCODING, 0.0
+    for encoding in available:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match ヘッダがETagに一致するか（弱い比較）"""
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag.removeprefix("W/") for tag in tags)
+
+
+class ReportResultCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: Path, visibility: str) -> CachedReportResult:
+        """レポート結果にvisibilityを追加したJSONのバイト列とETag、圧縮済みの表現を返す
+
+        Raises:
+            FileNotFoundError: ファイルが存在しない場合
+        """
+        stat = path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        key = str(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature and entry.visibility == visibility:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.result
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            result = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # パイプラインが書き出したNaNを含むJSONはorjsonでは読めないため、標準のjsonで読む（NaNはnullとして返す）
+            result = json.loads(data)
+        result["visibility"] = visibility
+        body = orjson.dumps(result)
+        cached = CachedReportResult(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        if len(body) > self.max_bytes:
+            # キャッシュに載らない結果は、リクエストごとに圧縮するとかえって遅くなるため圧縮しない
+            return cached
+        cached.encoded = {encoding: _compress(body, encoding) for encoding in SUPPORTED_ENCODINGS}
+
+        with self._lock:
+            self._remove(key)
+            if cached.size <= self.max_bytes:
+                self._entries[key] = _CacheEntry(signature=signature, visibility=visibility, result=cached)
+                self._total_bytes += cached.size
+                while self._total_bytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+        return cached
+
+    def invalidate(self, slug: str) -> None:
+        """レポートのファイルをすべてキャッシュから取り除く"""
+        with self._lock:
+            for key in [key for key in self._entries if Path(key).parent.name == slug]:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.result.size
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._total_bytes}
+
+
+report_result_cache = ReportResultCache(max_bytes=settings.REPORT_CACHE_MAX_MB * 1024 * 1024)
@@ -9,7 +9,7 @@ import pandas as pd
 
 from src.config import settings
 from src.schemas.admin_report import ReportInput
-from src.services.report_status import add_new_report_to_status, set_status, update_token_usage
+from src.services.report_status import add_new_report_to_status, compact_status, set_status, update_token_usage
 from src.services.report_sync import ReportSyncService
 from src.utils.logger import setup_logger
 
@@ -147,7 +147,8 @@ def _monitor_process(process: subprocess.Popen, slug: str) -> None:
         report_sync_service.sync_input_file_to_storage(slug)
         # 設定ファイルをストレージに同期
         report_sync_service.sync_config_file_to_storage(slug)
-        # ステータスファイルをストレージに同期
+        # ジャーナルに追記された更新を report_status.json に反映してから、ストレージに同期
+        compact_status()
         report_sync_service.sync_status_file_to_storage()
 
     else:
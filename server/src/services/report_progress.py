@@ -0,0 +1,107 @@
+"""作成中のレポートの進捗の読み込み
+
+パイプラインは現在のステップ・処理件数・トークン使用量を hierarchical_progress.json に書き出す
+（broadlistening/pipeline/services/progress.py を参照）。ここではそれを読み、管理画面向けの形式に変換する。
+多数の管理者が作成中のレポートの進捗を監視していても、読み込みとパースがファイルの更新ごとに1回で済むよう、
+ファイルの状態（更新時刻・サイズ）ごとに変換結果を保持する。
+
+進捗ファイルがない場合（進捗ファイルを書き出す前のパイプラインで作成中のレポートなど）は hierarchical_status.json を読む。
+"""
+
+import asyncio
+import json
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from src.config import settings
+
+PROGRESS_FILENAME = "hierarchical_progress.json"
+STATUS_FILENAME = "hierarchical_status.json"
+TERMINAL_STATUSES = ("completed", "error")
+POLL_INTERVAL_SECONDS = 1.0
+# 進捗が変わらない間も接続を維持するため、この間隔でコメント行を送る
+HEARTBEAT_INTERVAL_SECONDS = 15.0
+
+_lock = threading.Lock()
+_cache: dict[str, tuple[tuple, dict[str, Any]]] = {}
+
+
+def build_step_progress(status: dict[str, Any]) -> dict[str, Any]:
+    """パイプラインの進捗（またはステータス）を管理画面向けの形式に変換する"""
+    if status.get("status") in TERMINAL_STATUSES:
+        current_step = status["status"]
+    else:
+        # current_job が空文字列の場合も "loading" とする
+        current_step = status.get("current_job") or "loading"
+
+    return {
+        "status": status.get("status", "running"),
+        "current_step": current_step,
+        "current_step_progress": status.get("current_job_progress"),
+        "current_step_tasks": status.get("current_jop_tasks"),
+        "completed_steps": [
+            job["step"] if isinstance(job, dict) else job for job in status.get("completed_jobs") or []
+        ],
+        "token_usage": status.get("total_token_usage") or 0,
+        "token_usage_input": status.get("token_usage_input") or 0,
+        "token_usage_output": status.get("token_usage_output") or 0,
+        "estimated_cost": status.get("estimated_cost") or 0.0,
+        "provider": status.get("provider"),
+        "model": status.get("model"),
+    }
+
+
+def get_step_progress(slug: str) -> dict[str, Any]:
+    """レポートの進捗を返す。ファイルが前回から変わっていなければ、読み込まずに前回の結果を返す"""
+    report_dir = settings.REPORT_DIR / slug
+    for path in (report_dir / PROGRESS_FILENAME, report_dir / STATUS_FILENAME):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        signature = (str(path), stat.st_mtime_ns, stat.st_size)
+        with _lock:
+            cached = _cache.get(slug)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        try:
+            with open(path) as f:
+                progress = build_step_progress(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            # hierarchical_status.json の書き込み中に読んだ場合は、前回の結果を返す
+            return cached[1] if cached is not None else {"current_step": "loading"}
+        with _lock:
+            _cache[slug] = (signature, progress)
+        return progress
+
+    return {"current_step": "loading"}
+
+
+def format_event(progress: dict[str, Any]) -> str:
+    return f"event: progress\ndata: {json.dumps(progress, ensure_ascii=False)}\n\n"
+
+
+async def iter_progress_events(
+    slug: str,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_interval: float = POLL_INTERVAL_SECONDS,
+    heartbeat_interval: float = HEARTBEAT_INTERVAL_SECONDS,
+) -> AsyncIterator[str]:
+    """進捗が変わるたびに Server-Sent Events のイベントを返す。パイプラインが終了するか、接続が切れたら終わる"""
+    last_progress = None
+    idle_seconds = 0.0
+    while not await is_disconnected():
+        progress = get_step_progress(slug)
+        if progress != last_progress:
+            yield format_event(progress)
+            last_progress = progress
+            idle_seconds = 0.0
+            if progress.get("status") in TERMINAL_STATUSES:
+                return
+        elif idle_seconds >= heartbeat_interval:
+            yield ": keep-alive\n\n"
+            idle_seconds = 0.0
+        await asyncio.sleep(poll_interval)
+        idle_seconds += poll_interval
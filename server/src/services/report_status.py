@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 import threading
 from datetime import UTC, datetime
 
@@ -10,13 +11,24 @@ from src.schemas.admin_report import ReportInput
 from src.schemas.report import AnalysisData, Report, ReportStatus, ReportVisibility
 from src.schemas.report_config import ReportConfigUpdate
 from src.services.llm_pricing import LLMPricing
+from src.services.report_cache import report_result_cache
 
 # ロガーの設定
 logger = logging.getLogger("uvicorn")
 
 STATE_FILE = settings.DATA_DIR / "report_status.json"
+# レポートごとの更新は report_status.json を書き直さず、更新後のレポートの状態をジャーナルに1行ずつ追記する
+# ジャーナルの行数が COMPACTION_THRESHOLD を超えた場合と、起動時・ストレージへの同期前に
+# report_status.json に書き戻して（コンパクション）ジャーナルを空にする
+COMPACTION_THRESHOLD = 100
 _lock = threading.RLock()
 _report_status = {}
+_journal_entries = 0
+# メモリ上の _report_status を正とし、report_status.json はストレージからのダウンロードなど
+# プロセスの外で書き換えられた場合（パス・inode・更新時刻・サイズのいずれかが変わった場合）にだけ読み込み直す
+# _status_signature は最後に読み書きしたファイルの状態、_reports は _report_status から作ったReportのリスト（Noneは未生成）
+_status_signature: tuple | None = None
+_reports: list[Report] | None = None
 
 
 # FIXME: report_status.jsonのフォーマット変更に対応するためのコード。広聴AIをver3.0にした段階で削除する。
@@ -36,7 +48,16 @@ def convert_old_format_status(status: dict) -> dict:
 
 
 def load_status() -> None:
-    global _report_status
+    with _lock:
+        _read_state_file()
+        if _journal_entries:
+            # 前回の起動中に追記された更新を report_status.json に反映しておく
+            compact_status()
+
+
+def _read_state_file() -> None:
+    global _report_status, _status_signature, _reports, _journal_entries
+    _status_signature = _status_file_signature()
     try:
         with open(STATE_FILE) as f:
             _report_status = convert_old_format_status(json.load(f))
@@ -44,19 +65,41 @@ def load_status() -> None:
         _report_status = {}
     except json.JSONDecodeError:
         _report_status = {}
+    _journal_entries = _replay_journal(_report_status)
+    _reports = None
 
 
-def load_status_as_reports(include_deleted: bool = False) -> list[Report]:
-    global _report_status
+def _journal_file():
+    return STATE_FILE.with_name(f"{STATE_FILE.stem}.journal.jsonl")
+
+
+def _replay_journal(status: dict) -> int:
+    """ジャーナルの更新を status に反映し、反映した行数を返す"""
     try:
-        with open(STATE_FILE) as f:
-            _report_status = convert_old_format_status(json.load(f))
+        with open(_journal_file(), encoding="utf-8") as f:
+            lines = f.readlines()
     except FileNotFoundError:
-        _report_status = {}
-    except json.JSONDecodeError:
-        _report_status = {}
+        return 0
+
+    for i, line in enumerate(lines):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            # 追記中にプロセスが停止した場合は最後の行が途中までしか書かれていないため、それ以降を無視する
+            logger.warning(f"Ignoring incomplete report status journal entry at line {i + 1}")
+            return i
+        status[entry["slug"]] = convert_old_format_status({entry["slug"]: entry["report"]})[entry["slug"]]
+    return len(lines)
 
-    reports = [Report(**report) for report in _report_status.values()]
+
+def load_status_as_reports(include_deleted: bool = False) -> list[Report]:
+    global _reports
+    with _lock:
+        if _status_file_signature() != _status_signature:
+            _read_state_file()
+        if _reports is None:
+            _reports = [Report(**report) for report in _report_status.values()]
+        reports = list(_reports)
 
     if not include_deleted:
         reports = [report for report in reports if report.status != ReportStatus.DELETED]
@@ -64,14 +107,57 @@ def load_status_as_reports(include_deleted: bool = False) -> list[Report]:
     return reports
 
 
-def save_status() -> None:
+def _status_file_signature() -> tuple | None:
+    try:
+        stat = STATE_FILE.stat()
+    except FileNotFoundError:
+        return None
+    return (str(STATE_FILE), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def save_status(slug: str | None = None) -> None:
+    """ステータスを保存する
+
+    Args:
+        slug: 更新したレポートのスラッグ。指定した場合はそのレポートの状態をジャーナルに追記し、
+            指定しない場合は全体を report_status.json に書き出す
+    """
+    global _reports, _journal_entries
     with _lock:
+        _reports = None
+        if slug is None or _journal_entries >= COMPACTION_THRESHOLD:
+            compact_status()
+            return
+
         # ディレクトリが存在しない場合は作成
         STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps({"slug": slug, "report": _report_status[slug]}, ensure_ascii=False)
+        with open(_journal_file(), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        _journal_entries += 1
+
 
-        # ローカルに保存
-        with open(STATE_FILE, "w") as f:
+def compact_status() -> None:
+    """メモリ上のステータス全体を report_status.json にアトミックに書き出し、ジャーナルを空にする"""
+    global _status_signature, _journal_entries
+    with _lock:
+        # ディレクトリが存在しない場合は作成
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+
+        # 書き込み途中で停止しても report_status.json が壊れないよう、一時ファイルに書き出してから置き換える
+        tmp_file = STATE_FILE.with_name(f"{STATE_FILE.name}.tmp")
+        with open(tmp_file, "w") as f:
             json.dump(_report_status, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, STATE_FILE)
+        # 置き換えた後に停止した場合は、ジャーナルの内容が再度適用されるだけなので結果は変わらない
+        _journal_file().unlink(missing_ok=True)
+        _journal_entries = 0
+        # 自身が書き込んだファイルは読み込み直さない
+        _status_signature = _status_file_signature()
 
 
 def add_new_report_to_status(report_input: ReportInput) -> None:
@@ -91,7 +177,7 @@ def add_new_report_to_status(report_input: ReportInput) -> None:
             "provider": None,  # LLMプロバイダーを初期化
             "model": None,  # LLMモデルを初期化
         }
-        save_status()
+        save_status(report_input.input)
 
 
 def set_status(slug: str, status: str) -> None:
@@ -99,7 +185,7 @@ def set_status(slug: str, status: str) -> None:
         if slug not in _report_status:
             raise ValueError(f"slug {slug} not found in report status")
         _report_status[slug]["status"] = status
-        save_status()
+        save_status(slug)
 
 
 def get_status(slug: str) -> str:
@@ -108,6 +194,9 @@ def get_status(slug: str) -> str:
 
 
 def invalidate_report_cache(slug: str) -> None:
+    # APIプロセス内のレポート結果のキャッシュを破棄する
+    report_result_cache.invalidate(slug)
+
     # Next.jsのキャッシュを破棄するAPIを呼び出す
     try:
         logger.info(f"Attempting to revalidate Next.js cache for report: {slug}")
@@ -140,7 +229,7 @@ def update_report_visibility_state(slug: str, new_visibility: ReportVisibility)
         # enumの値を文字列に変換して保存
         _report_status[slug]["visibility"] = new_visibility.value
 
-        save_status()
+        save_status(slug)
     invalidate_report_cache(slug)
     return _report_status[slug]["visibility"]
 
@@ -200,7 +289,7 @@ def update_token_usage(
         logger.info(
             f"Updated token usage for {slug} in report status: total={token_usage}, input={token_usage_input}, output={token_usage_output}"
         )
-        save_status()
+        save_status(slug)
 
 
 def update_report_config(slug: str, updated_config: ReportConfigUpdate) -> dict:
@@ -229,7 +318,7 @@ def update_report_config(slug: str, updated_config: ReportConfigUpdate) -> dict:
         if updated_config.intro is not None:
             _report_status[slug]["description"] = updated_config.intro
 
-        save_status()
+        save_status(slug)
 
     invalidate_report_cache(slug)
     return _report_status[slug]
@@ -149,3 +149,23 @@ class TestVerifyApiKey:
             _, kwargs = mock_request.call_args
             assert kwargs["provider"] == "gemini"
             assert kwargs["model"] == "gemini-2.5-flash"
+
+
+class TestStreamStepProgress:
+    def test_stream_step_progress(self, client, tmp_path):
+        """正常系：進捗をServer-Sent Eventsで送り、パイプラインが終了したら接続を閉じる"""
+        report_dir = tmp_path / "test-slug"
+        report_dir.mkdir()
+        (report_dir / "hierarchical_progress.json").write_text(
+            json.dumps({"status": "completed", "current_job": "hierarchical_aggregation", "total_token_usage": 10}),
+            encoding="utf-8",
+        )
+
+        with patch("src.services.report_progress.settings.REPORT_DIR", tmp_path):
+            response = client.get("/admin/reports/test-slug/status/stream", headers={"x-api-key": "test-api-key"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        event = json.loads(response.text.split("data: ", 1)[1])
+        assert event["current_step"] == "completed"
+        assert event["token_usage"] == 10
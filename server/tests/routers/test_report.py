@@ -1,11 +1,15 @@
 """Test cases for public report endpoints."""
 
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 
 from fastapi.testclient import TestClient
 
 from src.schemas.report import ReportStatus, ReportVisibility
+from src.services.report_cache import report_result_cache
 
 
 class TestReportEndpoint:
@@ -120,3 +124,151 @@ class TestReportEndpoint:
 
         assert response.status_code == 404
         assert "Report not found" in response.json()["detail"]
+
+    def test_get_report_columnar_with_accept_header(self, client: TestClient, temp_report_dir, test_settings):
+        """正常系：Acceptヘッダで列指向の形式を要求すると、列指向のレポートを返す"""
+        slug = "test-columnar-report"
+
+        report_dir = temp_report_dir / slug
+        report_dir.mkdir(parents=True, exist_ok=True)
+        with open(report_dir / "hierarchical_result.json", "w", encoding="utf-8") as f:
+            json.dump({"config": {"question": "質問"}, "arguments": []}, f)
+        with open(report_dir / "hierarchical_result_columnar.json", "w", encoding="utf-8") as f:
+            json.dump({"format": "columnar", "config": {"question": "質問"}, "arguments": {"count": 0}}, f)
+
+        mock_reports = [
+            type("Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC})()
+        ]
+
+        with (
+            patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
+            patch("src.routers.report.load_status_as_reports", return_value=mock_reports),
+        ):
+            columnar_response = client.get(
+                f"/reports/{slug}",
+                headers={
+                    "x-api-key": test_settings.PUBLIC_API_KEY,
+                    "Accept": "application/vnd.kouchou-ai.columnar+json, application/json;q=0.9",
+                },
+            )
+            json_response = client.get(f"/reports/{slug}", headers={"x-api-key": test_settings.PUBLIC_API_KEY})
+
+        assert columnar_response.status_code == 200
+        assert columnar_response.headers["content-type"].startswith("application/vnd.kouchou-ai.columnar+json")
+        assert "Accept" in columnar_response.headers["vary"]
+        assert columnar_response.json()["format"] == "columnar"
+        assert columnar_response.json()["visibility"] == "public"
+
+        assert json_response.headers["content-type"].startswith("application/json")
+        assert "Accept" in json_response.headers["vary"]
+        assert json_response.json()["arguments"] == []
+
+    def test_get_report_columnar_falls_back_to_json(self, client: TestClient, temp_report_dir, test_settings):
+        """正常系：列指向のファイルがないレポートは、Acceptヘッダに関わらず通常のJSONを返す"""
+        slug = "test-legacy-report"
+
+        report_dir = temp_report_dir / slug
+        report_dir.mkdir(parents=True, exist_ok=True)
+        with open(report_dir / "hierarchical_result.json", "w", encoding="utf-8") as f:
+            json.dump({"config": {"question": "質問"}, "arguments": []}, f)
+
+        mock_reports = [
+            type("Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC})()
+        ]
+
+        with (
+            patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
+            patch("src.routers.report.load_status_as_reports", return_value=mock_reports),
+        ):
+            response = client.get(
+                f"/reports/{slug}",
+                headers={
+                    "x-api-key": test_settings.PUBLIC_API_KEY,
+                    "Accept": "application/vnd.kouchou-ai.columnar+json",
+                },
+            )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/json")
+        assert response.json()["arguments"] == []
+
+    def test_get_report_with_gzip_and_etag(self, client: TestClient, temp_report_dir, test_settings):
+        """正常系：Accept-Encodingに応じてgzipで返し、If-None-MatchがETagに一致すれば304を返す"""
+        slug = "test-etag-report"
+
+        report_dir = temp_report_dir / slug
+        report_dir.mkdir(parents=True, exist_ok=True)
+        with open(report_dir / "hierarchical_result.json", "w", encoding="utf-8") as f:
+            json.dump({"config": {"question": "質問"}, "arguments": [{"argument": "意見"}] * 100}, f)
+
+        mock_reports = [
+            type("Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC})()
+        ]
+
+        with (
+            patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
+            patch("src.routers.report.load_status_as_reports", return_value=mock_reports),
+        ):
+            headers = {"x-api-key": test_settings.PUBLIC_API_KEY}
+            gzip_response = client.get(f"/reports/{slug}", headers={**headers, "Accept-Encoding": "gzip"})
+            identity_response = client.get(f"/reports/{slug}", headers={**headers, "Accept-Encoding": "identity"})
+            not_modified_response = client.get(
+                f"/reports/{slug}",
+                headers={**headers, "Accept-Encoding": "gzip", "If-None-Match": gzip_response.headers["etag"]},
+            )
+
+        assert gzip_response.status_code == 200
+        assert gzip_response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in gzip_response.headers["vary"]
+        assert gzip_response.json()["visibility"] == "public"
+
+        assert identity_response.status_code == 200
+        assert "content-encoding" not in identity_response.headers
+        assert identity_response.json() == gzip_response.json()
+        assert identity_response.headers["etag"] != gzip_response.headers["etag"]
+
+        assert not_modified_response.status_code == 304
+        assert not_modified_response.content == b""
+        assert not_modified_response.headers["etag"] == gzip_response.headers["etag"]
+
+    def test_cache_miss_does_not_block_other_requests(self, client: TestClient, temp_report_dir, test_settings):
+        """キャッシュのミス時の読み込み・圧縮の間も、他のリクエストに応答できる"""
+        slug = "test-slow-report"
+
+        report_dir = temp_report_dir / slug
+        report_dir.mkdir(parents=True, exist_ok=True)
+        with open(report_dir / "hierarchical_result.json", "w", encoding="utf-8") as f:
+            json.dump({"config": {"question": "質問"}, "arguments": []}, f)
+
+        mock_reports = [
+            type("Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC})()
+        ]
+        started = threading.Event()
+        release = threading.Event()
+        original_get = report_result_cache.get
+
+        def slow_get(path, visibility):
+            started.set()
+            # イベントループ上で実行されていれば、下の別のレポートへのリクエストが終わらずタイムアウトする
+            release.wait(timeout=5)
+            return original_get(path, visibility)
+
+        headers = {"x-api-key": test_settings.PUBLIC_API_KEY}
+        with (
+            patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
+            patch("src.routers.report.load_status_as_reports", return_value=mock_reports),
+            patch("src.main.initialize_from_storage", return_value=True),
+            patch.object(report_result_cache, "get", side_effect=slow_get),
+            client,  # 同じイベントループで2つのリクエストを処理させる
+            ThreadPoolExecutor(max_workers=1) as executor,
+        ):
+            slow_response = executor.submit(client.get, f"/reports/{slug}", headers=headers)
+            assert started.wait(timeout=5)
+            start = time.monotonic()
+            other_response = client.get("/reports/unknown-report", headers=headers)
+            elapsed = time.monotonic() - start
+            release.set()
+
+            assert other_response.status_code == 404
+            assert elapsed < 2
+            assert slow_response.result(timeout=5).json()["visibility"] == "public"
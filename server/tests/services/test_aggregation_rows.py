@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from broadlistening.pipeline.services.aggregation_rows import match_comment_rows, property_values, take_comment_values
+
+
+def matched_comments_per_row(clusters: pd.DataFrame, comments: pd.DataFrame, relation_df: pd.DataFrame) -> list:
+    """結合に置き換える前の、意見ごとにコメント全体を検索する実装（対応するコメントの行、なければNone）"""
+    comments_copy = comments.copy()
+    comments_copy["comment-id"] = comments_copy["comment-id"].astype(str)
+    relation_df = relation_df.copy()
+    relation_df["comment-id"] = relation_df["comment-id"].astype(str)
+    arg_comment_map = dict(zip(relation_df["arg-id"], relation_df["comment-id"], strict=False))
+
+    matched = []
+    for _, row in clusters.iterrows():
+        comment_rows = comments_copy[comments_copy["comment-id"] == arg_comment_map.get(row["arg-id"])]
+        matched.append(None if comment_rows.empty else comment_rows.iloc[0])
+    return matched
+
+
+def matched_comments(clusters: pd.DataFrame, comments: pd.DataFrame, relation_df: pd.DataFrame) -> list:
+    comment_rows, has_comment = match_comment_rows(clusters, comments, relation_df.copy())
+    return [comments.iloc[row] if found else None for row, found in zip(comment_rows, has_comment, strict=True)]
+
+
+class TestMatchCommentRows:
+    """意見と元コメントの対応付けのテスト"""
+
+    clusters = pd.DataFrame({"arg-id": ["A1_0", "A1_1", "A2_0", "A3_0", "A4_0"]})
+    comments = pd.DataFrame(
+        {
+            "comment-id": [1, 2, 2, 3],
+            "comment-body": ["本文1", "本文2（先頭）", "本文2（重複）", "本文3"],
+            "attribute_age": [20, 30, 40, np.nan],
+        }
+    )
+    relation_df = pd.DataFrame(
+        {
+            "arg-id": ["A1_0", "A1_1", "A2_0", "A3_0", "A3_0", "A4_0"],
+            "comment-id": [1, 1, 2, 1, 3, 99],
+        }
+    )
+
+    def test_last_relation_and_first_comment_win(self):
+        comment_rows, has_comment = match_comment_rows(self.clusters, self.comments, self.relation_df.copy())
+
+        # A3_0は関係の最後の行（comment-id 3）、A2_0は重複したcomment-id 2の先頭のコメント、A4_0は対応するコメントなし
+        assert has_comment.tolist() == [True, True, True, True, False]
+        assert comment_rows[has_comment].tolist() == [0, 0, 1, 3]
+
+    def test_matches_per_row_implementation(self):
+        expected = matched_comments_per_row(self.clusters, self.comments, self.relation_df)
+        actual = matched_comments(self.clusters, self.comments, self.relation_df)
+
+        assert len(actual) == len(expected)
+        for got, want in zip(actual, expected, strict=True):
+            if want is None:
+                assert got is None
+            else:
+                assert got["comment-body"] == want["comment-body"]
+
+    def test_without_comment_id_in_relations(self):
+        relation_df = pd.DataFrame({"arg-id": ["A1_0"]})
+
+        comment_rows, has_comment = match_comment_rows(self.clusters, self.comments, relation_df)
+
+        assert not has_comment.any()
+        assert len(comment_rows) == len(self.clusters)
+
+    def test_take_comment_values_converts_numpy_scalars(self):
+        comment_rows, has_comment = match_comment_rows(self.clusters, self.comments, self.relation_df.copy())
+
+        values = take_comment_values(self.comments["attribute_age"], comment_rows)
+
+        assert values[:3] == [20.0, 20.0, 30.0]
+        assert np.isnan(values[3])
+        assert all(type(value) is float for value in values)
+        assert take_comment_values(pd.Series([], dtype=object), comment_rows) == [None] * 5
+
+
+def property_values_per_row(arguments: pd.DataFrame, prop: str) -> list:
+    """列ごとの変換に置き換える前の、arguments.iterrows() で1件ずつ変換する実装"""
+    values = []
+    for _, row in arguments.iterrows():
+        value = row[prop] if not pd.isna(row[prop]) else None
+        if value is not None:
+            if isinstance(value, np.integer):
+                value = int(value)
+            elif isinstance(value, np.floating):
+                value = float(value)
+            elif isinstance(value, np.ndarray):
+                value = value.tolist()
+            else:
+                value = str(value)
+        values.append(value)
+    return values
+
+
+class TestPropertyValues:
+    """意見の属性の値の変換のテスト"""
+
+    arguments = pd.DataFrame(
+        {
+            "argument": ["意見1", "意見2", "意見3", "意見4"],
+            "int": [1, 2, 3, 4],
+            "float": [0.5, np.nan, 1e16, 0.1 + 0.2],
+            "bool": [True, False, True, False],
+            "nullable": pd.array([1, None, 3, 4], dtype="Int64"),
+            "category": ["賛成", None, "反対", np.nan],
+            "mixed": [1, "a", 2.5, None],
+        },
+        index=["A1_0", "A2_0", "A3_0", "A4_0"],
+    )
+
+    def test_matches_per_row_implementation(self):
+        for prop in self.arguments.columns:
+            assert property_values(self.arguments[prop]) == property_values_per_row(self.arguments, prop), prop
+
+    def test_values_are_strings_or_none(self):
+        assert property_values(self.arguments["int"]) == ["1", "2", "3", "4"]
+        assert property_values(self.arguments["float"]) == ["0.5", None, "1e+16", "0.30000000000000004"]
+        assert property_values(self.arguments["bool"]) == ["True", "False", "True", "False"]
+        assert property_values(self.arguments["nullable"]) == ["1", None, "3", "4"]
+        assert property_values(self.arguments["category"]) == ["賛成", None, "反対", None]
+        assert property_values(self.arguments["mixed"]) == ["1", "a", "2.5", None]
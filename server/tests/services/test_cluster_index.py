@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from broadlistening.pipeline.services.cluster_index import ClusterIndex
+
+
+@pytest.fixture
+def clusters_df():
+    return pd.DataFrame(
+        {
+            "argument": ["a", "b", "c", "d", "e"],
+            "cluster-level-1-id": ["1_0", "1_1", "1_0", "1_1", "1_0"],
+            "cluster-level-2-id": ["2_0", "2_2", "2_1", "2_2", "2_0"],
+        }
+    )
+
+
+class TestClusterIndex:
+    """クラスタIDの索引のテスト"""
+
+    def test_rows_match_boolean_filter(self, clusters_df):
+        columns = ["cluster-level-1-id", "cluster-level-2-id"]
+        index = ClusterIndex(clusters_df, columns)
+
+        for column in columns:
+            for cluster_id in clusters_df[column].unique():
+                pd.testing.assert_frame_equal(
+                    index.rows(clusters_df, column, cluster_id),
+                    clusters_df[clusters_df[column] == cluster_id],
+                )
+
+    def test_unknown_cluster_returns_no_rows(self, clusters_df):
+        index = ClusterIndex(clusters_df, ["cluster-level-1-id"])
+
+        assert len(index.positions("cluster-level-1-id", "1_9")) == 0
+        assert index.rows(clusters_df, "cluster-level-1-id", "1_9").empty
+
+    def test_rows_with_added_columns(self, clusters_df):
+        index = ClusterIndex(clusters_df, ["cluster-level-2-id"])
+        labelled_df = clusters_df.assign(**{"cluster-level-2-label": "ラベル"})
+
+        rows = index.rows(labelled_df, "cluster-level-2-id", "2_2")
+
+        assert rows["argument"].tolist() == ["b", "d"]
+        assert rows["cluster-level-2-label"].tolist() == ["ラベル", "ラベル"]
+
+    def test_rows_rejects_different_dataframe(self, clusters_df):
+        index = ClusterIndex(clusters_df, ["cluster-level-1-id"])
+
+        with pytest.raises(ValueError):
+            index.rows(clusters_df.iloc[:3], "cluster-level-1-id", "1_0")
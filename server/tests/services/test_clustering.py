@@ -0,0 +1,237 @@
+import numpy as np
+import pytest
+import scipy.cluster.hierarchy as sch
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
+
+from broadlistening.pipeline.services import clustering
+from broadlistening.pipeline.services.clustering import (
+    DEFAULT_LARGE_DATASET_THRESHOLD,
+    cluster_embeddings,
+    hierarchical_clustering_embeddings,
+    merge_clusters_with_hierarchy,
+    project_embeddings,
+    reduce_dimensions,
+    use_large_dataset_mode,
+)
+
+
+def make_blobs(num_topics: int = 4, per_topic: int = 20, dim: int = 32, seed: int = 0):
+    """話題ごとに離れた位置に集まった、正規化済みの埋め込みと話題のラベル"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_topics, dim)) * 5
+    topics = np.repeat(np.arange(num_topics), per_topic)
+    embeddings = centers[topics] + 0.1 * rng.standard_normal((len(topics), dim))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32), topics
+
+
+class FakeUmapModule:
+    """UMAPの代わりに、渡された埋め込みとパラメータを記録して先頭の2列を返す"""
+
+    __version__ = "test"
+
+    def __init__(self):
+        self.fits = []
+        fits = self.fits
+
+        class UMAP:
+            def __init__(self, **params):
+                self.params = params
+
+            def fit_transform(self, vectors):
+                fits.append((self.params, vectors.shape))
+                return np.asarray(vectors)[:, :2]
+
+        self.UMAP = UMAP
+
+
+class TestUseLargeDatasetMode:
+    """大規模データ向けの処理に切り替えるかの判定のテスト"""
+
+    def test_auto_uses_threshold(self):
+        options = {"large_dataset_mode": "auto", "large_dataset_threshold": 100}
+
+        assert not use_large_dataset_mode(options, 99)
+        assert use_large_dataset_mode(options, 100)
+        assert use_large_dataset_mode(options, 101)
+
+    def test_auto_is_default_with_default_threshold(self):
+        assert not use_large_dataset_mode({}, DEFAULT_LARGE_DATASET_THRESHOLD - 1)
+        assert use_large_dataset_mode({}, DEFAULT_LARGE_DATASET_THRESHOLD)
+
+    @pytest.mark.parametrize("n_samples", [10, 1_000_000])
+    def test_explicit_setting_ignores_threshold(self, n_samples):
+        assert use_large_dataset_mode({"large_dataset_mode": True, "large_dataset_threshold": 100}, n_samples)
+        assert not use_large_dataset_mode({"large_dataset_mode": False, "large_dataset_threshold": 100}, n_samples)
+
+
+class TestLargeDatasetMode:
+    """PCAによる事前の次元削減とMiniBatchKMeansを使う処理のテスト"""
+
+    def test_reduce_dimensions(self):
+        embeddings, _ = make_blobs(dim=32)
+
+        reduced = reduce_dimensions(embeddings, 8, chunk_size=7)
+
+        assert reduced.shape == (len(embeddings), 8)
+        assert reduced.dtype == np.float32
+        # チャンクごとに変換しても、一度に変換した結果と一致する
+        np.testing.assert_allclose(reduced, reduce_dimensions(embeddings, 8), rtol=1e-5, atol=1e-5)
+
+    def test_reduce_dimensions_caps_components(self):
+        embeddings, _ = make_blobs(num_topics=2, per_topic=3, dim=32)
+
+        assert reduce_dimensions(embeddings, 64).shape == (6, 6)
+
+    def test_project_embeddings_reduces_before_umap(self, monkeypatch):
+        embeddings, _ = make_blobs(dim=32)
+        fake_umap = FakeUmapModule()
+        monkeypatch.setattr(clustering, "import_module", lambda name: fake_umap)
+
+        projection = project_embeddings(embeddings, large_dataset_mode=True, pre_reduction_dim=8)
+
+        assert projection.shape == (len(embeddings), 2)
+        (params, fitted_shape), *_ = fake_umap.fits
+        # UMAPにはPCAで削減した埋め込みを渡し、近傍グラフを省メモリに構築する
+        assert fitted_shape == (len(embeddings), 8)
+        assert params["low_memory"] is True
+        assert params["force_approximation_algorithm"] is True
+
+    def test_project_embeddings_without_large_dataset_mode(self, monkeypatch):
+        embeddings, _ = make_blobs(dim=32)
+        fake_umap = FakeUmapModule()
+        monkeypatch.setattr(clustering, "import_module", lambda name: fake_umap)
+
+        project_embeddings(embeddings, large_dataset_mode=False, pre_reduction_dim=8)
+
+        (params, fitted_shape), *_ = fake_umap.fits
+        assert fitted_shape == (len(embeddings), 32)
+        assert "force_approximation_algorithm" not in params
+
+    def test_minibatch_kmeans_recovers_clusters(self, monkeypatch):
+        embeddings, topics = make_blobs(num_topics=4)
+        vectors = reduce_dimensions(embeddings, 8)
+        fitted = []
+
+        class RecordingMiniBatchKMeans(clustering.MiniBatchKMeans):
+            def fit(self, X, *args, **kwargs):
+                fitted.append(X.shape)
+                return super().fit(X, *args, **kwargs)
+
+        monkeypatch.setattr(clustering, "MiniBatchKMeans", RecordingMiniBatchKMeans)
+
+        results = hierarchical_clustering_embeddings(vectors, [2, 4], use_minibatch=True)
+
+        assert fitted == [(len(embeddings), 8)]
+        assert list(results) == [2, 4]
+        assert adjusted_rand_score(topics, results[4]) == 1.0
+        assert len(set(results[2])) == 2
+        # 上位の階層は下位のクラスタをまとめたもの
+        for label in set(results[4]):
+            assert len(set(results[2][results[4] == label])) == 1
+
+
+def merge_clusters_per_sample(cluster_centers, kmeans_labels, n_samples, n_cluster_cut):
+    """インデックス参照に置き換える前の、階層を毎回計算して1件ずつラベルを置き換える実装"""
+    Z = sch.linkage(cluster_centers, method="ward")
+    cluster_labels_merged = sch.fcluster(Z, t=n_cluster_cut, criterion="maxclust")
+    final_labels = np.zeros(n_samples, dtype=int)
+    for i in range(n_samples):
+        final_labels[i] = cluster_labels_merged[kmeans_labels[i]]
+    return final_labels
+
+
+class TestHierarchy:
+    """クラスタ中心の階層による上位の階層の計算のテスト"""
+
+    def test_merge_clusters_matches_per_sample_mapping(self):
+        rng = np.random.default_rng(1)
+        centers = rng.standard_normal((12, 2))
+        kmeans_labels = rng.integers(0, 12, 200)
+        linkage_matrix = sch.linkage(centers, method="ward")
+
+        for n_cluster_cut in [2, 3, 6, 11, 12]:
+            np.testing.assert_array_equal(
+                merge_clusters_with_hierarchy(kmeans_labels, linkage_matrix, n_cluster_cut),
+                merge_clusters_per_sample(centers, kmeans_labels, len(kmeans_labels), n_cluster_cut),
+            )
+
+    def test_every_level_matches_per_sample_mapping(self):
+        vectors = np.random.default_rng(2).standard_normal((300, 2))
+        cluster_nums = [3, 6, 12]
+
+        results = hierarchical_clustering_embeddings(vectors, list(cluster_nums))
+
+        kmeans = KMeans(n_clusters=12, random_state=42).fit(vectors)
+        np.testing.assert_array_equal(results[12], kmeans.labels_)
+        for n_cluster_cut in cluster_nums[:-1]:
+            np.testing.assert_array_equal(
+                results[n_cluster_cut],
+                merge_clusters_per_sample(kmeans.cluster_centers_, kmeans.labels_, len(vectors), n_cluster_cut),
+            )
+            assert len(set(results[n_cluster_cut])) == n_cluster_cut
+
+
+class TestClusterSpace:
+    """クラスタリングに使う空間（cluster_space）のテスト"""
+
+    options = {"cluster_nums": [2, 4], "large_dataset_mode": False, "cluster_dim": 6}
+
+    @pytest.fixture
+    def fake_umap(self, monkeypatch):
+        fake_umap = FakeUmapModule()
+        monkeypatch.setattr(clustering, "import_module", lambda name: fake_umap)
+        return fake_umap
+
+    @pytest.fixture
+    def kmeans_inputs(self, monkeypatch):
+        """K-meansに渡されたベクトルの形状"""
+        shapes = []
+
+        class RecordingKMeans(clustering.KMeans):
+            def fit(self, X, *args, **kwargs):
+                shapes.append(X.shape)
+                return super().fit(X, *args, **kwargs)
+
+        monkeypatch.setattr(clustering, "KMeans", RecordingKMeans)
+        return shapes
+
+    def test_chunked_reduction_of_memmap(self, tmp_path):
+        embeddings, _ = make_blobs(dim=32)
+        path = tmp_path / "embeddings.f32"
+        embeddings.tofile(path)
+        memmap = np.memmap(path, dtype=np.float32, mode="r", shape=embeddings.shape)
+
+        reduced = reduce_dimensions(memmap, 6, chunk_size=9)
+
+        assert reduced.shape == (len(embeddings), 6)
+        np.testing.assert_allclose(reduced, reduce_dimensions(embeddings, 6), rtol=1e-5, atol=1e-5)
+
+    def test_reduced_space_clusters_pca_vectors_and_keeps_umap_coordinates(self, fake_umap, kmeans_inputs):
+        embeddings, topics = make_blobs(num_topics=4, dim=32)
+
+        projection, results = cluster_embeddings(embeddings, {**self.options, "cluster_space": "reduced"})
+
+        # x, y はUMAPの射影のまま、クラスタリングはPCAで cluster_dim 次元に削減した埋め込みで行う
+        np.testing.assert_array_equal(projection, embeddings[:, :2])
+        assert [shape for _, shape in fake_umap.fits] == [(len(embeddings), 32)]
+        assert kmeans_inputs == [(len(embeddings), 6)]
+        assert adjusted_rand_score(topics, results[4]) == 1.0
+
+    def test_umap_space_clusters_projection(self, fake_umap, kmeans_inputs):
+        embeddings, _ = make_blobs(num_topics=4, dim=32)
+
+        projection, results = cluster_embeddings(embeddings, {**self.options, "cluster_space": "umap"})
+
+        np.testing.assert_array_equal(projection, embeddings[:, :2])
+        assert kmeans_inputs == [(len(embeddings), 2)]
+        assert list(results) == [2, 4]
+
+    def test_unknown_cluster_space(self, fake_umap):
+        embeddings, _ = make_blobs()
+
+        with pytest.raises(ValueError, match="Unknown cluster_space"):
+            cluster_embeddings(embeddings, {**self.options, "cluster_space": "tsne"})
+        # UMAPを計算する前に設定の誤りを検出する
+        assert fake_umap.fits == []
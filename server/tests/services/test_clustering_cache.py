@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from broadlistening.pipeline.services.clustering_cache import ClusteringCache, array_hash
+
+
+class TestArrayHash:
+    def test_depends_on_content_and_params(self):
+        array = np.arange(12, dtype=np.float32).reshape(4, 3)
+
+        key = array_hash(array, {"n_neighbors": 15})
+
+        assert key == array_hash(array.copy(), {"n_neighbors": 15})
+        assert key != array_hash(array, {"n_neighbors": 10})
+        assert key != array_hash(array + 1, {"n_neighbors": 15})
+        assert key != array_hash(array.reshape(3, 4), {"n_neighbors": 15})
+
+    def test_chunked_hash_matches_for_memmap(self, tmp_path):
+        array = np.random.default_rng(0).random((25000, 4)).astype(np.float32)
+        np.save(tmp_path / "embeddings.npy", array)
+
+        mmap = np.load(tmp_path / "embeddings.npy", mmap_mode="r")
+
+        assert array_hash(mmap, {}) == array_hash(array, {})
+
+
+class TestClusteringCache:
+    """クラスタリングの中間結果のキャッシュのテスト"""
+
+    def test_put_and_get(self, tmp_path):
+        cache = ClusteringCache(tmp_path)
+        labels = np.array([0, 1, 1], dtype=np.int32)
+        centers = np.array([[0.0, 0.0], [1.0, 1.0]])
+
+        assert cache.get("key") is None
+        cache.put("key", labels=labels, centers=centers)
+        cached = cache.get("key")
+
+        np.testing.assert_array_equal(cached["labels"], labels)
+        np.testing.assert_array_equal(cached["centers"], centers)
+        assert cache.stats() == {"hits": 1, "misses": 1}
+        assert [path.name for path in tmp_path.iterdir()] == ["key.npz"]
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = ClusteringCache(tmp_path, max_entries=2)
+        for i, key in enumerate(["a", "b"]):
+            cache.put(key, projection=np.zeros(1))
+            os.utime(tmp_path / f"{key}.npz", ns=(i * 10**9, i * 10**9))
+
+        cache.get("a")
+        cache.put("c", projection=np.zeros(1))
+
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["a.npz", "c.npz"]
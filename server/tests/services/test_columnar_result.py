@@ -0,0 +1,81 @@
+import json
+
+import numpy as np
+
+from broadlistening.pipeline.services.columnar_result import (
+    ColumnarArgumentsBuilder,
+    DictionaryEncoder,
+    decode_arguments,
+    decode_typed_array,
+    encode_typed_array,
+)
+
+
+def _argument(arg_id, x, cluster_ids, attributes=None, url=None):
+    return {
+        "arg_id": arg_id,
+        "argument": f"意見 {arg_id}",
+        "x": x,
+        "y": -x,
+        "p": 0,
+        "cluster_ids": cluster_ids,
+        "attributes": attributes,
+        "url": url,
+    }
+
+
+class TestColumnarResult:
+    """列指向の意見データのテスト"""
+
+    def test_roundtrip(self):
+        """エンコードしてJSONを経由しても、元の意見のリストに戻せる"""
+        arguments = [
+            _argument("A1_0", 0.5, ["0", "1_1", "2_3"], {"age": 20, "area": "東京都"}, url="https://example.com/1"),
+            _argument("A2_0", 1.25, ["0", "1_1", "2_4"], {"age": None, "area": "大阪府"}),
+            _argument("A3_0", -2.0, ["0", "1_2", "2_5"]),
+        ]
+        builder = ColumnarArgumentsBuilder()
+
+        collected = list(builder.collect(arguments))
+        decoded = decode_arguments(json.loads(json.dumps(builder.to_dict())))
+
+        assert collected == arguments
+        assert decoded == arguments
+
+    def test_cluster_ids_and_attributes_are_dictionary_encoded(self):
+        builder = ColumnarArgumentsBuilder()
+        for i in range(4):
+            builder.add(_argument(f"A{i}_0", float(i), ["0", f"1_{i % 2}"], {"area": ["北", "南"][i % 2]}))
+
+        columnar = builder.to_dict()
+
+        assert columnar["count"] == 4
+        assert columnar["cluster_ids"]["dictionary"] == ["0", "1_0", "1_1"]
+        assert columnar["attributes"]["area"]["dictionary"] == ["北", "南"]
+        assert decode_typed_array(columnar["attributes"]["area"]["codes"]).tolist() == [0, 1, 0, 1]
+        assert decode_typed_array(columnar["x"]).dtype == np.float32
+
+    def test_attribute_appearing_later_is_backfilled(self):
+        builder = ColumnarArgumentsBuilder()
+        builder.add(_argument("A1_0", 0.0, ["0"]))
+        builder.add(_argument("A2_0", 0.0, ["0"], {"age": 30}))
+
+        decoded = decode_arguments(builder.to_dict())
+
+        assert decoded[0]["attributes"] is None
+        assert decoded[1]["attributes"] == {"age": 30}
+
+    def test_dictionary_encoder_distinguishes_types(self):
+        """1, 1.0, True, "1" は別の値として扱い、Noneは-1になる"""
+        encoder = DictionaryEncoder()
+
+        codes = [encoder.encode(v) for v in [1, 1.0, True, "1", 1, None]]
+
+        assert codes == [0, 1, 2, 3, 0, -1]
+        assert encoder.values == [1, 1.0, True, "1"]
+
+    def test_typed_array_roundtrip(self):
+        encoded = encode_typed_array([1, -2, 3], "int32")
+
+        assert encoded["dtype"] == "int32"
+        assert decode_typed_array(encoded).tolist() == [1, -2, 3]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import numpy as np
+
+from broadlistening.pipeline.services.embedding_batches import make_batches, request_in_batches
+
+
+def fake_embed(text: str) -> list[float]:
+    """意見ごとに異なる2次元のベクトル"""
+    return [float(text.removeprefix("意見")), 0.5]
+
+
+class TestMakeBatches:
+    """埋め込みリクエストのバッチ分割のテスト"""
+
+    def test_splits_by_batch_size(self):
+        texts = [f"意見{i}" for i in range(7)]
+
+        batches = make_batches(texts, batch_size=3)
+
+        assert batches == [texts[0:3], texts[3:6], texts[6:7]]
+
+    def test_splits_by_token_limit(self):
+        # 日本語1文字（UTF-8で3バイト）がおおよそ1トークンと見積もられる
+        texts = ["あ" * 40, "い" * 40, "う" * 40, "え" * 10]
+
+        batches = make_batches(texts, batch_size=100, max_tokens=100)
+
+        assert batches == [["あ" * 40, "い" * 40], ["う" * 40, "え" * 10]]
+
+    def test_oversized_text_gets_its_own_batch(self):
+        texts = ["あ" * 10, "い" * 500, "う" * 10]
+
+        batches = make_batches(texts, batch_size=100, max_tokens=100)
+
+        assert batches == [["あ" * 10], ["い" * 500], ["う" * 10]]
+
+    def test_empty(self):
+        assert make_batches([], batch_size=10) == []
+
+
+class TestRequestInBatches:
+    """バッチの並列リクエストと入力順への並べ直しのテスト"""
+
+    def test_keeps_input_order_when_batches_complete_out_of_order(self):
+        texts = [f"意見{i}" for i in range(10)]
+        completed = []
+        lock = threading.Lock()
+
+        def request(batch):
+            # 先に投入したバッチほど応答を遅らせ、完了順を入力順と逆にする
+            first = int(batch[0].removeprefix("意見"))
+            time.sleep(0.05 * (10 - first) / 2)
+            with lock:
+                completed.append(first)
+            return [fake_embed(text) for text in batch]
+
+        vectors = request_in_batches(texts, request, batch_size=2, workers=5)
+
+        assert completed != sorted(completed)
+        assert vectors.dtype == np.float32
+        np.testing.assert_array_equal(vectors, np.asarray([fake_embed(text) for text in texts], dtype=np.float32))
+
+    def test_single_worker(self):
+        texts = [f"意見{i}" for i in range(5)]
+        calls = []
+
+        def request(batch):
+            calls.append(batch)
+            return [fake_embed(text) for text in batch]
+
+        vectors = request_in_batches(texts, request, batch_size=2, workers=0)
+
+        assert calls == [texts[0:2], texts[2:4], texts[4:5]]
+        assert vectors.shape == (5, 2)
+        np.testing.assert_array_equal(vectors[:, 0], np.arange(5, dtype=np.float32))
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from broadlistening.pipeline.services import embedding_cache
+from broadlistening.pipeline.services.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache:
+    """埋め込みキャッシュのテスト"""
+
+    def test_get_many_returns_hits_and_missing_positions(self, tmp_path):
+        """キャッシュ済みのテキストはベクトルを返し、存在しないテキストの位置を返す"""
+        cache = EmbeddingCache(tmp_path)
+        cache.put_many(["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+
+        matrix, missing = cache.get_many(["b", "c", "a"])
+
+        assert missing == [1]
+        assert matrix.dtype == np.float32
+        np.testing.assert_array_equal(matrix[[0, 2]], [[3.0, 4.0], [1.0, 2.0]])
+        assert cache.stats() == {"hits": 2, "misses": 1, "entries": 2}
+
+    def test_persists_across_instances(self, tmp_path):
+        """別のインスタンス（別のパイプライン実行）からも読み込める"""
+        EmbeddingCache(tmp_path).put_many(["a", "a", "b"], [[1.0], [1.0], [2.0]])
+
+        cache = EmbeddingCache(tmp_path)
+        matrix, missing = cache.get_many(["a", "b"])
+
+        assert len(cache) == 2
+        assert missing == []
+        np.testing.assert_array_equal(matrix, [[1.0], [2.0]])
+
+    def test_discards_partially_written_rows(self, tmp_path):
+        """書き込み途中で停止した行は読み込み時に破棄される"""
+        EmbeddingCache(tmp_path).put_many(["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+        with open(tmp_path / "index.txt", "a") as f:
+            f.write("deadbeef\n")  # ベクトルが書き込まれていないインデックス行
+
+        cache = EmbeddingCache(tmp_path)
+        cache.put_many(["c"], [[5.0, 6.0]])
+
+        matrix, missing = cache.get_many(["a", "b", "c"])
+        assert missing == []
+        np.testing.assert_array_equal(matrix, [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+
+    def test_append_after_orphan_vectors_from_another_process(self, tmp_path):
+        """他のプロセスがベクトルだけを書き込んで停止した後も、開いているキャッシュの追記の行番号がずれない"""
+        cache = EmbeddingCache(tmp_path)
+        cache.put_many(["x"], [[1.0, 1.0]])
+        with open(tmp_path / "vectors.f32", "ab") as f:
+            f.write(np.array([[9.0, 9.0]], dtype=np.float32).tobytes())  # インデックスが書き込まれなかった行
+
+        cache.put_many(["y"], [[2.0, 2.0]])
+
+        for reader in [cache, EmbeddingCache(tmp_path)]:
+            matrix, missing = reader.get_many(["x", "y"])
+            assert missing == []
+            np.testing.assert_array_equal(matrix, [[1.0, 1.0], [2.0, 2.0]])
+
+    def test_picks_up_rows_appended_by_another_instance(self, tmp_path):
+        first = EmbeddingCache(tmp_path)
+        second = EmbeddingCache(tmp_path)
+        first.put_many(["a"], [[1.0]])
+        second.put_many(["b"], [[2.0]])
+        first.put_many(["c"], [[3.0]])
+
+        matrix, missing = EmbeddingCache(tmp_path).get_many(["a", "b", "c"])
+        assert missing == []
+        np.testing.assert_array_equal(matrix, [[1.0], [2.0], [3.0]])
+
+    def test_compacts_oldest_rows_over_max_bytes(self, tmp_path):
+        """上限を超えると古く追記された行を捨てて詰め直し、古い世代を開いているインスタンスも読み込み直す"""
+        stale = EmbeddingCache(tmp_path)
+        stale.put_many(["a", "b"], [[1.0, 1.0], [2.0, 2.0]])
+        cache = EmbeddingCache(tmp_path, max_bytes=4 * 2 * 4)  # 4行分
+        cache.put_many(["c", "d", "e"], [[3.0, 3.0], [4.0, 4.0], [5.0, 5.0]])
+
+        assert len(cache) == 2
+        assert sorted(path.name for path in tmp_path.glob("*.f32")) == ["vectors.1.f32"]
+        for reader in [cache, stale, EmbeddingCache(tmp_path)]:
+            matrix, missing = reader.get_many(["a", "d", "e"])
+            assert missing == [0]
+            np.testing.assert_array_equal(matrix[1:], [[4.0, 4.0], [5.0, 5.0]])
+
+        stale.put_many(["f"], [[6.0, 6.0]])
+        matrix, missing = EmbeddingCache(tmp_path).get_many(["d", "e", "f"])
+        assert missing == []
+        np.testing.assert_array_equal(matrix, [[4.0, 4.0], [5.0, 5.0], [6.0, 6.0]])
+
+    def test_rejects_dimension_mismatch(self, tmp_path):
+        cache = EmbeddingCache(tmp_path)
+        cache.put_many(["a"], [[1.0, 2.0]])
+        with pytest.raises(ValueError):
+            cache.put_many(["b"], [[1.0, 2.0, 3.0]])
+
+    def test_get_embedding_cache_is_disabled_by_default(self, tmp_path):
+        assert embedding_cache.get_embedding_cache("openai/text-embedding-3-small") is None
+        embedding_cache.configure_embedding_cache(tmp_path)
+        try:
+            cache = embedding_cache.get_embedding_cache("openai/text-embedding-3-small")
+            assert cache is embedding_cache.get_embedding_cache("openai/text-embedding-3-small")
+            assert cache.directory == tmp_path / "openai_text-embedding-3-small"
+        finally:
+            embedding_cache.disable_embedding_cache()
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from broadlistening.pipeline.services.embedding_io import embeddings_exist, load_embeddings, save_embeddings
+
+
+class TestEmbeddingIO:
+    """埋め込みの保存形式のテスト"""
+
+    def test_save_and_load_memory_mapped(self, tmp_path):
+        """float32の行列として保存し、メモリマップで読み込める"""
+        save_embeddings(tmp_path, ["A1_0", "A2_0"], [[0.1, 0.2], [0.3, 0.4]])
+
+        vectors, arg_ids = load_embeddings(tmp_path)
+
+        assert isinstance(vectors, np.memmap)
+        assert vectors.dtype == np.float32
+        np.testing.assert_allclose(vectors, [[0.1, 0.2], [0.3, 0.4]], rtol=1e-6)
+        assert arg_ids == ["A1_0", "A2_0"]
+
+    def test_load_legacy_pickle(self, tmp_path):
+        """以前の形式のembeddings.pklも読み込める"""
+        pd.DataFrame({"arg-id": ["A1_0"], "embedding": [[1.0, 2.0, 3.0]]}).to_pickle(tmp_path / "embeddings.pkl")
+
+        assert embeddings_exist(tmp_path)
+        vectors, arg_ids = load_embeddings(tmp_path)
+
+        assert vectors.dtype == np.float32
+        assert vectors.shape == (1, 3)
+        assert arg_ids == ["A1_0"]
+
+    def test_save_replaces_legacy_pickle(self, tmp_path):
+        """保存時に以前の形式のファイルは削除される"""
+        pd.DataFrame({"arg-id": ["A1_0"], "embedding": [[1.0]]}).to_pickle(tmp_path / "embeddings.pkl")
+
+        save_embeddings(tmp_path, ["A1_0"], [[2.0]])
+
+        assert not (tmp_path / "embeddings.pkl").exists()
+        assert load_embeddings(tmp_path)[0][0, 0] == 2.0
+
+    def test_load_missing_raises(self, tmp_path):
+        assert not embeddings_exist(tmp_path)
+        with pytest.raises(FileNotFoundError):
+            load_embeddings(tmp_path)
@@ -0,0 +1,75 @@
+import numpy as np
+
+from broadlistening.pipeline.services.extraction_checkpoint import (
+    ExtractionCheckpoint,
+    checkpoint_fingerprint,
+    comment_hash,
+    load_checkpoint,
+    remove_checkpoint,
+)
+
+CONFIG = {"input": "example", "provider": "openai", "extraction": {"model": "gpt-4o-mini", "prompt": "意見を抽出"}}
+
+
+def write_checkpoint(path, fingerprint, comments: dict, arguments: dict) -> None:
+    with ExtractionCheckpoint(str(path), fingerprint) as checkpoint:
+        for comment_id, body in comments.items():
+            checkpoint.append(comment_id, comment_hash(body), arguments[comment_id])
+
+
+class TestExtractionCheckpoint:
+    """抽出ステップのチェックポイントのテスト"""
+
+    def test_resume_extracted_comments(self, tmp_path):
+        """再実行時は抽出済みのコメントの結果を復元する"""
+        path = tmp_path / "extraction_checkpoint.jsonl"
+        fingerprint = checkpoint_fingerprint(CONFIG)
+        comments = {np.int64(1): "本文1", np.int64(2): "本文2"}
+        write_checkpoint(path, fingerprint, comments, {1: ["意見1"], 2: ["意見2a", "意見2b"]})
+
+        hashes = {"1": comment_hash("本文1"), "2": comment_hash("本文2"), "3": comment_hash("本文3")}
+        extracted = load_checkpoint(str(path), fingerprint, hashes)
+
+        assert extracted == {"1": ["意見1"], "2": ["意見2a", "意見2b"]}
+
+    def test_ignores_comments_whose_body_changed(self, tmp_path):
+        """同じcomment-idでも本文が変わったコメントは復元せず、再度抽出させる"""
+        path = tmp_path / "extraction_checkpoint.jsonl"
+        fingerprint = checkpoint_fingerprint(CONFIG)
+        write_checkpoint(path, fingerprint, {1: "本文1", 2: "本文2"}, {1: ["意見1"], 2: ["意見2"]})
+
+        extracted = load_checkpoint(str(path), fingerprint, {"1": comment_hash("本文1"), "2": comment_hash("差し替え")})
+
+        assert extracted == {"1": ["意見1"]}
+
+    def test_discards_checkpoint_when_settings_changed(self, tmp_path):
+        path = tmp_path / "extraction_checkpoint.jsonl"
+        write_checkpoint(path, checkpoint_fingerprint(CONFIG), {1: "本文1"}, {1: ["意見1"]})
+        changed_config = {**CONFIG, "extraction": {**CONFIG["extraction"], "prompt": "別のプロンプト"}}
+
+        extracted = load_checkpoint(str(path), checkpoint_fingerprint(changed_config), {"1": comment_hash("本文1")})
+
+        assert extracted == {}
+        assert not path.exists()
+
+    def test_skips_broken_lines(self, tmp_path):
+        """書き込み途中でクラッシュした行は読み飛ばす"""
+        path = tmp_path / "extraction_checkpoint.jsonl"
+        fingerprint = checkpoint_fingerprint(CONFIG)
+        write_checkpoint(path, fingerprint, {1: "本文1"}, {1: ["意見1"]})
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"comment-id": 2, "body-ha')
+
+        extracted = load_checkpoint(str(path), fingerprint, {"1": comment_hash("本文1"), "2": comment_hash("本文2")})
+
+        assert extracted == {"1": ["意見1"]}
+
+    def test_remove_checkpoint(self, tmp_path):
+        path = tmp_path / "extraction_checkpoint.jsonl"
+        write_checkpoint(path, checkpoint_fingerprint(CONFIG), {1: "本文1"}, {1: ["意見1"]})
+
+        remove_checkpoint(str(path))
+        remove_checkpoint(str(path))
+
+        assert not path.exists()
+        assert load_checkpoint(str(path), checkpoint_fingerprint(CONFIG), {"1": comment_hash("本文1")}) == {}
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import Counter
+
+from broadlistening.pipeline.services.extraction_queue import MAX_ATTEMPTS, extract_stream
+
+
+class StubExtractor:
+    """抽出処理のスタブ。hang に含まれる本文は、最初の呼び出しだけ release されるまで応答しない"""
+
+    def __init__(self, hang: set[str] = frozenset(), fail: set[str] = frozenset()):
+        self.hang = hang
+        self.fail = fail
+        self.calls = Counter()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        with self._lock:
+            self.calls[text] += 1
+            first_call = self.calls[text] == 1
+        if text in self.fail:
+            raise RuntimeError("API error")
+        if text in self.hang and first_call:
+            self.release.wait(timeout=10)
+        return [f"意見:{text}"], 10, 5, 15
+
+
+class TestExtractStream:
+    """抽出ステップの作業キューのテスト"""
+
+    def test_returns_all_results_and_updates_tokens_as_consumed(self):
+        extractor = StubExtractor()
+        config = {}
+        inputs = [(i, f"本文{i}") for i in range(5)]
+
+        results = {}
+        for comment_id, items in extract_stream(inputs, extractor, workers=2, config=config):
+            results[comment_id] = items
+            # 全件の完了を待たず、結果を受け取るたびにトークン使用量が加算されている
+            assert config["total_token_usage"] == 15 * len(results)
+
+        assert results == {i: [f"意見:本文{i}"] for i in range(5)}
+        assert config["token_usage_input"] == 50
+        assert config["token_usage_output"] == 25
+        assert config["extraction_latency"]["count"] == 5
+
+    def test_gives_up_after_max_attempts(self):
+        extractor = StubExtractor(fail={"失敗"})
+
+        results = dict(extract_stream([(1, "失敗"), (2, "成功")], extractor, workers=1))
+
+        assert results == {1: None, 2: ["意見:成功"]}
+        assert extractor.calls["失敗"] == MAX_ATTEMPTS
+
+    def test_hanging_requests_do_not_time_out_queued_items(self):
+        """応答しないリクエストがスレッドを占有しても、後続のコメントは実行されずに時間切れにならない"""
+        extractor = StubExtractor(hang={"h1", "h2"})
+        inputs = [(1, "h1"), (2, "h2"), (3, "a"), (4, "b")]
+        # 打ち切ったリクエストがスレッドを使い切った後、しばらくして応答を返させる
+        timer = threading.Timer(2.0, extractor.release.set)
+        timer.start()
+        start = time.monotonic()
+        try:
+            results = dict(extract_stream(inputs, extractor, workers=1, item_timeout=0.2))
+        finally:
+            timer.cancel()
+            extractor.release.set()
+
+        assert results == {1: ["意見:h1"], 2: ["意見:h2"], 3: ["意見:a"], 4: ["意見:b"]}
+        # 後続のコメントは1回ずつしか実行されない（実行されないまま時間切れ・再投入されない）
+        assert extractor.calls["a"] == 1
+        assert extractor.calls["b"] == 1
+        assert time.monotonic() - start >= 2.0
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from broadlistening.pipeline.services.incremental import (
+    assign_to_existing_clusters,
+    find_changed_clusters,
+    incremental_clustering_fallback_reason,
+    is_compatible_clusters,
+    previous_step_params,
+)
+
+
+@pytest.fixture
+def previous_clusters():
+    """2つの上位クラスタ・4つの最下層クラスタに分かれた前回のクラスタリング結果"""
+    xy = np.array([[0, 0], [0, 1], [1, 0], [1, 1], [10, 10], [10, 11], [11, 10], [11, 11]], dtype=float)
+    return pd.DataFrame(
+        {
+            "arg-id": [f"A{i}" for i in range(8)],
+            "argument": [f"意見{i}" for i in range(8)],
+            "x": xy[:, 0],
+            "y": xy[:, 1],
+            "cluster-level-1-id": ["1_0"] * 4 + ["1_1"] * 4,
+            "cluster-level-2-id": ["2_0", "2_0", "2_1", "2_1", "2_2", "2_2", "2_3", "2_3"],
+        }
+    )
+
+
+class TestFindChangedClusters:
+    """差分更新時のクラスタ変化判定のテスト"""
+
+    def test_detects_clusters_over_threshold(self):
+        """意見の変化率が閾値を超えたクラスタと新規クラスタのみを返す"""
+        previous = pd.DataFrame(
+            {
+                "arg-id": [f"A{i}" for i in range(20)],
+                "cluster-level-1-id": ["1_1"] * 10 + ["1_2"] * 10,
+            }
+        )
+        current = pd.concat(
+            [
+                previous,
+                pd.DataFrame(
+                    {
+                        "arg-id": ["A20", "A21", "A22", "A23"],
+                        "cluster-level-1-id": ["1_1", "1_2", "1_2", "1_3"],
+                    }
+                ),
+            ]
+        )
+
+        changed = find_changed_clusters(previous, current, "cluster-level-1-id", threshold=0.1)
+
+        assert changed == {"1_2", "1_3"}
+
+    def test_removed_arguments_count_as_change(self):
+        """削除された意見も変化量に含める"""
+        previous = pd.DataFrame({"arg-id": ["A0", "A1", "A2"], "cluster-level-1-id": ["1_1"] * 3})
+        current = previous.iloc[:2]
+
+        assert find_changed_clusters(previous, current, "cluster-level-1-id", threshold=0.1) == {"1_1"}
+        assert find_changed_clusters(previous, current, "cluster-level-1-id", threshold=0.5) == set()
+
+
+class TestIsCompatibleClusters:
+    """前回のクラスタリング結果を差分更新で再利用できるかの判定のテスト"""
+
+    def test_same_cluster_nums(self, previous_clusters):
+        assert is_compatible_clusters(previous_clusters, [2, 4])
+        assert is_compatible_clusters(previous_clusters, [4, 2])
+
+    def test_upper_level_changed(self, previous_clusters):
+        """最下層のクラスタ数が同じでも、上位の階層のクラスタ数が変わった場合は全体再計算する"""
+        assert not is_compatible_clusters(previous_clusters, [3, 4])
+
+    def test_bottom_level_or_depth_changed(self, previous_clusters):
+        assert not is_compatible_clusters(previous_clusters, [2, 5])
+        assert not is_compatible_clusters(previous_clusters, [2, 4, 8])
+
+
+class TestAssignToExistingClusters:
+    """追加された意見を既存のクラスタに割り当てる処理のテスト"""
+
+    def test_assigns_new_arguments_to_nearest_cluster(self, previous_clusters):
+        """追加された意見は埋め込みが近い意見のクラスタに割り当てられ、上位の階層は親を引き継ぐ"""
+        # 前半4件と後半4件で向きの異なる埋め込み。追加する2件はそれぞれ A1, A6 と同じ向き
+        embeddings = np.array(
+            [[1, 0, 0]] * 2 + [[1, 0.1, 0]] * 2 + [[0, 1, 0]] * 2 + [[0, 1, 0.1]] * 2 + [[1, 0, 0], [0, 1, 0.1]],
+            dtype=np.float32,
+        )
+        arg_ids = [f"A{i}" for i in range(10)]
+        arguments = pd.DataFrame({"arg-id": arg_ids, "argument": [f"意見{i}" for i in range(10)]})
+
+        result = assign_to_existing_clusters(previous_clusters, arguments, embeddings, arg_ids)
+
+        assert result["arg-id"].tolist() == arg_ids
+        assert result.columns.tolist() == previous_clusters.columns.tolist()
+        pd.testing.assert_frame_equal(result.iloc[:8], previous_clusters)
+        added = result.iloc[8:].set_index("arg-id")
+        assert added.loc["A8", "cluster-level-1-id"] == "1_0"
+        assert added.loc["A9", "cluster-level-1-id"] == "1_1"
+        assert added.loc["A8", "cluster-level-2-id"] in {"2_0", "2_1"}
+        assert added.loc["A9", "cluster-level-2-id"] in {"2_2", "2_3"}
+        assert added.loc["A9", ["x", "y"]].tolist() == pytest.approx([10.5, 10.5], abs=0.5)
+
+    def test_removes_deleted_arguments(self, previous_clusters):
+        arguments = previous_clusters[["arg-id", "argument"]].drop(index=[0, 5])
+        embeddings = np.eye(8, dtype=np.float32)
+
+        result = assign_to_existing_clusters(previous_clusters, arguments, embeddings, [f"A{i}" for i in range(8)])
+
+        assert result["arg-id"].tolist() == ["A1", "A2", "A3", "A4", "A6", "A7"]
+
+
+CLUSTERING_OPTIONS = {
+    "cluster_nums": [2, 4],
+    "large_dataset_mode": "auto",
+    "large_dataset_threshold": 50000,
+    "pre_reduction_dim": 64,
+    "cluster_space": "umap",
+    "cluster_dim": 48,
+}
+
+
+class TestIncrementalClusteringFallback:
+    """差分更新で既存のクラスタに割り当てず、全体を再計算するかの判定のテスト"""
+
+    def test_assigns_when_nothing_changed(self, previous_clusters):
+        assert incremental_clustering_fallback_reason(previous_clusters, CLUSTERING_OPTIONS, CLUSTERING_OPTIONS) is None
+
+    def test_reduced_cluster_space_falls_back(self, previous_clusters):
+        """PCAで削減した空間で作ったクラスタには、2次元の座標で割り当てない"""
+        options = {**CLUSTERING_OPTIONS, "cluster_space": "reduced"}
+
+        assert incremental_clustering_fallback_reason(previous_clusters, options, options) is not None
+
+    @pytest.mark.parametrize(
+        "changed",
+        [
+            {"cluster_dim": 32},
+            {"pre_reduction_dim": 32},
+            {"large_dataset_mode": True},
+            {"large_dataset_threshold": 100},
+        ],
+    )
+    def test_changed_clustering_options_fall_back(self, previous_clusters, changed):
+        options = {**CLUSTERING_OPTIONS, **changed}
+
+        reason = incremental_clustering_fallback_reason(previous_clusters, options, CLUSTERING_OPTIONS)
+
+        assert reason is not None
+        assert next(iter(changed)) in reason
+
+    def test_cluster_nums_changed_falls_back(self, previous_clusters):
+        options = {**CLUSTERING_OPTIONS, "cluster_nums": [2, 5]}
+
+        assert incremental_clustering_fallback_reason(previous_clusters, options, CLUSTERING_OPTIONS) is not None
+
+    def test_unknown_previous_options_fall_back(self, previous_clusters):
+        assert incremental_clustering_fallback_reason(previous_clusters, CLUSTERING_OPTIONS, None) is not None
+
+    def test_previous_step_params(self):
+        config = {
+            "previous": {
+                "completed_jobs": [],
+                "previous": {
+                    # 前回の実行が失敗していた場合は、さらに前の実行の結果を使う
+                    "completed_jobs": [{"step": "embedding", "params": {"model": "m"}}],
+                    "previously_completed_jobs": [{"step": "hierarchical_clustering", "params": CLUSTERING_OPTIONS}],
+                },
+            }
+        }
+
+        assert previous_step_params(config, "hierarchical_clustering") == CLUSTERING_OPTIONS
+        assert previous_step_params(config, "extraction") is None
+        assert previous_step_params({}, "hierarchical_clustering") is None
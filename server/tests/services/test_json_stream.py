@@ -0,0 +1,49 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from broadlistening.pipeline.services.json_stream import JsonObjectWriter, json_default
+
+
+def _write(indent, values: dict, arrays: dict) -> str:
+    f = io.StringIO()
+    writer = JsonObjectWriter(f, indent=indent)
+    for key, items in arrays.items():
+        writer.write_array(key, iter(items))
+    for key, value in values.items():
+        writer.write(key, value)
+    writer.close()
+    return f.getvalue()
+
+
+class TestJsonObjectWriter:
+    """JSONの逐次書き出しのテスト"""
+
+    def test_indented_output_matches_json_dump(self):
+        """indent=2の出力はjson.dumpと同じ"""
+        arrays = {"arguments": [{"arg_id": "A1_0", "cluster_ids": ["0", "1_1"], "text": "改行\nを含む"}], "empty": []}
+        values = {"config": {"intro": "はじめに", "nested": {"list": [1, 2]}}, "comments": {}, "comment_num": 3}
+
+        text = _write(2, values, arrays)
+
+        assert text == json.dumps({**arrays, **values}, indent=2, ensure_ascii=False)
+
+    def test_compact_output(self):
+        text = _write(None, {"b": {"c": [1, 2]}}, {"a": [1, 2]})
+
+        assert text == '{"a":[1,2],"b":{"c":[1,2]}}'
+
+    def test_empty_object(self):
+        assert _write(2, {}, {}) == "{}"
+
+    def test_numpy_values(self):
+        """NumPyの型は事前に変換しなくても書き出せる"""
+        text = _write(None, {"v": {"i": np.int64(1), "f": np.float32(0.5), "b": np.bool_(True)}}, {"a": np.arange(2)})
+
+        assert json.loads(text) == {"a": [0, 1], "v": {"i": 1, "f": 0.5, "b": True}}
+
+    def test_json_default_rejects_unknown_types(self):
+        with pytest.raises(TypeError):
+            json_default(object())
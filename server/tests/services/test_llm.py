@@ -1,7 +1,8 @@
+import asyncio
 import os
 import sys
 import types
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import openai
 import pytest
@@ -14,7 +15,10 @@ from broadlistening.pipeline.services.llm import (
     request_to_azure_chatcompletion,
     request_to_azure_embed,  # noqa: F401
     request_to_chat_ai,
+    request_to_chat_ai_async,
     request_to_embed,  # noqa: F401
+    request_to_embed_async,
+    request_to_gemini_embed,
     request_to_openai,
 )
 
@@ -911,13 +915,13 @@ class TestLLMService:
                     request_to_chat_ai(messages=messages, model=model, provider="gemini")
 
     def test_request_to_embed_use_gemini(self):
-        """Geminiの埋め込みを使用するテストケース"""
+        """Geminiの埋め込みを使用するテストケース（複数のテキストを1回のリクエストで送る）"""
         args = ["hello", "world"]
         model = "models/embedding-001"
 
         genai_module = types.ModuleType("google.generativeai")
         configure_mock = MagicMock()
-        embed_content_mock = MagicMock(side_effect=[{"embedding": [0.1, 0.2]}, {"embedding": [0.3, 0.4]}])
+        embed_content_mock = MagicMock(return_value={"embedding": [[0.1, 0.2], [0.3, 0.4]]})
         genai_module.configure = configure_mock
         genai_module.embed_content = embed_content_mock
         google_module = types.ModuleType("google")
@@ -931,9 +935,54 @@ class TestLLMService:
 
         assert embeds == [[0.1, 0.2], [0.3, 0.4]]
         configure_mock.assert_called_once_with(api_key="test-api-key")
-        assert embed_content_mock.call_count == 2
-        embed_content_mock.assert_any_call(model=model, content="hello")
-        embed_content_mock.assert_any_call(model=model, content="world")
+        embed_content_mock.assert_called_once_with(model=model, content=["hello", "world"])
+
+    def test_request_to_gemini_embed_splits_batches_in_order(self):
+        """Geminiの埋め込み: 100件ずつのバッチに分けて並列に送り、入力順に結果を返す"""
+        args = [f"text-{i}" for i in range(250)]
+
+        def embed_content(model, content):
+            return {"embedding": [[float(text.split("-")[1])] for text in content]}
+
+        genai_module = types.ModuleType("google.generativeai")
+        genai_module.configure = MagicMock()
+        genai_module.embed_content = MagicMock(side_effect=embed_content)
+
+        with patch("broadlistening.pipeline.services.llm.genai", genai_module):
+            with patch.dict(os.environ, {"GEMINI_API_KEY": "test-api-key"}):
+                embeds = request_to_gemini_embed(args, "gemini-embedding-001")
+
+        assert embeds == [[float(i)] for i in range(250)]
+        batch_sizes = sorted(len(call.kwargs["content"]) for call in genai_module.embed_content.call_args_list)
+        assert batch_sizes == [50, 100, 100]
+
+    def test_request_to_gemini_embed_retries_rate_limit(self):
+        """Geminiの埋め込み: レート制限エラーはretry_delayだけ待ってリトライする"""
+
+        class GoogleAPICallError(Exception):
+            pass
+
+        class ResourceExhausted(GoogleAPICallError):
+            retry_delay = "2s"
+
+        google_excs = types.SimpleNamespace(GoogleAPICallError=GoogleAPICallError, ResourceExhausted=ResourceExhausted)
+        genai_module = types.ModuleType("google.generativeai")
+        genai_module.configure = MagicMock()
+        genai_module.embed_content = MagicMock(
+            side_effect=[ResourceExhausted("quota exceeded"), {"embedding": [[0.1], [0.2]]}]
+        )
+
+        with (
+            patch("broadlistening.pipeline.services.llm.genai", genai_module),
+            patch("broadlistening.pipeline.services.llm.google_exceptions", google_excs),
+            patch("broadlistening.pipeline.services.llm.time.sleep") as sleep_mock,
+            patch.dict(os.environ, {"GEMINI_API_KEY": "test-api-key"}),
+        ):
+            embeds = request_to_gemini_embed(["a", "b"], "gemini-embedding-001")
+
+        assert embeds == [[0.1], [0.2]]
+        assert genai_module.embed_content.call_count == 2
+        sleep_mock.assert_any_call(2)
 
     def test_extract_embedding_values_genai_object(self):
         """extract_embedding_values: genai SDKオブジェクト（response.embedding.values）を抽出できる"""
@@ -998,3 +1047,65 @@ class TestLLMService:
         response = {"data": []}
         values = extract_embedding_values(response)
         assert values is None
+
+
+class TestLLMClientPool:
+    """クライアントの使い回しと非同期APIのテスト"""
+
+    def test_sync_client_is_reused(self):
+        """同じプロバイダー・APIキーではクライアントを1度だけ生成する"""
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = "pooled"
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = mock_response
+        messages = [{"role": "user", "content": "Hello"}]
+
+        with patch("broadlistening.pipeline.services.llm.OpenAI", return_value=mock_client) as mock_openai:
+            request_to_openai(messages, model="gpt-4o", user_api_key="key-a")
+            request_to_openai(messages, model="gpt-4o", user_api_key="key-a")
+            request_to_openai(messages, model="gpt-4o", user_api_key="key-b")
+
+        assert mock_openai.call_count == 2
+        assert mock_client.chat.completions.create.call_count == 3
+
+    def test_request_to_chat_ai_async(self):
+        """request_to_chat_ai_async: 非同期クライアントを共有して並行にリクエストできる"""
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = "async response"
+        mock_response.usage.prompt_tokens = 10
+        mock_response.usage.completion_tokens = 5
+        mock_response.usage.total_tokens = 15
+        mock_client = MagicMock()
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+
+        async def run():
+            return await asyncio.gather(
+                *[
+                    request_to_chat_ai_async(
+                        messages=[{"role": "user", "content": f"Hello {i}"}], model="gpt-4o", provider="openai"
+                    )
+                    for i in range(5)
+                ]
+            )
+
+        with patch("broadlistening.pipeline.services.llm.AsyncOpenAI", return_value=mock_client) as mock_async_openai:
+            results = asyncio.run(run())
+
+        assert results == [("async response", 10, 5, 15)] * 5
+        mock_async_openai.assert_called_once_with()
+        assert mock_client.chat.completions.create.await_count == 5
+
+    def test_request_to_embed_async(self):
+        """request_to_embed_async: OpenAIの埋め込みを非同期に取得できる"""
+        mock_item = MagicMock()
+        mock_item.embedding = [0.1, 0.2, 0.3]
+        mock_client = MagicMock()
+        mock_client.embeddings.create = AsyncMock(return_value=MagicMock(data=[mock_item]))
+
+        with patch("broadlistening.pipeline.services.llm.AsyncOpenAI", return_value=mock_client):
+            embeds = asyncio.run(request_to_embed_async(["text"], "text-embedding-3-small", provider="openai"))
+
+        assert embeds == [[0.1, 0.2, 0.3]]
+        mock_client.embeddings.create.assert_awaited_once_with(input=["text"], model="text-embedding-3-small")
@@ -0,0 +1,146 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pydantic import BaseModel
+
+from broadlistening.pipeline.services import llm_cache
+from broadlistening.pipeline.services.llm import request_to_chat_ai
+from broadlistening.pipeline.services.llm_cache import LLMResponseCache
+
+
+class ResponseModel(BaseModel):
+    label: str
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMResponseCache(tmp_path / "llm_responses.sqlite3")
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def enabled_cache(tmp_path):
+    cache = llm_cache.configure_llm_cache(tmp_path / "llm_responses.sqlite3")
+    yield cache
+    llm_cache.disable_llm_cache()
+
+
+class TestLLMResponseCache:
+    """LLMレスポンスキャッシュのテスト"""
+
+    def test_make_key_is_stable_and_content_addressed(self):
+        """同じ内容なら同じキー、内容が異なれば異なるキーになる"""
+        messages = [{"role": "user", "content": "こんにちは"}]
+        key1 = LLMResponseCache.make_key("openai", "gpt-4o-mini", messages, ResponseModel)
+        key2 = LLMResponseCache.make_key("openai", "gpt-4o-mini", list(messages), ResponseModel)
+        assert key1 == key2
+        assert key1 != LLMResponseCache.make_key("openai", "gpt-4o", messages, ResponseModel)
+        assert key1 != LLMResponseCache.make_key("gemini", "gpt-4o-mini", messages, ResponseModel)
+        assert key1 != LLMResponseCache.make_key("openai", "gpt-4o-mini", messages, None)
+
+    def test_get_and_set(self, cache):
+        """保存したレスポンスを取得でき、ヒット・ミス数が記録される"""
+        assert cache.get("missing") is None
+        cache.set("key", {"label": "ラベル"})
+        assert cache.get("key") == {"label": "ラベル"}
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["entries"] == 1
+
+    def test_evicts_least_recently_used_entries(self, tmp_path):
+        """上限サイズを超えた場合は参照が古いエントリから削除される"""
+        cache = LLMResponseCache(tmp_path / "small.sqlite3", max_bytes=100)
+        try:
+            cache.set("a", "x" * 30)
+            cache.set("b", "y" * 30)
+            cache.get("a")
+            cache.set("c", "z" * 30)
+
+            assert cache.get("b") is None
+            assert cache.get("a") == "x" * 30
+            assert cache.get("c") == "z" * 30
+            assert cache.stats()["evictions"] == 1
+            assert cache.stats()["size_bytes"] <= 100
+        finally:
+            cache.close()
+
+    def test_tracks_total_size_without_scanning(self, tmp_path):
+        """合計サイズは保存・置き換え・削除に合わせて meta テーブルで更新され、別の接続からも正しい値になる"""
+        path = tmp_path / "llm_responses.sqlite3"
+        cache = LLMResponseCache(path, max_bytes=100)
+        other = LLMResponseCache(path, max_bytes=100)
+        try:
+            cache.set("a", "x" * 30)
+            cache.set("a", "x" * 10)
+            other.set("b", "y" * 30)
+            cache.set("c", "z" * 50)
+
+            (actual,) = cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            assert cache.stats()["size_bytes"] == actual <= 100
+            assert other.stats()["size_bytes"] == actual
+        finally:
+            other.close()
+            cache.close()
+
+    def test_existing_file_without_meta_table(self, tmp_path):
+        """合計サイズを保持する前のファイルは、開いた際に一度だけ集計する"""
+        path = tmp_path / "llm_responses.sqlite3"
+        cache = LLMResponseCache(path)
+        cache.set("a", "x" * 30)
+        cache._conn.executescript(
+            """
+            DROP TABLE meta;
+            DROP TRIGGER responses_total_size_insert;
+            DROP TRIGGER responses_total_size_delete;
+            DROP TRIGGER responses_total_size_update;
+            """
+        )
+        cache.close()
+
+        cache = LLMResponseCache(path)
+        try:
+            assert cache.stats()["size_bytes"] == len('{"response": "' + "x" * 30 + '"}')
+        finally:
+            cache.close()
+
+    def test_hits_are_touched_in_batches(self, tmp_path):
+        """ヒット時の参照時刻の更新はまとめて書き込まれ、閉じる際にも書き込まれる"""
+        path = tmp_path / "llm_responses.sqlite3"
+        cache = LLMResponseCache(path)
+        cache.set("a", "x")
+        (before,) = cache._conn.execute("SELECT accessed_at FROM responses").fetchone()
+
+        with patch.object(llm_cache.time, "time", return_value=before + 100):
+            cache.get("a")
+        assert cache._conn.execute("SELECT accessed_at FROM responses").fetchone()[0] == before
+        cache.close()
+
+        cache = LLMResponseCache(path)
+        try:
+            assert cache._conn.execute("SELECT accessed_at FROM responses").fetchone()[0] == before + 100
+        finally:
+            cache.close()
+
+    def test_request_to_chat_ai_uses_cache(self, enabled_cache):
+        """キャッシュ有効時、同一リクエストの2回目はプロバイダーを呼ばずトークン使用量0で返す"""
+        messages = [{"role": "user", "content": "Hello"}]
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = "cached response"
+        mock_response.usage.prompt_tokens = 10
+        mock_response.usage.completion_tokens = 5
+        mock_response.usage.total_tokens = 15
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = mock_response
+
+        with patch("broadlistening.pipeline.services.llm.OpenAI", return_value=mock_client):
+            first = request_to_chat_ai(messages=messages, model="gpt-4o-mini", provider="openai")
+            second = request_to_chat_ai(messages=messages, model="gpt-4o-mini", provider="openai")
+
+        assert first == ("cached response", 10, 5, 15)
+        assert second == ("cached response", 0, 0, 0)
+        assert mock_client.chat.completions.create.call_count == 1
+        assert enabled_cache.stats()["hits"] == 1
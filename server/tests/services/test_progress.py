@@ -0,0 +1,31 @@
+from broadlistening.pipeline.services.progress import PROGRESS_FILENAME, read_progress, write_progress
+
+
+class TestProgress:
+    """パイプラインの進捗ファイルのテスト"""
+
+    def test_write_and_read_progress(self, tmp_path):
+        config = {
+            "status": "running",
+            "current_job": "extraction",
+            "current_job_progress": 10,
+            "current_jop_tasks": 100,
+            "total_token_usage": 1234,
+            "completed_jobs": [{"step": "embedding", "params": {"source_code": "..."}}],
+            "extraction": {"prompt": "長いプロンプト", "source_code": "..."},
+        }
+
+        write_progress(tmp_path, config)
+        progress = read_progress(tmp_path)
+
+        assert progress["current_job"] == "extraction"
+        assert progress["current_job_progress"] == 10
+        assert progress["current_jop_tasks"] == 100
+        assert progress["total_token_usage"] == 1234
+        assert progress["completed_jobs"] == ["embedding"]
+        assert "extraction" not in progress
+        assert "updated_at" in progress
+        assert [path.name for path in tmp_path.iterdir()] == [PROGRESS_FILENAME]
+
+    def test_read_missing_progress(self, tmp_path):
+        assert read_progress(tmp_path) is None
@@ -0,0 +1,183 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import httpx
+import openai
+
+from broadlistening.pipeline.services.rate_limiter import (
+    DEFAULT_LIMITS,
+    RateLimiter,
+    default_limits,
+    estimate_tokens,
+    get_rate_limiter,
+    parse_duration,
+    reset_rate_limiters,
+)
+
+
+class TestRateLimiter:
+    """レートリミッターのテスト"""
+
+    def test_no_limits_never_waits(self):
+        """上限値が不明な場合は待たない"""
+        limiter = RateLimiter()
+        start = time.monotonic()
+        for _ in range(1000):
+            limiter.acquire(10_000)
+        assert time.monotonic() - start < 0.5
+        assert limiter.waited_seconds == 0
+
+    def test_requests_per_minute_budget(self):
+        """RPMの予算（バースト分）を使い切ると、補充されるまで待つ"""
+        limiter = RateLimiter(rpm=600)  # 10リクエスト/秒、バーストは100リクエストまで
+        for _ in range(100):
+            limiter.acquire()
+        assert limiter.waited_seconds == 0
+
+        start = time.monotonic()
+        limiter.acquire()
+        assert time.monotonic() - start >= 0.05
+        assert limiter.waited_seconds > 0
+
+    def test_tokens_are_corrected_with_actual_usage(self):
+        """見積もりより実際の使用量が多い場合は、その分だけ予算を消費する"""
+        limiter = RateLimiter(tpm=6000)  # バーストは1000トークンまで
+        response = MagicMock()
+        response.usage.total_tokens = 900
+        limiter.call(lambda: response, 100)
+        assert limiter.tokens.level <= 100 + 1
+
+    def test_learns_limits_from_rate_limit_headers(self):
+        """429のレスポンスヘッダから上限値と待機時間を学習し、送信レートを下げる"""
+        limiter = RateLimiter()
+        response = MagicMock()
+        response.headers = {
+            "x-ratelimit-limit-requests": "500",
+            "x-ratelimit-limit-tokens": "30000",
+            "retry-after": "2",
+        }
+        error = openai.RateLimitError(message="Rate limit exceeded", response=response, body=None)
+
+        def fail():
+            raise error
+
+        try:
+            limiter.call(fail, 10)
+        except openai.RateLimitError:
+            pass
+
+        assert limiter.requests.limit_per_minute == 500
+        assert limiter.tokens.limit_per_minute == 30000
+        assert limiter.rate_factor == 0.5
+        assert limiter.paused_until - time.monotonic() > 1.5
+
+    def test_mock_headers_are_ignored(self):
+        """ヘッダが文字列でない場合（テスト用のモックなど）は無視する"""
+        limiter = RateLimiter()
+        limiter.record_rate_limited(MagicMock())
+        assert limiter.requests.limit_per_minute is None
+        assert limiter.paused_until == 0
+
+    def test_estimate_and_parse_duration(self):
+        assert estimate_tokens("あいうえお") == 5
+        assert estimate_tokens([{"role": "user", "content": "hello"}]) > 0
+        assert parse_duration("6m0s") == 360
+        assert parse_duration("20ms") == 0.02
+        assert parse_duration("1.5") == 1.5
+
+
+def chat_completion_json() -> dict:
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+def openai_client(headers: dict[str, str]) -> openai.OpenAI:
+    """指定したレスポンスヘッダで成功レスポンスを返すOpenAIクライアント"""
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json=chat_completion_json(), headers=headers))
+    return openai.OpenAI(api_key="test", http_client=httpx.Client(transport=transport))
+
+
+class TestAdaptiveLimits:
+    """既定の予算と、成功したレスポンスのヘッダからの学習のテスト"""
+
+    def test_default_limits_by_provider_and_model(self):
+        assert default_limits("openai", "gpt-4o-mini-2024-07-18") == (500, 200_000)
+        assert default_limits("openai", "gpt-4o") == (500, 30_000)
+        assert default_limits("openai", "text-embedding-3-small") == (3000, 1_000_000)
+        assert default_limits("openai", "unknown-model") == DEFAULT_LIMITS["openai"][""]
+        assert default_limits("gemini", "gemini-2.0-flash") == (2000, 4_000_000)
+        assert default_limits("azure", "my-deployment") == (None, None)
+        assert default_limits("local", None) == (None, None)
+
+    def test_shared_limiter_uses_defaults_unless_configured(self, monkeypatch):
+        monkeypatch.delenv("OPENAI_RPM_LIMIT", raising=False)
+        monkeypatch.delenv("LLM_RPM_LIMIT", raising=False)
+        monkeypatch.setenv("OPENAI_TPM_LIMIT", "1000")
+        reset_rate_limiters()
+        try:
+            limiter = get_rate_limiter("openai", "gpt-4o-mini")
+            assert limiter.requests.limit_per_minute == 500
+            assert limiter.tokens.limit_per_minute == 1000
+        finally:
+            reset_rate_limiters()
+
+    def test_learns_limits_from_successful_response_headers(self):
+        """429を待たずに、成功したレスポンスのヘッダから上限値を学習する"""
+        client = openai_client({"x-ratelimit-limit-requests": "10000", "x-ratelimit-limit-tokens": "2000000"})
+        limiter = RateLimiter(default_rpm=500, default_tpm=30_000)
+
+        response = limiter.call(client.chat.completions.create, 10, model="gpt-4o-mini", messages=[])
+
+        # 戻り値は通常どおりパース済みのレスポンス
+        assert response.choices[0].message.content == "ok"
+        assert response.usage.total_tokens == 15
+        assert limiter.requests.limit_per_minute == 10000
+        assert limiter.tokens.limit_per_minute == 2_000_000
+        assert limiter.rate_limited_count == 0
+
+    def test_learned_limits_do_not_exceed_configured_limits(self):
+        client = openai_client({"x-ratelimit-limit-requests": "10000", "x-ratelimit-limit-tokens": "2000000"})
+        limiter = RateLimiter(rpm=100)
+
+        limiter.call(client.chat.completions.create, 10, model="gpt-4o-mini", messages=[])
+
+        assert limiter.requests.limit_per_minute == 100
+        assert limiter.tokens.limit_per_minute == 2_000_000
+
+    def test_pauses_until_reset_when_remaining_is_exhausted(self):
+        """残量が0になったら、429を受ける前にリセットまで送信を待たせる"""
+        client = openai_client(
+            {
+                "x-ratelimit-limit-requests": "500",
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": "2s",
+            }
+        )
+        limiter = RateLimiter()
+
+        limiter.call(client.chat.completions.create, 10, model="gpt-4o-mini", messages=[])
+
+        assert limiter.requests.level <= 0
+        assert limiter.paused_until - time.monotonic() > 1.5
+        assert limiter.rate_limited_count == 0
+
+    def test_waited_seconds_is_counted_across_threads(self):
+        limiter = RateLimiter(rpm=60)  # 1リクエスト/秒、バーストは10リクエストまで
+        for _ in range(10):
+            limiter.acquire()
+        limiter.paused_until = time.monotonic() + 0.2
+
+        threads = [threading.Thread(target=limiter.acquire) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert limiter.waited_seconds >= 0.4
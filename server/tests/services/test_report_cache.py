@@ -0,0 +1,127 @@
+import gzip
+import json
+import os
+
+import orjson
+
+from src.services.report_cache import ReportResultCache, etag_matches, select_encoding
+
+
+def _write(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+class TestReportResultCache:
+    """レポート結果のメモリキャッシュのテスト"""
+
+    def test_returns_serialized_result_with_visibility(self, tmp_path):
+        path = tmp_path / "hierarchical_result.json"
+        _write(path, {"overview": "概要", "arguments": []})
+        cache = ReportResultCache(max_bytes=1024 * 1024)
+
+        result = cache.get(path, "public")
+
+        assert orjson.loads(result.body) == {"overview": "概要", "arguments": [], "visibility": "public"}
+        assert cache.get(path, "public") is result
+        assert cache.stats()["hits"] == 1
+
+    def test_reloads_when_file_changes(self, tmp_path):
+        path = tmp_path / "hierarchical_result.json"
+        _write(path, {"overview": "古い"})
+        cache = ReportResultCache(max_bytes=1024 * 1024)
+        cache.get(path, "public")
+
+        _write(path, {"overview": "新しい概要"})
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert orjson.loads(cache.get(path, "public").body)["overview"] == "新しい概要"
+
+    def test_visibility_change_and_invalidate(self, tmp_path):
+        report_dir = tmp_path / "my-report"
+        report_dir.mkdir()
+        path = report_dir / "hierarchical_result.json"
+        _write(path, {"overview": "概要"})
+        cache = ReportResultCache(max_bytes=1024 * 1024)
+        cache.get(path, "public")
+
+        assert orjson.loads(cache.get(path, "unlisted").body)["visibility"] == "unlisted"
+
+        cache.invalidate("my-report")
+        assert cache.stats()["entries"] == 0
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        paths = []
+        for i in range(3):
+            path = tmp_path / f"{i}.json"
+            _write(path, {"overview": "x" * 100})
+            paths.append(path)
+        entry_size = ReportResultCache(max_bytes=1024).get(paths[0], "public").size
+        cache = ReportResultCache(max_bytes=entry_size * 2)
+
+        cache.get(paths[0], "public")
+        cache.get(paths[1], "public")
+        cache.get(paths[0], "public")
+        cache.get(paths[2], "public")
+
+        assert cache.stats()["entries"] == 2
+        cache.get(paths[0], "public")
+        assert cache.stats()["misses"] == 3
+
+    def test_nan_is_returned_as_null(self, tmp_path):
+        """NaNを含むパイプラインの出力も返せる"""
+        path = tmp_path / "hierarchical_result.json"
+        path.write_text('{"clusters": [{"density_rank_percentile": NaN}]}', encoding="utf-8")
+
+        result = ReportResultCache(max_bytes=1024).get(path, "public")
+
+        assert orjson.loads(result.body)["clusters"][0]["density_rank_percentile"] is None
+
+    def test_precompressed_representations(self, tmp_path):
+        """gzipで圧縮済みの表現を持ち、表現ごとに異なる強いETagを返す"""
+        path = tmp_path / "hierarchical_result.json"
+        _write(path, {"arguments": [{"argument": "意見"}] * 100})
+
+        result = ReportResultCache(max_bytes=1024 * 1024).get(path, "public")
+        gzip_body, gzip_etag = result.representation("gzip")
+        identity_body, identity_etag = result.representation("identity")
+
+        assert gzip.decompress(gzip_body) == result.body
+        assert len(gzip_body) < len(result.body)
+        assert identity_body is result.body
+        assert identity_etag.startswith('"') and not identity_etag.startswith("W/")
+        assert gzip_etag != identity_etag
+
+    def test_etag_changes_with_visibility(self, tmp_path):
+        path = tmp_path / "hierarchical_result.json"
+        _write(path, {"overview": "概要"})
+        cache = ReportResultCache(max_bytes=1024 * 1024)
+
+        assert cache.get(path, "public").etag != cache.get(path, "unlisted").etag
+
+    def test_large_result_is_not_compressed(self, tmp_path):
+        path = tmp_path / "hierarchical_result.json"
+        _write(path, {"overview": "x" * 100})
+
+        result = ReportResultCache(max_bytes=10).get(path, "public")
+
+        assert result.encoded == {}
+        assert result.representation("gzip") == (result.body, result.etag)
+
+
+class TestSelectEncoding:
+    def test_select_encoding(self):
+        assert select_encoding("gzip, deflate", available=("gzip",)) == "gzip"
+        assert select_encoding("gzip, br", available=("br", "gzip")) == "br"
+        assert select_encoding("gzip;q=1.0, br;q=0.5", available=("br", "gzip")) == "gzip"
+        assert select_encoding("gzip;q=0", available=("gzip",)) == "identity"
+        assert select_encoding("*", available=("gzip",)) == "gzip"
+        assert select_encoding("", available=("gzip",)) == "identity"
+
+    def test_etag_matches(self):
+        assert etag_matches('"abc"', '"abc"')
+        assert etag_matches('"x", W/"abc"', '"abc"')
+        assert etag_matches("*", '"abc"')
+        assert not etag_matches('"abc-gzip"', '"abc"')
+        assert not etag_matches("", '"abc"')
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from src.services import report_progress
+from src.services.report_progress import build_step_progress, get_step_progress, iter_progress_events
+
+
+def _write(path, data):
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+
+@pytest.fixture
+def report_dir(tmp_path):
+    report_dir = tmp_path / "my-report"
+    report_dir.mkdir()
+    report_progress._cache.clear()
+    with patch("src.services.report_progress.settings.REPORT_DIR", tmp_path):
+        yield report_dir
+
+
+class TestReportProgress:
+    """作成中のレポートの進捗の読み込みのテスト"""
+
+    def test_build_step_progress(self):
+        progress = build_step_progress(
+            {
+                "status": "running",
+                "current_job": "extraction",
+                "current_job_progress": 5,
+                "current_jop_tasks": 10,
+                "completed_jobs": [{"step": "embedding", "params": {}}],
+                "total_token_usage": 100,
+            }
+        )
+
+        assert progress["current_step"] == "extraction"
+        assert progress["current_step_progress"] == 5
+        assert progress["current_step_tasks"] == 10
+        assert progress["completed_steps"] == ["embedding"]
+        assert progress["token_usage"] == 100
+        assert build_step_progress({"status": "completed", "current_job": "x"})["current_step"] == "completed"
+        assert build_step_progress({"status": "running", "current_job": ""})["current_step"] == "loading"
+
+    def test_prefers_progress_file_and_reuses_result_until_it_changes(self, report_dir):
+        _write(report_dir / "hierarchical_status.json", {"status": "running", "current_job": "embedding"})
+        _write(report_dir / "hierarchical_progress.json", {"status": "running", "current_job": "extraction"})
+
+        first = get_step_progress("my-report")
+        with patch("builtins.open", side_effect=AssertionError("should not read the file")):
+            second = get_step_progress("my-report")
+
+        _write(report_dir / "hierarchical_progress.json", {"status": "running", "current_job": "embedding"})
+        stat = (report_dir / "hierarchical_progress.json").stat()
+        os.utime(report_dir / "hierarchical_progress.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert first["current_step"] == "extraction"
+        assert second is first
+        assert get_step_progress("my-report")["current_step"] == "embedding"
+
+    def test_falls_back_to_status_file(self, report_dir):
+        assert get_step_progress("my-report") == {"current_step": "loading"}
+
+        _write(report_dir / "hierarchical_status.json", {"status": "running", "current_job": "embedding"})
+
+        assert get_step_progress("my-report")["current_step"] == "embedding"
+
+    def test_iter_progress_events_stops_when_pipeline_finishes(self, report_dir):
+        _write(
+            report_dir / "hierarchical_progress.json",
+            {"status": "completed", "current_job": "hierarchical_aggregation"},
+        )
+
+        async def is_disconnected():
+            return False
+
+        async def collect():
+            return [event async for event in iter_progress_events("my-report", is_disconnected, poll_interval=0)]
+
+        events = asyncio.run(collect())
+
+        assert len(events) == 1
+        assert events[0].startswith("event: progress\ndata: ")
+        assert json.loads(events[0].split("data: ", 1)[1])["current_step"] == "completed"
@@ -226,3 +226,104 @@ class TestAddAnalysisData:
         updated = add_analysis_data(processing_report)
         assert updated == processing_report
         assert updated.analysis is None
+
+
+class TestLoadStatusAsReports:
+    """report_status.jsonの読み込みのテスト"""
+
+    @staticmethod
+    def _status(title: str) -> dict:
+        return {
+            "my-report": {
+                "slug": "my-report",
+                "status": "ready",
+                "title": title,
+                "description": "説明",
+                "visibility": "public",
+            }
+        }
+
+    def test_reuses_reports_until_file_changes(self, tmp_path):
+        from src.services import report_status
+
+        state_file = tmp_path / "report_status.json"
+        state_file.write_text(json.dumps(self._status("タイトル")), encoding="utf-8")
+
+        with patch("src.services.report_status.STATE_FILE", state_file):
+            first = report_status.load_status_as_reports()
+            with patch("builtins.open", side_effect=AssertionError("should not read the file")):
+                second = report_status.load_status_as_reports()
+
+            state_file.write_text(json.dumps(self._status("新しいタイトル")), encoding="utf-8")
+            third = report_status.load_status_as_reports()
+
+        assert first[0] is second[0]
+        assert third[0].title == "新しいタイトル"
+
+    def test_rebuilds_reports_on_mutation_without_rereading(self, tmp_path):
+        """自身の更新ではファイルを読み込み直さず、メモリ上の状態からReportを作り直す"""
+        from src.services import report_status
+
+        state_file = tmp_path / "report_status.json"
+        state_file.write_text(json.dumps(self._status("タイトル")), encoding="utf-8")
+
+        with patch("src.services.report_status.STATE_FILE", state_file):
+            report_status.load_status()
+            first = report_status.load_status_as_reports()
+            report_status.set_status("my-report", "error")
+            with patch("src.services.report_status._read_state_file", side_effect=AssertionError("should not reload")):
+                second = report_status.load_status_as_reports()
+
+        assert first[0].status == ReportStatus.READY
+        assert second[0].status == ReportStatus.ERROR
+
+
+class TestReportStatusJournal:
+    """レポートごとの更新をジャーナルに追記する保存処理のテスト"""
+
+    @pytest.fixture
+    def state_file(self, tmp_path):
+        from src.services import report_status
+
+        state_file = tmp_path / "report_status.json"
+        state_file.write_text(json.dumps(TestLoadStatusAsReports._status("タイトル")), encoding="utf-8")
+        with patch("src.services.report_status.STATE_FILE", state_file):
+            report_status.load_status()
+            yield state_file
+
+    def test_update_appends_to_journal_without_rewriting_state_file(self, state_file):
+        from src.services import report_status
+
+        before = state_file.read_text(encoding="utf-8")
+        report_status.set_status("my-report", "error")
+
+        journal = state_file.with_name("report_status.journal.jsonl").read_text(encoding="utf-8").splitlines()
+        assert state_file.read_text(encoding="utf-8") == before
+        assert len(journal) == 1
+        assert json.loads(journal[0])["report"]["status"] == "error"
+
+    def test_load_replays_journal_and_compacts(self, state_file):
+        from src.services import report_status
+
+        report_status.set_status("my-report", "error")
+        journal_file = state_file.with_name("report_status.journal.jsonl")
+        # 追記の途中で停止した行は無視される
+        with open(journal_file, "a", encoding="utf-8") as f:
+            f.write('{"slug": "my-report", "rep')
+
+        report_status.load_status()
+
+        assert report_status.get_status("my-report") == "error"
+        assert json.loads(state_file.read_text(encoding="utf-8"))["my-report"]["status"] == "error"
+        assert not journal_file.exists()
+
+    def test_compacts_when_journal_exceeds_threshold(self, state_file):
+        from src.services import report_status
+
+        with patch("src.services.report_status.COMPACTION_THRESHOLD", 2):
+            for status in ["processing", "error", "ready"]:
+                report_status.set_status("my-report", status)
+
+        assert json.loads(state_file.read_text(encoding="utf-8"))["my-report"]["status"] == "ready"
+        assert not state_file.with_name("report_status.journal.jsonl").exists()
+        assert not state_file.with_name("report_status.json.tmp").exists()